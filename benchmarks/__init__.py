@@ -0,0 +1,6 @@
+"""jsonapi-query benchmarks.
+
+Benchmarks generate their own SQLite databases and are run as modules::
+
+    python -m benchmarks.concurrent_count --rows 100000
+"""
@@ -0,0 +1,70 @@
+"""Benchmark the NumPy columnar adapter against SQLite.
+
+::
+
+    python -m benchmarks.columnar --rows 100000 --rows 1000000
+"""
+from benchmarks.models import *
+from jsonapiquery.database.numpy import ColumnarDataset
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import argparse
+import jsonapiquery
+
+
+DRIVERS = [
+    DriverSchemaMarshmallow(ArticleSchema()), DriverModelSQLAlchemy(Article)]
+COLUMNS = ['id', 'title', 'status', 'views', 'author_id']
+SHAPES = {
+    'eq filter, sorted page': {
+        'filter[status]': 'open', 'sort': '-views', 'page[limit]': '50'},
+    'ilike filter': {'filter[title]': 'ilike:99', 'page[limit]': '50'},
+    'range filter, multi-key sort': {
+        'filter[views]': 'gte:50000', 'sort': 'status,-views,title',
+        'page[offset]': '1000', 'page[limit]': '50'},
+    'in filter': {'filter[views]': 'in:' + ','.join(
+        str(value) for value in range(0, 100000, 97))},
+}
+
+
+def execute(query, params):
+    query, _ = jsonapiquery.filter_query(query, params, DRIVERS)
+    query, _ = jsonapiquery.sort_query(query, params, DRIVERS)
+    total = query.count()
+    query, _ = jsonapiquery.paginate_query(query, params)
+    return total, query.all()
+
+
+def run(rows, repeat):
+    engine = make_engine()
+    populate(engine, articles=rows, authors=1000, tags=1, comments=0)
+    session = make_session_factory(engine)()
+
+    table = Article.__table__
+    records = engine.execute(
+        table.select().with_only_columns([table.c[name] for name in COLUMNS]))
+    dataset = ColumnarDataset.from_records(records, COLUMNS)
+
+    report_header('columnar vs sqlite ({} rows)'.format(rows))
+    for name, params in SHAPES.items():
+        report('sqlite: ' + name, measure(
+            lambda: execute(session.query(Article), params), repeat))
+        report('numpy: ' + name, measure(
+            lambda: execute(dataset.query(), params), repeat))
+
+    columns = {
+        name: column.values
+        for name, column in dataset.snapshot.columns.items()}
+    report('numpy: reload', measure(
+        lambda: dataset.reload(columns), max(repeat // 4, 1), warmup=0))
+    session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, action='append')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    for rows in args.rows or [100000, 1000000]:
+        run(rows, args.repeat)
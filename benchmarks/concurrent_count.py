@@ -0,0 +1,63 @@
+"""Benchmark sequential and concurrent count and page-fetch execution.
+
+::
+
+    python -m benchmarks.concurrent_count --rows 100000
+"""
+from benchmarks.models import *
+from jsonapiquery.database.sqlalchemy import count_query, execute_query
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import argparse
+import jsonapiquery
+
+
+DRIVERS = [
+    DriverSchemaMarshmallow(ArticleSchema()), DriverModelSQLAlchemy(Article)]
+
+
+def run(rows, repeat, latency):
+    engine = make_engine()
+    populate(engine, articles=rows, comments=0)
+    simulate_latency(engine, latency)
+    Session = make_session_factory(engine)
+
+    params = {'filter[views]': 'gt:100', 'sort': '-views', 'page[limit]': '50'}
+    base_url = 'http://localhost/articles'
+
+    def build(session):
+        query = session.query(Article)
+        query, _ = jsonapiquery.filter_query(query, params, DRIVERS)
+        query, _ = jsonapiquery.sort_query(query, params, DRIVERS)
+        return query
+
+    def sequential():
+        session = Session()
+        query = build(session)
+        total = count_query(query)
+        page, paginators = jsonapiquery.paginate_query(query, params)
+        page.all()
+        jsonapiquery.make_pagination_links(
+            base_url, paginators, dict(params), total)
+        session.close()
+
+    def concurrent():
+        session = Session()
+        execute_query(build(session), params, base_url, Session)
+        session.close()
+
+    report_header('count + page ({} rows, {}ms latency)'.format(rows, latency))
+    report('sequential', measure(sequential, repeat))
+    report('concurrent', measure(concurrent, repeat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='Simulated network latency per statement in milliseconds.')
+    args = parser.parse_args()
+    run(args.rows, args.repeat, args.latency)
@@ -0,0 +1,65 @@
+"""Benchmark `in:` filters over lists of 10, 1k and 50k ids.
+
+Each list is filtered both with a plain `column.in_` clause, binding one
+parameter per value, and with the adapter's size-aware `in` strategy.
+Compile and execution times are reported separately.  Plain clauses
+over more values than SQLite's bind variable limit fail and are
+reported as such.
+
+::
+
+    python -m benchmarks.in_values --sizes 10 1000 50000
+"""
+from benchmarks.models import *
+from jsonapiquery.drivers.model.sqlalchemy import InValues
+
+import argparse
+import random
+
+
+def run(sizes, rows, repeat):
+    engine = make_engine()
+    populate(engine, articles=rows, authors=100, tags=10, comments=0)
+    Session = make_session_factory(engine)
+    session = Session()
+
+    variants = [
+        ('in_', lambda values: Article.id.in_(values)),
+        ('in strategy', lambda values: InValues(Article.id, values)),
+        ('~in strategy', lambda values: InValues(
+            Article.id, values, negate=True)),
+    ]
+
+    report_header('in: filters over {} rows'.format(rows))
+    rng = random.Random(0)
+    for size in sizes:
+        values = [rng.randint(1, rows * 2) for _ in range(size)]
+        for name, make_clause in variants:
+            query = session.query(Article.id).filter(make_clause(values))
+
+            def compile_():
+                str(query.statement.compile(engine))
+
+            def execute():
+                query.all()
+
+            label = '{} values {}'.format(size, name)
+            report('{} compile'.format(label), measure(compile_, repeat))
+            try:
+                report('{} execute'.format(label), measure(execute, repeat))
+            except Exception as exc:
+                session.rollback()
+                print('{:<40} failed: {}'.format(
+                    '{} execute'.format(label), type(exc).__name__))
+    session.close()
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10, 1000, 50000])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(args.sizes, args.rows, args.repeat)
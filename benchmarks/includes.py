@@ -0,0 +1,72 @@
+"""Benchmark compound document serialization on a high-overlap dataset.
+
+Many articles share a handful of authors so most included resources are
+reached repeatedly.
+
+::
+
+    python -m benchmarks.includes --articles 500 --authors 5
+"""
+from benchmarks.models import *
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import argparse
+import json
+import jsonapiquery
+
+
+DRIVERS = [
+    DriverSchemaMarshmallow(ArticleSchema()), DriverModelSQLAlchemy(Article)]
+PARAMS = {'include': 'author,comments.author,tags'}
+
+
+def serialize_per_parent(includes, models):
+    """Serialize every related model of every parent without deduplication."""
+    output = []
+    for include in includes:
+        mapping = zip(include.relationships, include.source.relationships)
+        included = models
+        for mapper, relationship in mapping:
+            related_models = []
+            for model in included:
+                related = getattr(model, mapper.attribute_name)
+                if related is None:
+                    continue
+                if not isinstance(related, list):
+                    related = [related]
+                output.extend(relationship.serialize(related))
+                related_models.extend(related)
+            included = related_models
+    return output
+
+
+def run(articles, authors, repeat):
+    engine = make_engine()
+    populate(engine, articles=articles, authors=authors, tags=5, comments=3)
+    session = make_session_factory(engine)()
+
+    query, includes = jsonapiquery.include_query(
+        session.query(Article), PARAMS, DRIVERS)
+    models = query.all()
+
+    report_header('include serialization ({} articles, {} authors)'.format(
+        articles, authors))
+    variants = [
+        ('per parent', serialize_per_parent),
+        ('serialize_includes', jsonapiquery.serialize_includes),
+    ]
+    for name, fn in variants:
+        size = len(json.dumps(fn(includes, models)))
+        report('{} ({} bytes)'.format(name, size), measure(
+            lambda: fn(includes, models), repeat))
+    session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--authors', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(args.articles, args.authors, args.repeat)
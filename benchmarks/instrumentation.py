@@ -0,0 +1,52 @@
+"""Benchmark instrumentation overhead on query building.
+
+::
+
+    python -m benchmarks.instrumentation
+"""
+from benchmarks.models import *
+from jsonapiquery import instrumentation
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import argparse
+import jsonapiquery
+
+
+DRIVERS = [
+    DriverSchemaMarshmallow(ArticleSchema()), DriverModelSQLAlchemy(Article)]
+PARAMS = {
+    'filter[status]': 'open', 'filter[views]': 'gte:100', 'sort': '-views',
+    'include': 'author,tags', 'page[limit]': '50'}
+
+
+def build(session):
+    query = session.query(Article)
+    query, _ = jsonapiquery.filter_query(query, PARAMS, DRIVERS)
+    query, _ = jsonapiquery.sort_query(query, PARAMS, DRIVERS)
+    query, _ = jsonapiquery.include_query(query, PARAMS, DRIVERS)
+    query, _ = jsonapiquery.paginate_query(query, PARAMS)
+    return query
+
+
+def traced(session, sink):
+    with instrumentation.trace(sink):
+        return build(session)
+
+
+def run(repeat):
+    engine = make_engine()
+    session = make_session_factory(engine)()
+    sink = instrumentation.HistogramSink()
+
+    report_header('instrumentation overhead (query building)')
+    report('disabled', measure(lambda: build(session), repeat))
+    report('traced', measure(lambda: traced(session, sink), repeat))
+    session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,294 @@
+"""Load test a reference WSGI application under concurrent clients.
+
+The application serves ``GET /articles`` the way the README composes
+the library: filter, sort, count, include, paginate, then serialize
+the page, its included resources and pagination links.  It is served
+by ``wsgiref`` in worker processes while client threads in the parent
+process issue a weighted mix of request shapes.
+
+Worker modes:
+
+- ``thread``: one server process handling requests on a thread pool.
+- ``process``: pre-forked single threaded server processes sharing the
+  listening socket.
+
+::
+
+    python -m benchmarks.loadtest --rows 100000 --mode thread --workers 4
+    python -m benchmarks.loadtest --mode process --workers 4 \\
+        --mix simple=4,offset=1,include=2,in=1 --duration 30
+"""
+from benchmarks.models import *
+from concurrent.futures import ThreadPoolExecutor
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+from jsonapiquery.errors import JSONAPIQueryError
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlencode
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+
+import argparse
+import http.client
+import json
+import jsonapiquery
+import multiprocessing
+import threading
+
+
+SHAPES = {
+    'simple': lambda rng, rows: {'page[limit]': '25'},
+    'offset': lambda rng, rows: {
+        'sort': 'id', 'page[limit]': '25',
+        'page[offset]': str(rng.randint(rows // 2, max(rows - 25, 0)))},
+    'include': lambda rng, rows: {
+        'include': 'author,comments.author,tags', 'page[limit]': '25'},
+    'in': lambda rng, rows: {
+        'filter[id]': 'in:' + ','.join(
+            str(rng.randint(1, rows)) for _ in range(500)),
+        'page[limit]': '25'},
+}
+DEFAULT_MIX = 'simple=4,offset=1,include=2,in=1'
+
+
+def make_app(session_factory, base_url='http://localhost/articles'):
+    """Return a WSGI application serving the articles collection."""
+    drivers = [
+        DriverSchemaMarshmallow(ArticleSchema()),
+        DriverModelSQLAlchemy(Article)]
+    schema = ArticleSchema(many=True)
+
+    def app(environ, start_response):
+        params = dict(parse_qsl(environ.get('QUERY_STRING', '')))
+        session = session_factory()
+        try:
+            query = session.query(Article)
+            query, _ = jsonapiquery.filter_query(query, params, drivers)
+            query, _ = jsonapiquery.sort_query(query, params, drivers)
+            total = query.order_by(None).count()
+
+            query, includes = jsonapiquery.include_query(
+                query, params, drivers)
+            query, paginators = jsonapiquery.paginate_query(query, params)
+            models = query.all()
+
+            document = schema.dump(models).data
+            document['included'] = jsonapiquery.serialize_includes(
+                includes, models)
+            document['links'] = jsonapiquery.make_pagination_links(
+                base_url, paginators, dict(params), total)
+            document['meta'] = {'total': total}
+            status = '200 OK'
+        except JSONAPIQueryError as error:
+            document = {'errors': [error.message]}
+            status = '400 Bad Request'
+        finally:
+            session.close()
+
+        body = json.dumps(document).encode('utf-8')
+        start_response(status, [
+            ('Content-Type', 'application/vnd.api+json'),
+            ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """WSGI server handling requests on a bounded thread pool."""
+
+    request_queue_size = 128
+    workers = 4
+
+    def process_request(self, request, client_address):
+        if not hasattr(self, '_executor'):
+            self._executor = ThreadPoolExecutor(self.workers)
+        self._executor.submit(
+            self.process_request_thread, request, client_address)
+
+
+class BacklogWSGIServer(WSGIServer):
+
+    request_queue_size = 128
+
+
+def serve(server, engine):
+    # Connections must not be shared with the parent process.
+    engine.dispose()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def start_servers(engine, mode, workers):
+    """Start the server processes and return (port, processes)."""
+    app = make_app(make_session_factory(engine))
+    if mode == 'thread':
+        server_class = type(
+            'Server', (PooledWSGIServer,), {'workers': workers})
+        processes = 1
+    else:
+        server_class = BacklogWSGIServer
+        processes = workers
+
+    server = make_server(
+        '127.0.0.1', 0, app, server_class=server_class,
+        handler_class=QuietHandler)
+    context = multiprocessing.get_context('fork')
+    started = []
+    for _ in range(processes):
+        process = context.Process(target=serve, args=(server, engine))
+        process.daemon = True
+        process.start()
+        started.append(process)
+    port = server.server_address[1]
+    server.socket.close()
+    return port, started
+
+
+def parse_mix(value):
+    mix = []
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SHAPES:
+            raise ValueError('Unknown shape {!r}.'.format(name))
+        mix.append((name, int(weight or 1)))
+    return mix
+
+
+def client(port, mix, rows, deadline, seed, results, lock):
+    """Issue requests until the deadline and record their latencies."""
+    rng = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        path = '/articles?' + urlencode(SHAPES[name](rng, rows))
+        start = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection(
+                '127.0.0.1', port, timeout=30)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+        if ok:
+            latencies[name].append(time.perf_counter() - start)
+        else:
+            errors[name] += 1
+
+    with lock:
+        for name in names:
+            results[name]['latencies'].extend(latencies[name])
+            results[name]['errors'] += errors[name]
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    index = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(results, seconds):
+    summary = {}
+    for name, result in results.items():
+        latencies = sorted(result['latencies'])
+        summary[name] = {
+            'requests': len(latencies),
+            'errors': result['errors'],
+            'throughput': len(latencies) / seconds,
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+        }
+    latencies = sorted(
+        value for result in results.values() for value in result['latencies'])
+    summary['total'] = {
+        'requests': len(latencies),
+        'errors': sum(result['errors'] for result in results.values()),
+        'throughput': len(latencies) / seconds,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+    }
+    return summary
+
+
+def report_summary(summary):
+    print('{:<10} {:>9} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'shape', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+        'p99 ms'))
+    for name, stats in summary.items():
+        print('{:<10} {:>9} {:>7} {:>10.1f} {:>10.3f} {:>10.3f} {:>10.3f}'
+              .format(name, stats['requests'], stats['errors'],
+                      stats['throughput'], stats['p50'], stats['p95'],
+                      stats['p99']))
+
+
+def run(rows, mode, workers, clients, duration, mix, warmup=1.0):
+    engine = make_engine()
+    populate(engine, articles=rows, authors=max(rows // 100, 1), tags=50,
+             comments=2)
+    port, processes = start_servers(engine, mode, workers)
+    try:
+        lock = threading.Lock()
+        for seconds, seed in [(warmup, 0), (duration, 1)]:
+            results = {
+                name: {'latencies': [], 'errors': 0} for name, _ in mix}
+            start = time.perf_counter()
+            threads = [
+                threading.Thread(target=client, args=(
+                    port, mix, rows, start + seconds, seed * clients + i,
+                    results, lock))
+                for i in range(clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        engine.dispose()
+    return summarize(results, elapsed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument(
+        '--mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument(
+        '--duration', type=float, default=10, help='Seconds per run.')
+    parser.add_argument(
+        '--mix', default=DEFAULT_MIX,
+        help='Weighted request shapes: {}.'.format(', '.join(SHAPES)))
+    parser.add_argument('--output', help='Write the results to a JSON file.')
+    args = parser.parse_args()
+
+    summary = run(
+        args.rows, args.mode, args.workers, args.clients, args.duration,
+        parse_mix(args.mix))
+    print('load test ({} rows, {} mode, {} workers, {} clients)'.format(
+        args.rows, args.mode, args.workers, args.clients))
+    report_summary(summary)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(summary, output, indent=2, sort_keys=True)
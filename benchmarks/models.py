@@ -0,0 +1,255 @@
+"""Synthetic benchmark models, schemas and datasets."""
+from datetime import datetime, timedelta
+from jsonapiquery.database.sqlalchemy import QueryMixin
+from marshmallow_jsonapi import fields, Schema
+from sqlalchemy import create_engine, event, ForeignKey, Table
+from sqlalchemy import Column, DateTime, Enum, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Query, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import os
+import random
+import statistics
+import tempfile
+import time
+import weakref
+
+
+Base = declarative_base()
+
+article_tag = Table(
+    'article_tag', Base.metadata,
+    Column('article_id', Integer, ForeignKey('article.id'), primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tag.id'), primary_key=True))
+
+
+class Author(Base):
+    __tablename__ = 'author'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    country = Column(String)
+
+
+class Tag(Base):
+    __tablename__ = 'tag'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+
+class Article(Base):
+    __tablename__ = 'article'
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    status = Column(Enum('open', 'closed'), default='open')
+    views = Column(Integer)
+    author_id = Column(Integer, ForeignKey('author.id'))
+    updated_at = Column(DateTime, default=datetime.now)
+
+    author = relationship('Author', backref='articles')
+    tags = relationship('Tag', secondary=article_tag, backref='articles')
+
+
+class Comment(Base):
+    __tablename__ = 'comment'
+
+    id = Column(Integer, primary_key=True)
+    body = Column(String)
+    article_id = Column(Integer, ForeignKey('article.id'))
+    author_id = Column(Integer, ForeignKey('author.id'))
+
+    article = relationship('Article', backref='comments')
+    author = relationship('Author', backref='comments')
+
+
+class AuthorSchema(Schema):
+    id = fields.Integer()
+    name = fields.String()
+    country = fields.String()
+
+    class Meta:
+        type_ = 'authors'
+
+
+class TagSchema(Schema):
+    id = fields.Integer()
+    name = fields.String()
+
+    class Meta:
+        type_ = 'tags'
+
+
+class ArticleSchema(Schema):
+    id = fields.Integer()
+    title = fields.String()
+    status = fields.String()
+    views = fields.Integer()
+    updated_at = fields.DateTime()
+    author = fields.Relationship(
+        schema='AuthorSchema', include_resource_linkage=True,
+        type_='authors')
+    tags = fields.Relationship(
+        schema='TagSchema', include_resource_linkage=True, type_='tags',
+        many=True)
+    comments = fields.Relationship(
+        schema='CommentSchema', include_resource_linkage=True,
+        type_='comments', many=True)
+
+    class Meta:
+        type_ = 'articles'
+
+
+class CommentSchema(Schema):
+    id = fields.Integer()
+    body = fields.String()
+    article = fields.Relationship(
+        schema='ArticleSchema', include_resource_linkage=True,
+        type_='articles')
+    author = fields.Relationship(
+        schema='AuthorSchema', include_resource_linkage=True,
+        type_='authors')
+
+    class Meta:
+        type_ = 'comments'
+
+
+def make_engine(path=None, **kwargs):
+    """Return a pooled engine bound to a SQLite database in WAL mode.
+
+    Without a path the database is a temporary file removed, by the
+    process which created it, once the engine is garbage collected or
+    the process exits.
+    """
+    temporary = path is None
+    if temporary:
+        handle, path = tempfile.mkstemp(suffix='.db', prefix='jsonapiquery-')
+        os.close(handle)
+    kwargs.setdefault('poolclass', QueuePool)
+    kwargs.setdefault('connect_args', {'check_same_thread': False})
+    engine = create_engine('sqlite:///{}'.format(path), **kwargs)
+
+    @event.listens_for(engine, 'connect')
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+        dbapi_connection.execute('PRAGMA synchronous=NORMAL')
+
+    if temporary:
+        weakref.finalize(engine, remove_database, path, os.getpid())
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def remove_database(path, pid=None):
+    """Remove a SQLite database file and its WAL files.
+
+    :param pid: Only remove the files from this process.  Forked workers
+        must not remove their parent's database.
+    """
+    if pid is not None and pid != os.getpid():
+        return
+    for suffix in ['', '-wal', '-shm']:
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def simulate_latency(engine, milliseconds):
+    """Delay every statement to emulate a remote database round trip."""
+    if not milliseconds:
+        return
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def do_sleep(*args, **kwargs):
+        time.sleep(milliseconds / 1000)
+
+
+def populate(engine, articles=10000, authors=100, tags=50, comments=2,
+             seed=0, chunk_size=10000):
+    """Insert a synthetic dataset.
+
+    :param articles: Number of article rows.
+    :param authors: Number of author rows shared by articles and comments.
+    :param tags: Number of tag rows.  Each article receives two tags.
+    :param comments: Number of comments per article.
+    """
+    rng = random.Random(seed)
+    countries = ['us', 'de', 'fr', 'jp', 'br']
+    now = datetime(2020, 1, 1)
+
+    _insert(engine, Author.__table__, (
+        {'id': i, 'name': 'author-{}'.format(i),
+         'country': countries[i % len(countries)]}
+        for i in range(1, authors + 1)), chunk_size)
+    _insert(engine, Tag.__table__, (
+        {'id': i, 'name': 'tag-{}'.format(i)}
+        for i in range(1, tags + 1)), chunk_size)
+    _insert(engine, Article.__table__, (
+        {'id': i, 'title': 'article-{}'.format(i),
+         'status': rng.choice(['open', 'closed']),
+         'views': rng.randint(0, 100000),
+         'author_id': rng.randint(1, authors),
+         'updated_at': now + timedelta(seconds=i)}
+        for i in range(1, articles + 1)), chunk_size)
+    _insert(engine, article_tag, (
+        {'article_id': i, 'tag_id': tag}
+        for i in range(1, articles + 1)
+        for tag in {i % tags + 1, (i * 7) % tags + 1}), chunk_size)
+    _insert(engine, Comment.__table__, (
+        {'body': 'comment-{}-{}'.format(i, j), 'article_id': i,
+         'author_id': rng.randint(1, authors)}
+        for i in range(1, articles + 1) for j in range(comments)),
+        chunk_size)
+
+
+def _insert(engine, table, rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            engine.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        engine.execute(table.insert(), chunk)
+
+
+class BenchmarkQuery(QueryMixin, Query):
+    pass
+
+
+def make_session_factory(engine, query_cls=BenchmarkQuery):
+    return sessionmaker(bind=engine, query_cls=query_cls)
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Return timing statistics, in milliseconds, for a callable."""
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+    }
+
+
+def report(name, stats):
+    print('{:<40} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+        name, stats['min'], stats['median'], stats['mean']))
+
+
+def report_header(title):
+    print(title)
+    print('{:<40} {:>10} {:>10} {:>10}'.format(
+        'benchmark (ms)', 'min', 'median', 'mean'))
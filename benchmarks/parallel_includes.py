@@ -0,0 +1,66 @@
+"""Benchmark sequential and parallel loading of independent includes.
+
+A page of articles is included with 1 to 3 independent top-level
+include paths.  The sequential variant loads every include path on the
+request's session while serializing; the parallel variant fetches each
+top-level subtree on its own pooled connection first.  A simulated
+per-statement latency stands in for a remote database.
+
+::
+
+    python -m benchmarks.parallel_includes --latency 5
+"""
+from benchmarks.models import *
+from jsonapiquery.database.sqlalchemy import load_includes
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import argparse
+import jsonapiquery
+
+
+DRIVERS = [
+    DriverSchemaMarshmallow(ArticleSchema()), DriverModelSQLAlchemy(Article)]
+INCLUDES = [
+    'author',
+    'author,tags',
+    'author,tags,comments.author',
+]
+
+
+def run(page_size, repeat, latency):
+    engine = make_engine()
+    populate(engine, articles=page_size * 10, authors=50, tags=20,
+             comments=3)
+    simulate_latency(engine, latency)
+    Session = make_session_factory(engine)
+
+    def handle(params, parallel):
+        session = Session()
+        query, includes = jsonapiquery.include_query(
+            session.query(Article), params, DRIVERS)
+        models = session.query(Article).limit(page_size).all()
+        if parallel:
+            load_includes(includes, models, Session)
+        jsonapiquery.serialize_includes(includes, models)
+        session.close()
+
+    report_header('include loading ({} models, {}ms latency)'.format(
+        page_size, latency))
+    for include in INCLUDES:
+        params = {'include': include}
+        for name, parallel in [('sequential', False), ('parallel', True)]:
+            stats = measure(lambda: handle(params, parallel), repeat)
+            report('{} {}'.format(include, name), stats)
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument(
+        '--latency', type=float, default=5,
+        help='Simulated milliseconds per statement.')
+    args = parser.parse_args()
+    run(args.page_size, args.repeat, args.latency)
@@ -0,0 +1,71 @@
+"""Benchmark per-request driver construction against a shared registry.
+
+Every request parses and builds a filtered, sorted and included query.
+Drivers are either built per request, as a view function would, or
+fetched from a process-wide registry.  Requests are issued from one or
+more threads.
+
+::
+
+    python -m benchmarks.registry --threads 4
+"""
+from benchmarks.models import *
+from concurrent.futures import ThreadPoolExecutor
+from jsonapiquery.drivers import DriverRegistry
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import argparse
+import jsonapiquery
+
+
+PARAMS = {
+    'filter[author.country]': 'us',
+    'filter[views]': 'gte:1000',
+    'sort': '-views,title',
+    'include': 'author,comments.author,tags',
+}
+
+
+def handle(drivers):
+    query = BenchmarkQuery(Article)
+    query, _ = jsonapiquery.filter_query(query, PARAMS, drivers)
+    query, _ = jsonapiquery.sort_query(query, PARAMS, drivers)
+    query, _ = jsonapiquery.include_query(query, PARAMS, drivers)
+    return query
+
+
+def per_request():
+    return handle([
+        DriverSchemaMarshmallow(ArticleSchema()),
+        DriverModelSQLAlchemy(Article)])
+
+
+def make_shared(registry):
+    def shared():
+        return handle(registry.get(ArticleSchema, Article))
+    return shared
+
+
+def run(threads, requests, repeat):
+    registry = DriverRegistry()
+    variants = [
+        ('per request drivers', per_request),
+        ('driver registry', make_shared(registry)),
+    ]
+
+    report_header('{} requests on {} threads'.format(requests, threads))
+    with ThreadPoolExecutor(threads) as executor:
+        for name, fn in variants:
+            def batch():
+                list(executor.map(lambda _: fn(), range(requests)))
+            report(name, measure(batch, repeat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(args.threads, args.requests, args.repeat)
@@ -0,0 +1,52 @@
+"""Benchmark per-request include overhead with and without schema pooling.
+
+Every request builds fresh drivers, as a view function would, then
+parses and serializes the includes of a page of articles whose
+relationships are already loaded.
+
+::
+
+    python -m benchmarks.schema_pool --page-size 100
+"""
+from benchmarks.models import *
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+from jsonapiquery.drivers.schema.marshmallow import Relationship, SchemaPool
+
+import argparse
+import jsonapiquery
+
+
+PARAMS = {'include': 'author,comments.author,tags'}
+
+
+def handle(session, models):
+    drivers = [
+        DriverSchemaMarshmallow(ArticleSchema()),
+        DriverModelSQLAlchemy(Article)]
+    query, includes = jsonapiquery.include_query(
+        session.query(Article), PARAMS, drivers)
+    return jsonapiquery.serialize_includes(includes, models)
+
+
+def run(page_size, repeat):
+    engine = make_engine()
+    populate(engine, articles=page_size, authors=page_size, tags=20,
+             comments=3)
+    session = make_session_factory(engine)()
+    models = session.query(Article).limit(page_size).all()
+    handle(session, models)
+
+    report_header('include overhead ({} models per page)'.format(page_size))
+    for name, pool in [('no pool', None), ('schema pool', SchemaPool())]:
+        Relationship.pool = pool
+        report(name, measure(lambda: handle(session, models), repeat))
+    session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(args.page_size, args.repeat)
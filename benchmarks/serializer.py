@@ -0,0 +1,53 @@
+"""Benchmark compiled serializers against `Schema.dump`.
+
+::
+
+    python -m benchmarks.serializer --rows 10000
+"""
+from benchmarks.models import *
+from jsonapiquery.drivers.schema import compiler
+from sqlalchemy.orm import joinedload
+
+import argparse
+
+
+def dump(schema, models):
+    data, errors = schema.dump(models, many=True)
+    return data['data']
+
+
+def run(rows, repeat):
+    engine = make_engine()
+    populate(engine, articles=rows, authors=rows, tags=50, comments=1)
+    session = make_session_factory(engine)()
+
+    authors = session.query(Author).all()
+    articles = session.query(Article).all()
+    comments = session.query(Comment).options(
+        joinedload(Comment.article), joinedload(Comment.author)).all()
+    shapes = [
+        ('authors', AuthorSchema(), authors),
+        ('articles (attributes)', ArticleSchema(
+            only=('id', 'title', 'status', 'views', 'updated_at')), articles),
+        ('comments (linkage)', CommentSchema(), comments),
+    ]
+
+    report_header('serializer throughput ({} rows)'.format(rows))
+    for name, schema, models in shapes:
+        assert compiler.serialize(schema, models) == dump(schema, models)
+        dumped = measure(lambda: dump(schema, models), repeat)
+        compiled = measure(lambda: compiler.serialize(schema, models), repeat)
+        report('dump: ' + name, dumped)
+        report('compiled: ' + name, compiled)
+        print('{:<40} {:>10.0f} {:>10.0f}'.format(
+            'rows/s (dump, compiled): ' + name, rows / dumped['median'] * 1000,
+            rows / compiled['median'] * 1000))
+    session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
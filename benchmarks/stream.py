@@ -0,0 +1,76 @@
+"""Benchmark peak memory of in-memory and streamed documents.
+
+::
+
+    python -m benchmarks.stream --rows 50000
+"""
+from benchmarks.models import *
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+from jsonapiquery.stream import stream_document
+
+import argparse
+import json
+import jsonapiquery
+import time
+import tracemalloc
+
+
+DRIVERS = [
+    DriverSchemaMarshmallow(ArticleSchema()), DriverModelSQLAlchemy(Article)]
+PARAMS = {'include': 'author,comments,tags'}
+SCHEMA = ArticleSchema()
+
+
+def serialize(models):
+    return SCHEMA.dump(models, many=True).data['data']
+
+
+def build_in_memory(session, includes):
+    models = session.query(Article).all()
+    included = jsonapiquery.serialize_includes(includes, models)
+    document = {'data': serialize(models), 'included': included}
+    return len(json.dumps(document).encode('utf-8'))
+
+
+def build_streamed(session, includes, chunk_size):
+    query = session.query(Article)
+    chunks = stream_document(query, serialize, includes, chunk_size=chunk_size)
+    return sum(len(chunk) for chunk in chunks)
+
+
+def profile(name, fn):
+    # Timings are taken without tracing; tracemalloc slows allocation.
+    start = time.perf_counter()
+    size = fn()
+    elapsed = (time.perf_counter() - start) * 1000
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<40} {:>10.1f} {:>10.1f} {:>10}'.format(
+        name, elapsed, peak / 1024 / 1024, size))
+
+
+def run(rows, chunk_size):
+    engine = make_engine()
+    populate(engine, articles=rows, authors=1000, tags=50, comments=2)
+    Session = make_session_factory(engine)
+    includes = list(jsonapiquery.iter_by_type(
+        jsonapiquery.url.iter_includes, PARAMS, DRIVERS))
+
+    print('document generation ({} rows)'.format(rows))
+    print('{:<40} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'ms', 'peak MiB', 'bytes'))
+    profile('in memory', lambda: build_in_memory(Session(), includes))
+    profile('streamed ({} rows per chunk)'.format(chunk_size),
+            lambda: build_streamed(Session(), includes, chunk_size))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+    run(args.rows, args.chunk_size)
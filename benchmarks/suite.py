@@ -0,0 +1,250 @@
+"""Benchmark suite with machine-readable results and regression checks.
+
+Each request stage is timed separately against synthetic SQLite
+datasets: URL parsing, driver resolution, query building through the
+public `*_query` functions, SQL execution (page and count), include
+serialization and pagination links.  Every scenario of `SCENARIOS` is
+run; stages of scenarios other than "base" are prefixed with the
+scenario's name, for example "include.serialize".  Pages are fetched
+with a new session each time so model hydration is always measured.
+
+::
+
+    python -m benchmarks.suite --rows 10000 --rows 100000 --output base.json
+    python -m benchmarks.suite --rows 10000 --rows 100000 \\
+        --baseline base.json --threshold 0.15 --stage-threshold parse=0.5
+
+The comparison exits with status 1 when a stage's median regressed by
+more than its threshold (a fraction of the baseline median).
+"""
+from benchmarks.models import *
+from jsonapiquery import url
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import argparse
+import json
+import jsonapiquery
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+
+
+PARAMS = {
+    'filter[status]': 'open',
+    'filter[views]': 'gte:50000',
+    'filter[author.country]': 'us,de',
+    'sort': '-views,title',
+    'page[limit]': '50',
+    'page[offset]': '100',
+}
+SCENARIOS = {
+    'base': PARAMS,
+    'include': dict(PARAMS, include='author,comments.author,tags'),
+    'include.limited': dict(PARAMS, **{
+        'include': 'author,comments.author,tags',
+        'page[comments][limit]': '1', 'sort[comments]': '-id'}),
+}
+BASE_URL = 'http://localhost/articles'
+
+
+def make_drivers():
+    return [
+        DriverSchemaMarshmallow(ArticleSchema()),
+        DriverModelSQLAlchemy(Article)]
+
+
+def parse(params):
+    return (
+        list(url.iter_filters(params)), list(url.iter_sorts(params)),
+        list(url.iter_includes(params)), list(url.iter_paginators(params)))
+
+
+def resolve(items, drivers):
+    filters, sorts, includes, paginators = items
+    parsed = []
+    for group in [filters, sorts, includes]:
+        group = list(group)
+        for driver in drivers:
+            group = [driver.parse(item) for item in group]
+        parsed.append(group)
+    return parsed + [paginators]
+
+
+def build(query, params, drivers):
+    """Return the unpaginated and paginated queries and the includes."""
+    query, _ = jsonapiquery.filter_query(query, params, drivers)
+    query, _ = jsonapiquery.sort_query(query, params, drivers)
+    query, includes = jsonapiquery.include_query(query, params, drivers)
+    page, _ = jsonapiquery.paginate_query(query, params)
+    return query, page, includes
+
+
+def measure_prepared(prepare, fn, repeat, warmup=1, finish=None):
+    """Return timing statistics of "fn" called with "prepare"'s result.
+
+    The preparation, and "finish" called with the same value, are not
+    timed.
+    """
+    def call(value):
+        start = time.perf_counter()
+        fn(value)
+        elapsed = time.perf_counter() - start
+        if finish is not None:
+            finish(value)
+        return elapsed
+
+    for _ in range(warmup):
+        call(prepare())
+
+    timings = [call(prepare()) * 1000 for _ in range(repeat)]
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+    }
+
+
+def run(rows, repeat):
+    """Return the timing statistics of every stage for a dataset size."""
+    engine = make_engine()
+    populate(engine, articles=rows, authors=max(rows // 100, 1), tags=50,
+             comments=2)
+    session_factory = make_session_factory(engine)
+    drivers = make_drivers()
+    results = {}
+    for scenario, params in SCENARIOS.items():
+        prefix = '' if scenario == 'base' else scenario + '.'
+        stages = run_scenario(params, session_factory, drivers, repeat)
+        for stage, stats in stages.items():
+            results[prefix + stage] = stats
+    engine.dispose()
+    return results
+
+
+def run_scenario(params, session_factory, drivers, repeat):
+    session = session_factory()
+    raw = parse(params)
+    unpaginated, page, includes = build(
+        session.query(Article), params, drivers)
+    total = unpaginated.order_by(None).count()
+    paginators = raw[3]
+
+    def load_page():
+        session = session_factory()
+        models = page.with_session(session).all()
+        return session, models
+
+    def close(value):
+        value[0].close()
+
+    results = {
+        'parse': measure(lambda: parse(params), repeat),
+        'resolve': measure(lambda: resolve(raw, drivers), repeat),
+        'build': measure(
+            lambda: build(session.query(Article), params, drivers), repeat),
+        'execute.page': measure_prepared(
+            session_factory, lambda session: page.with_session(session).all(),
+            repeat, finish=lambda session: session.close()),
+        'execute.count': measure(
+            lambda: unpaginated.order_by(None).count(), repeat),
+        'links': measure(lambda: jsonapiquery.make_pagination_links(
+            BASE_URL, paginators, dict(params), total), repeat),
+    }
+    if includes:
+        results['serialize'] = measure_prepared(
+            load_page,
+            lambda value: jsonapiquery.serialize_includes(includes, value[1]),
+            repeat, finish=close)
+    session.close()
+    return results
+
+
+def collect(sizes, repeat):
+    results = {}
+    for rows in sizes:
+        report_header('benchmark suite ({} rows)'.format(rows))
+        for stage, stats in run(rows, repeat).items():
+            report(stage, stats)
+            results['{}/{}'.format(rows, stage)] = stats
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold, stage_thresholds=None):
+    """Return (name, baseline, current, change, regressed) rows.
+
+    Medians are compared.  Benchmarks missing from either side are
+    skipped.
+    """
+    stage_thresholds = stage_thresholds or {}
+    rows = []
+    for name, stats in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['median']
+        after = stats['median']
+        change = (after - before) / before if before else 0.0
+        stage = name.split('/', 1)[1]
+        limit = stage_thresholds.get(stage, threshold)
+        rows.append((name, before, after, change, change > limit))
+    return rows
+
+
+def report_comparison(rows):
+    print('{:<30} {:>12} {:>12} {:>9}'.format(
+        'benchmark (median ms)', 'baseline', 'current', 'change'))
+    for name, before, after, change, regressed in rows:
+        print('{:<30} {:>12.3f} {:>12.3f} {:>+8.1%} {}'.format(
+            name, before, after, change, 'REGRESSED' if regressed else ''))
+
+
+def parse_stage_thresholds(values):
+    thresholds = {}
+    for value in values or []:
+        stage, _, limit = value.partition('=')
+        thresholds[stage] = float(limit)
+    return thresholds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--rows', type=int, action='append',
+        help='Dataset size; may be repeated (default 10000).')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='Write the results to a JSON file.')
+    parser.add_argument('--baseline', help='Compare against a JSON file.')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Allowed median regression as a fraction of the baseline.')
+    parser.add_argument(
+        '--stage-threshold', action='append',
+        help='Per stage threshold override: STAGE=FRACTION.')
+    args = parser.parse_args()
+
+    current = collect(args.rows or [10000], args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(current, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            baseline = json.load(baseline)
+        rows = compare(
+            current, baseline, args.threshold,
+            parse_stage_thresholds(args.stage_threshold))
+        report_comparison(rows)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
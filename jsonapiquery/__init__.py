@@ -1,67 +1,372 @@
-from jsonapiquery import url
+from jsonapiquery import errors, instrumentation, url
+from jsonapiquery.utils import include_scope
+from jsonapiquery.types import IncludeNode, Includes, Validator
+from datetime import timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import urlencode
 
+import hashlib
+
+
+# Default maximum number of included resources per parent and relationship.
+MAX_INCLUDE_LIMIT = 100
+
 
 def iter_by_type(iterator, params, drivers):
-    for item in iterator(params):
-        for driver in drivers:
-            item = driver.parse(item)
+    with instrumentation.stage('parse'):
+        items = list(iterator(params))
+    for item in items:
+        with instrumentation.stage('resolve'):
+            for driver in drivers:
+                item = driver.parse(item)
         yield item
 
 
 def filter_query(query, params, drivers):
     filters = iter_by_type(url.iter_filters, params, drivers)
     filters = list(filters)
-    return query.apply_filters(filters), filters
+    with instrumentation.stage('build.filter'):
+        return query.apply_filters(filters), filters
 
 
 def sort_query(query, params, drivers):
     sorts = iter_by_type(url.iter_sorts, params, drivers)
     sorts = list(sorts)
-    return query.apply_sorts(sorts), sorts
+    with instrumentation.stage('build.sort'):
+        return query.apply_sorts(sorts), sorts
+
+
+def include_query(query, params, drivers, max_limit=MAX_INCLUDE_LIMIT):
+    """Return the query joined to the requested includes and the parsed
+    includes.
 
+    The returned includes carry their per-parent limits as "limits";
+    `serialize_includes` uses them by default.
 
-def include_query(query, params, drivers):
+    :param max_limit: Maximum per-parent include limit.  See
+        `include_limits`.
+    """
     includes = iter_by_type(url.iter_includes, params, drivers)
-    includes = list(includes)
-    return query.apply_includes(includes), includes
+    limits = include_limits(params, drivers, max_limit)
+    includes = Includes(includes, limits)
+    with instrumentation.stage('build.include'):
+        return query.apply_includes(includes, limits), includes
+
+
+def include_limits(params, drivers, max_size=MAX_INCLUDE_LIMIT):
+    """Return the parsed per-parent limits of included relationships.
+
+    For example, "page[comments][limit]=5&sort[comments]=-created_at"
+    includes each parent's five newest comments.  Sorts must name
+    attributes of the limited relationship's resource.  Pass the limits
+    to `serialize_includes`.
+
+    :param max_size: Maximum number of related resources per parent.
+        `None` removes the cap.
+    """
+    limits = []
+    for limit in iter_by_type(url.iter_include_limits, params, drivers):
+        try:
+            value = int(limit.limit)
+            if value < 1 or (max_size is not None and value > max_size):
+                raise ValueError('Invalid include limit.')
+        except ValueError:
+            raise errors.InvalidPaginationValue(item=limit)
+
+        sorts = []
+        for sort in limit.sorts:
+            if len(sort.relationships) != len(limit.relationships):
+                message = 'Included relationships can only be sorted by ' \
+                    'their own attributes.'
+                raise errors.InvalidPath(message, sort)
+            for driver in drivers:
+                sort = driver.parse(sort)
+            sorts.append(sort)
+        limits.append(limit._replace(limit=value, sorts=sorts))
+    return limits
 
 
 def paginate_query(query, params, max_size=None):
-    paginators = url.iter_paginators(params)
-    paginators = list(paginators)
-    return query.apply_paginators(paginators, max_size), paginators
+    with instrumentation.stage('parse'):
+        paginators = url.iter_paginators(params)
+        paginators = list(paginators)
+    with instrumentation.stage('build.paginate'):
+        return query.apply_paginators(paginators, max_size), paginators
+
 
+def export_query(query, params, drivers, max_rows=None):
+    """Return a filtered and sorted but unpaginated query for a bulk
+    export and the parsed includes.
 
-def serialize_includes(includes, models):
-    output = []
+    Includes are parsed but not joined; streaming exports load them in
+    batches per chunk.
+
+    :param max_rows: Maximum number of exported rows.
+    """
+    query, _ = filter_query(query, params, drivers)
+    query, _ = sort_query(query, params, drivers)
+    includes = iter_by_type(url.iter_includes, params, drivers)
+    includes = list(includes)
+    if max_rows is not None:
+        query = query.limit(max_rows)
+    return query, includes
+
+
+def facet_query(query, params, drivers):
+    """Return the value counts of the requested facets and the facets.
+
+    Counts are computed under the query's filters and keyed by the
+    requested facet path, for example:
+    ``{'status': {'open': 120, 'closed': 80}}``.
+    """
+    facets = iter_by_type(url.iter_facets, params, drivers)
+    facets = list(facets)
+    if not facets:
+        return {}, facets
+    with instrumentation.stage('facet'):
+        return query.apply_facets(facets), facets
+
+
+def relationship_counts(query, models, params, drivers):
+    """Return the requested relationship counts of each model and the
+    parsed counts.
+
+    Each model's counts are keyed by relationship name, for example:
+    ``{'comments': 3, 'tags': 2}``.
+    """
+    counts = iter_by_type(url.iter_counts, params, drivers)
+    counts = list(counts)
+    if not counts or not models:
+        return [{} for _ in models], counts
+    with instrumentation.stage('count.relationships'):
+        return query.apply_counts(counts, models), counts
+
+
+def attach_counts(resources, counts):
+    """Add the relationship counts of each model to the "meta" member of
+    its serialized resource.
+    """
+    for resource, values in zip(resources, counts):
+        if values:
+            resource.setdefault('meta', {})['counts'] = values
+    return resources
+
+
+def make_validator(query, params, drivers):
+    """Return the cache validator of a filtered query's result.
+
+    The greatest version of the matched rows and their number are
+    selected with one aggregate statement.  The entity tag combines them
+    with the canonical request parameters, so any change to a matched
+    row's version, to the set of matched rows or to the request changes
+    the tag.  The version column is configured by the model driver's
+    "version_attribute".  Changes to included or related resources do
+    not change the tag.
+
+    `None` is returned, and conditional requests are never answered as
+    not modified, when the model has no version column: a count alone
+    can not tell whether a matched row changed.
+
+    The returned total can be reused as the unpaginated row count.
+    """
+    version_column = None
+    for driver in drivers:
+        version_column = getattr(driver, 'version_column', version_column)
+    if version_column is None:
+        return None
+
+    with instrumentation.stage('validate'):
+        version, total = query.apply_validator(version_column)
+
+    shape = urlencode(sorted(params.items()))
+    digest = hashlib.sha1(
+        '{}|{}|{}'.format(version, total, shape).encode('utf-8'))
+    return Validator(
+        'W/"{}"'.format(digest.hexdigest()), version, total)
+
+
+def is_not_modified(validator, if_none_match=None, if_modified_since=None):
+    """Return "True" if a conditional request's representation is unchanged.
+
+    "If-None-Match" takes precedence over "If-Modified-Since".  Naive
+    versions are compared as UTC datetimes.  Requests without a
+    validator are always modified.
+    """
+    if validator is None:
+        return False
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        tags = {_strip_weak(tag) for tag in if_none_match.split(',')}
+        return _strip_weak(validator.etag) in tags
+
+    last_modified = validator.last_modified
+    if if_modified_since is None or not hasattr(last_modified, 'tzinfo'):
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def _strip_weak(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def make_include_tree(includes):
+    """Return a set of includes merged into a tree of shared prefixes.
+
+    Each node references the first include reaching it and its depth
+    within that include's relationships.  The root node has no include.
+    """
+    root = IncludeNode(None, -1, {})
+    for include in includes:
+        node = root
+        for depth, name in enumerate(_iter_names(include)):
+            if name not in node.children:
+                node.children[name] = IncludeNode(include, depth, {})
+            node = node.children[name]
+    return root
+
+
+def _iter_names(include):
+    """Return the requested relationship names of a parsed include."""
+    while not isinstance(include.source, str):
+        include = include.source
+    return include.relationships
+
+
+def identify_models(includes, models):
+    """Return the (type, id) pairs of the primary models."""
     for include in includes:
-        mapping = zip(include.relationships, include.source.relationships)
-        included = models
-        for mapper, relationship in mapping:
-            data, included = serialize_models(mapper, relationship, included)
-            output.extend(data)
+        if include.source.relationships:
+            relationship = include.source.relationships[0]
+            return set(map(relationship.identify_parent, models))
+    return set()
+
+
+def serialize_includes(
+        includes, models, seen=None, cache=None, limits=None):
+    """Return the unique serialized resources related to a set of models.
+
+    The include tree is walked breadth first.  Each level's related
+    models are loaded and gathered from every parent first.  Once the
+    whole tree is loaded, each level is serialized with one dump per
+    resource schema.  Resources are identified by their (type, id) pair;
+    each is serialized once no matter how many models or include paths
+    refer to it and resources in the primary data are never included.
+
+    :param seen: Set of (type, id) pairs which must not be included.  It
+        is updated in place so it can be shared across calls.  Defaults
+        to the identities of the primary models.
+    :param cache: Optional `jsonapiquery.cache.FragmentCache` instance.
+    :param limits: Parsed per-parent include limits.  See
+        `include_limits`.  Defaults to the limits of includes returned
+        by `include_query`.
+    """
+    if limits is None:
+        limits = getattr(includes, 'limits', ())
+    if seen is None:
+        seen = identify_models(includes, models)
+
+    with instrumentation.stage('include.load'):
+        levels = _load_includes(includes, models, seen, limits)
+
+    with instrumentation.stage('include.serialize'):
+        output = []
+        for batches in levels:
+            for relationship, batch, path in batches.values():
+                with include_scope(path, relationship):
+                    output.extend(relationship.serialize(batch, cache))
     return output
 
 
-def serialize_models(mapper, relationship, models):
-    included_data = []
-    related_models = []
+def _load_includes(includes, models, seen, limits=()):
+    """Return the unseen related models of each include level grouped by
+    resource schema.
+    """
+    limits = {'.'.join(_iter_names(limit)): limit for limit in limits}
+    levels = []
+    tree = make_include_tree(includes)
+    level = [(node, models) for node in tree.children.values()]
+    while level:
+        next_level = []
+        batches = {}
+        for node, parents in level:
+            mapper = node.include.relationships[node.depth]
+            relationship = node.include.source.relationships[node.depth]
+            path = '.'.join(_iter_names(node.include)[:node.depth + 1])
+
+            with include_scope(path, mapper):
+                # Model drivers may load unloaded relationships in bulk.
+                limit = limits.get(path)
+                if limit is not None and hasattr(mapper, 'load_limited'):
+                    mapper.load_limited(parents, limit.limit, limit.sorts)
+                elif hasattr(mapper, 'load'):
+                    mapper.load(parents)
+                related = list(iter_related(mapper, parents))
+
+            unseen = filter_unseen(relationship, related, seen)
+            if unseen:
+                key = relationship.schema_key
+                batch = batches.setdefault(key, (relationship, [], path))
+                batch[1].extend(unseen)
+
+            for child in node.children.values():
+                next_level.append((child, related))
+
+        levels.append(batches)
+        level = next_level
+    return levels
+
+
+def serialize_models(mapper, relationship, models, seen=None):
+    """Serialize the related models of a set of models with one dump."""
+    related = list(iter_related(mapper, models))
+    unseen = filter_unseen(relationship, related, seen)
+    if not unseen:
+        return [], related
+    return relationship.serialize(unseen), related
+
+
+def serialize_relationship(mapper, relationship, model, seen=None):
+    return serialize_models(mapper, relationship, [model], seen)
+
+
+def iter_related(mapper, models):
+    """Return a generator of the unique models related to a set of models."""
+    visited = set()
     for model in models:
-        data, related = serialize_relationship(mapper, relationship, model)
-        included_data.extend(data)
-        related_models.extend(related)
-    return included_data, related_models
+        related = getattr(model, mapper.attribute_name)
+        if related is None:
+            continue
 
+        if not isinstance(related, list):
+            related = [related]
+        for related_model in related:
+            if id(related_model) not in visited:
+                visited.add(id(related_model))
+                yield related_model
 
-def serialize_relationship(mapper, relationship, model):
-    models = getattr(model, mapper.attribute_name)
-    if models is None:
-        return [], []
 
-    if not isinstance(models, list):
-        models = [models]
-    return relationship.serialize(models), models
+def filter_unseen(relationship, models, seen=None):
+    """Return the models whose identity is not in (and add them to) seen."""
+    if seen is None:
+        return models
+
+    unseen = []
+    for model in models:
+        key = relationship.identify(model)
+        if key not in seen:
+            seen.add(key)
+            unseen.append(model)
+    return unseen
 
 
 def make_pagination_links(base_url, paginators, parameters, total):
@@ -0,0 +1,135 @@
+"""Filter and sort usage recording and index advice.
+
+The recorder is opt-in.  Assign an instance to the query class and every
+applied filter and sort is aggregated by model, column path, strategy and
+sort direction.
+
+::
+
+    class BaseQuery(QueryMixin, Query):
+        usage_recorder = UsageRecorder()
+
+    for advice in BaseQuery.usage_recorder.advise():
+        print(advice.count, advice.statement)
+"""
+from collections import Counter, namedtuple
+from jsonapiquery import errors
+from sqlalchemy import UniqueConstraint
+
+import threading
+
+
+Usage = namedtuple('Usage', ['model', 'path', 'strategy', 'direction'])
+Advice = namedtuple('Advice', ['table', 'column', 'paths', 'count', 'statement'])
+
+
+class UsageRecorder:
+    """Aggregate filter and sort usage frequencies.
+
+    :param enforce: Reject sorts and restricted strategies on columns
+        which are not indexed.
+    :param restricted_strategies: Strategies which require an index when
+        enforcement is enabled.
+    """
+
+    RESTRICTED_STRATEGIES = frozenset([
+        'gt', '~gt', 'gte', '~gte', 'lt', '~lt', 'lte', '~lte', 'like',
+        '~like', 'ilike', '~ilike'])
+
+    def __init__(self, enforce=False, restricted_strategies=None):
+        self.enforce = enforce
+        if restricted_strategies is None:
+            restricted_strategies = self.RESTRICTED_STRATEGIES
+        self.restricted_strategies = frozenset(restricted_strategies)
+        self.usage = Counter()
+        self.columns = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{}(enforce={})'.format(self.__class__.__name__, self.enforce)
+
+    def record_filter(self, filter_):
+        """Record a filter and raise if it is not allowed."""
+        strategy, _ = filter_.value
+        if self.enforce and strategy in self.restricted_strategies:
+            self.check(filter_)
+        self.record(filter_, strategy=strategy)
+
+    def record_sort(self, sort):
+        """Record a sort and raise if it is not allowed."""
+        if self.enforce:
+            self.check(sort)
+        self.record(sort, direction=sort.direction)
+
+    def record(self, item, strategy=None, direction=None):
+        path = [mapper.attribute_name for mapper in item.relationships]
+        path.append(item.attribute.attribute_name)
+
+        usage = Usage(
+            item.attribute.model, '.'.join(path), strategy, direction)
+        with self._lock:
+            self.usage[usage] += 1
+            self.columns[usage] = item.attribute.column
+
+    def check(self, item):
+        """Raise if the item's column is not indexed."""
+        if not is_indexed(item.attribute.column):
+            message = 'Field "{}" can not be used for this query.'.format(
+                item.attribute.attribute_name)
+            raise errors.UnindexedField(message, item)
+
+    def reset(self):
+        with self._lock:
+            self.usage.clear()
+            self.columns.clear()
+
+    def advise(self, min_count=1):
+        """Return unindexed columns ordered by their usage frequency."""
+        with self._lock:
+            usage = list(self.usage.items())
+            columns = dict(self.columns)
+
+        counts = Counter()
+        paths = {}
+        for key, count in usage:
+            column = columns[key]
+            if is_indexed(column):
+                continue
+            counts[column] += count
+            paths.setdefault(column, set()).add(key.path)
+
+        advice = []
+        for column, count in counts.most_common():
+            if count < min_count:
+                break
+            advice.append(Advice(
+                column.table.name, column.name, sorted(paths[column]), count,
+                make_index_statement(column)))
+        return advice
+
+
+def is_indexed(column):
+    """Return "True" if the column leads an index or key.
+
+    Only the leading column of a composite key or index can be used
+    alone for a lookup.
+    """
+    if column.index or column.unique:
+        return True
+    primary_key = list(column.table.primary_key.columns)
+    if primary_key and primary_key[0] is column:
+        return True
+    for index in column.table.indexes:
+        if list(index.columns)[0] is column:
+            return True
+    for constraint in column.table.constraints:
+        if isinstance(constraint, UniqueConstraint) and \
+                list(constraint.columns)[0] is column:
+            return True
+    return False
+
+
+def make_index_statement(column):
+    """Return a suggested index creation statement."""
+    table = column.table.name
+    return 'CREATE INDEX ix_{0}_{1} ON {0} ({1})'.format(table, column.name)
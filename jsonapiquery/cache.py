@@ -0,0 +1,243 @@
+"""Serialized resource fragment cache.
+
+Resource objects are cached by schema, fieldset, id and version so hot
+resources (authors, tags, categories) are serialized once and reused
+across include paths and requests.
+
+::
+
+    cache = FragmentCache(max_bytes=64 * 1024 * 1024)
+    cache.listen(Base, Session)  # The application's sessionmaker.
+
+    data = cache.serialize(schema, models)
+    included = jsonapiquery.serialize_includes(includes, models, cache=cache)
+"""
+from collections import OrderedDict
+from jsonapiquery.drivers.schema import compiler
+from jsonapiquery.drivers.schema.marshmallow import identify, make_schema_key
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.exc import UnmappedInstanceError
+
+import json
+import threading
+
+
+class FragmentCache:
+    """LRU cache of serialized resource objects.
+
+    Cached fragments are shared between callers and must be treated as
+    read-only.  Fragments are keyed by the schema's class, fieldset,
+    context and included data options; schemas whose context can not be
+    hashed are never cached.
+
+    Fragments include resource linkage.  A row's own writes invalidate
+    its fragments, including changes to its foreign keys, but inserting,
+    moving or deleting related rows or secondary table rows does not
+    invalidate the linkage of to-many relationships.  Touch the version
+    attribute of the owning row on such changes or clear the cache.
+
+    :param max_entries: Maximum number of cached fragments.
+    :param max_bytes: Maximum JSON encoded size of the cached fragments.
+    :param version_attribute: Model attribute included in the key so a
+        changed row is never served from the cache.  Models without the
+        attribute are keyed by identity only.
+    """
+
+    def __init__(
+            self, max_entries=10000, max_bytes=32 * 1024 * 1024,
+            version_attribute='updated_at'):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version_attribute = version_attribute
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._fragments = OrderedDict()
+        self._index = {}
+        # Incremented by every invalidation so fragments dumped while one
+        # ran are not stored.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def __repr__(self):
+        return '{}(entries={}, bytes={})'.format(
+            self.__class__.__name__, len(self), self.size)
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def metrics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio,
+            'evictions': self.evictions,
+            'entries': len(self),
+            'bytes': self.size,
+        }
+
+    def make_key(self, schema, model):
+        """Return a model's fragment key or `None` if it is not cached."""
+        schema_key = make_fragment_schema_key(schema)
+        if schema_key is None:
+            return None
+        return self._make_key(schema_key, schema, model)
+
+    def _make_key(self, schema_key, schema, model):
+        _, id_ = identify(schema, model)
+        version = getattr(model, self.version_attribute, None)
+        return schema_key + (id_, version)
+
+    def serialize(self, schema, models):
+        """Return the resource objects of a list of models.
+
+        Models which are not cached are dumped with a single call.
+        """
+        schema_key = make_fragment_schema_key(schema)
+        if schema_key is None:
+            with self._lock:
+                self.misses += len(models)
+            return compiler.serialize(schema, models)
+
+        keys = [self._make_key(schema_key, schema, model) for model in models]
+        output = [None] * len(models)
+        misses = []
+        with self._lock:
+            for position, key in enumerate(keys):
+                fragment = self._fragments.get(key)
+                if fragment is None:
+                    misses.append(position)
+                else:
+                    self._fragments.move_to_end(key)
+                    output[position] = fragment[0]
+            self.hits += len(models) - len(misses)
+            self.misses += len(misses)
+            generation = self._generation
+
+        if misses:
+            data = compiler.serialize(
+                schema, [models[position] for position in misses])
+
+            with self._lock:
+                for position, item in zip(misses, data):
+                    output[position] = item
+                    self._set(
+                        keys[position], models[position], item, generation)
+        return output
+
+    def _set(self, key, model, item, generation):
+        if key in self._fragments or generation != self._generation:
+            return
+
+        # Pending models have no identity and can not be invalidated.
+        identity = _identity_key(model)
+        if identity is None:
+            return
+
+        size = len(json.dumps(item, default=str))
+        if size > self.max_bytes:
+            return
+
+        self._fragments[key] = (item, size, identity)
+        self._index.setdefault(identity, set()).add(key)
+        self.size += size
+
+        while len(self._fragments) > self.max_entries or \
+                self.size > self.max_bytes:
+            self._remove(next(iter(self._fragments)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, identity = self._fragments.pop(key)
+        self.size -= size
+        keys = self._index.get(identity)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._index[identity]
+
+    def invalidate(self, model):
+        """Remove every cached fragment of a model."""
+        identity = _identity_key(model)
+        with self._lock:
+            self._generation += 1
+            for key in list(self._index.get(identity, ())):
+                self._remove(key)
+
+    def invalidate_type(self, model_class):
+        """Remove every cached fragment of a mapped class's rows."""
+        with self._lock:
+            self._generation += 1
+            for identity in list(self._index):
+                if isinstance(identity, tuple) and \
+                        issubclass(identity[0], model_class):
+                    for key in list(self._index[identity]):
+                        self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._fragments.clear()
+            self._index.clear()
+            self.size = 0
+
+    def listen(self, target, session):
+        """Invalidate fragments when rows are updated or deleted.
+
+        Bulk "Query.update" and "Query.delete" calls of the session
+        invalidate every fragment of the queried class.
+
+        :param target: Mapped class or declarative base.  Listeners
+            propagate to subclasses.
+        :param session: The application's sessionmaker, or a session,
+            whose bulk operations are listened to.  Pass the sessionmaker
+            rather than the global `Session` class so other applications'
+            sessions do not invalidate the cache.
+        """
+        for name in ['after_update', 'after_delete']:
+            event.listen(target, name, self._on_write, propagate=True)
+        for name in ['after_bulk_update', 'after_bulk_delete']:
+            event.listen(session, name, self._on_bulk_write)
+
+    def remove_listeners(self, target, session):
+        for name in ['after_update', 'after_delete']:
+            if event.contains(target, name, self._on_write):
+                event.remove(target, name, self._on_write)
+        for name in ['after_bulk_update', 'after_bulk_delete']:
+            if event.contains(session, name, self._on_bulk_write):
+                event.remove(session, name, self._on_bulk_write)
+
+    def _on_write(self, mapper, connection, target):
+        self.invalidate(target)
+
+    def _on_bulk_write(self, context):
+        for description in context.query.column_descriptions:
+            if isinstance(description['entity'], type):
+                self.invalidate_type(description['entity'])
+
+
+def make_fragment_schema_key(schema):
+    """Return the part of a fragment key identifying how a schema
+    serializes or `None` if its context can not be hashed.
+    """
+    try:
+        context = frozenset((schema.context or {}).items())
+        hash(context)
+    except (AttributeError, TypeError):
+        return None
+    include_data = tuple(getattr(schema, 'include_data', None) or ())
+    return make_schema_key(schema) + (context, include_data)
+
+
+def _identity_key(model):
+    try:
+        return inspect(model).identity_key
+    except UnmappedInstanceError:
+        return id(model)
@@ -1,9 +1,13 @@
 from abc import abstractmethod, ABCMeta
+from jsonapiquery import errors
 
 
 class BaseQueryMixin(metaclass=ABCMeta):
     """Base query class mixin."""
 
+    DEFAULT_LIMIT = 50
+    DEFAULT_OFFSET = 0
+
     @abstractmethod
     def apply_filters(self):
         return
@@ -23,3 +27,31 @@ class BaseQueryMixin(metaclass=ABCMeta):
     @abstractmethod
     def apply_paginators(self):
         return
+
+    def make_pagination(self, paginators, max_size=None):
+        """Return a limit and offset pair from a set of paginators.
+
+        :param paginators: List of stategy and value arguments.
+        :param max_size: Maximum page size.
+        """
+        pagination = {
+            'limit': self.DEFAULT_LIMIT,
+            'offset': self.DEFAULT_OFFSET
+        }
+        for paginator in paginators:
+            try:
+                value = int(paginator.value)
+
+                # Raise if the maximum page size was exceeded.
+                if max_size is not None and \
+                        paginator.strategy in ['limit', 'number'] and \
+                        value > max_size:
+                    raise ValueError('Maximum query size exceeded.')
+
+                pagination[paginator.strategy] = value
+            except ValueError:
+                raise errors.InvalidPaginationValue(item=paginator)
+        if 'number' in pagination:
+            limit = pagination['limit']
+            pagination['offset'] = pagination['number'] * limit - limit
+        return pagination['limit'], pagination['offset']
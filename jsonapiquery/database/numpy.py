@@ -0,0 +1,343 @@
+"""NumPy in-memory jsonapi-query adapter.
+
+Fully cached reference datasets can be filtered, sorted and paginated
+without a database round trip.  The adapter accepts the same filter and
+sort items as the SQLAlchemy adapter.  Columns are addressed by their
+attribute name; related columns are flattened into dotted names (for
+example "author.name").
+
+::
+
+    dataset = ColumnarDataset.from_records(rows, ['id', 'name', 'author.name'])
+    query, filters = jsonapiquery.filter_query(dataset.query(), params, DRIVERS)
+    query, sorts = jsonapiquery.sort_query(query, params, DRIVERS)
+    total = query.count()
+    query, paginators = jsonapiquery.paginate_query(query, params)
+    rows = query.all()
+"""
+from jsonapiquery import errors
+from jsonapiquery.database import BaseQueryMixin
+
+import numpy
+import operator
+
+
+def _compare(fn):
+    def strategy(column, value):
+        if value is None:
+            return numpy.zeros(len(column), dtype=bool)
+        return fn(column.values, value) & ~column.nulls
+    return strategy
+
+
+def _eq(column, value):
+    if value is None:
+        return column.nulls.copy()
+    return (column.values == value) & ~column.nulls
+
+
+def _ne(column, value):
+    if value is None:
+        return ~column.nulls
+    return (column.values != value) & ~column.nulls
+
+
+def _contains(column, value, lower=False):
+    if value is None:
+        return numpy.zeros(len(column), dtype=bool)
+    values = column.lower if lower else column.strings
+    value = value.lower() if lower else value
+    return (numpy.char.find(values, value) >= 0) & ~column.nulls
+
+
+def _not_contains(column, value, lower=False):
+    if value is None:
+        return numpy.zeros(len(column), dtype=bool)
+    return ~_contains(column, value, lower) & ~column.nulls
+
+
+def _in(column, values):
+    if None in values:
+        values = [value for value in values if value is not None]
+    return numpy.isin(column.values, values) & ~column.nulls
+
+
+def _not_in(column, values):
+    if None in values:
+        return numpy.zeros(len(column), dtype=bool)
+    return ~numpy.isin(column.values, values) & ~column.nulls
+
+
+class Column:
+    """Read-only column array with a null mask.
+
+    String columns are stored as fixed width unicode arrays so they can
+    be searched with `numpy.char`.  Derived arrays are computed once per
+    column on first use.
+    """
+
+    def __init__(self, values):
+        values = numpy.asarray(values)
+        nulls = numpy.zeros(len(values), dtype=bool)
+        if values.dtype == object:
+            # Null positions are filled with a present value so that
+            # vectorized comparisons never see None.  The null mask is
+            # applied to every result.
+            nulls = numpy.equal(values, None)
+            present = numpy.asarray(values[~nulls].tolist())
+            if len(present):
+                values = numpy.where(nulls, present[0], values)
+                values = values.astype(present.dtype)
+
+        values.setflags(write=False)
+        nulls.setflags(write=False)
+        self.values = values
+        self.nulls = nulls
+        self._strings = None
+        self._lower = None
+        self._ranks = None
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def strings(self):
+        """Return the values as a unicode array."""
+        if self.values.dtype.kind == 'U':
+            return self.values
+        if self._strings is None:
+            self._strings = self.values.astype(str)
+            self._strings.setflags(write=False)
+        return self._strings
+
+    @property
+    def lower(self):
+        """Return the lowercased string values."""
+        if self._lower is None:
+            self._lower = numpy.char.lower(self.strings)
+        return self._lower
+
+    @property
+    def ranks(self):
+        """Return the dense sort rank of each value.
+
+        Null values are ranked first in ascending order.
+        """
+        if self._ranks is None:
+            ranks = numpy.full(len(self.values), -1, dtype=numpy.int64)
+            present = ~self.nulls
+            _, inverse = numpy.unique(
+                self.values[present], return_inverse=True)
+            ranks[present] = inverse
+            self._ranks = ranks
+        return self._ranks
+
+
+class Snapshot:
+    """Immutable set of equal length columns."""
+
+    def __init__(self, columns):
+        self.columns = {
+            name: Column(values) for name, values in columns.items()}
+
+        sizes = {len(column) for column in self.columns.values()}
+        if len(sizes) > 1:
+            raise ValueError('Columns must have the same length.')
+        self.size = sizes.pop() if sizes else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+
+class ColumnarDataset:
+    """Reloadable in-memory dataset.
+
+    Queries capture the dataset's current snapshot when they are
+    created.  Reloading builds a new snapshot and swaps it in with a
+    single assignment so in-flight queries are never affected.
+    """
+
+    def __init__(self, columns):
+        self.snapshot = Snapshot(columns)
+
+    @classmethod
+    def from_records(cls, records, names):
+        """Return a dataset built from a sequence of row tuples."""
+        return cls(_transpose(records, names))
+
+    def reload(self, columns):
+        """Atomically replace the dataset's contents."""
+        self.snapshot = Snapshot(columns)
+
+    def reload_records(self, records, names):
+        self.reload(_transpose(records, names))
+
+    def query(self):
+        """Return a query against the current snapshot."""
+        return ColumnarQuery(self.snapshot)
+
+
+def _transpose(records, names):
+    columns = {name: [] for name in names}
+    for record in records:
+        for name, value in zip(names, record):
+            columns[name].append(value)
+    return columns
+
+
+class ColumnarQuery(BaseQueryMixin):
+    """NumPy columnar query.
+
+    Like an ORM query, each method returns a new query object.  Rows
+    are only materialized by "all", "first" and "count".
+    """
+
+    STRATEGIES = {
+        'eq': _eq,
+        '~eq': _ne,
+        'ne': _ne,
+        'gt': _compare(operator.gt),
+        '~gt': _compare(operator.le),
+        'gte': _compare(operator.ge),
+        '~gte': _compare(operator.lt),
+        'lt': _compare(operator.lt),
+        '~lt': _compare(operator.ge),
+        'lte': _compare(operator.le),
+        '~lte': _compare(operator.gt),
+        'like': _contains,
+        '~like': _not_contains,
+        'ilike': lambda column, value: _contains(column, value, True),
+        '~ilike': lambda column, value: _not_contains(column, value, True),
+        'in': _in,
+        '~in': _not_in,
+    }
+
+    def __init__(self, snapshot, mask=None, sorts=(), limit=None, offset=0):
+        self.snapshot = snapshot
+        self.mask = mask
+        self.sorts = sorts
+        self._limit = limit
+        self._offset = offset
+
+    def __repr__(self):
+        return '{}(size={})'.format(
+            self.__class__.__name__, self.snapshot.size)
+
+    def _clone(self, **changes):
+        kwargs = {
+            'mask': self.mask,
+            'sorts': self.sorts,
+            'limit': self._limit,
+            'offset': self._offset,
+        }
+        kwargs.update(changes)
+        return self.__class__(self.snapshot, **kwargs)
+
+    def apply_filters(self, filters):
+        """Return a query object filtered by a set of column, value pairs."""
+        for filter_ in filters:
+            self = self.apply_filter(filter_)
+        return self
+
+    def apply_filter(self, filter_):
+        """Return a query object filtered by a column, value pair."""
+        column = self.get_column(filter_)
+        strategy_name, values = filter_.value
+
+        if strategy_name in self.STRATEGIES:
+            strategy = self.STRATEGIES[strategy_name]
+        else:
+            raise errors.InvalidValue('Unknown strategy specified.', filter_)
+
+        if strategy_name in ['in', '~in']:
+            mask = strategy(column, values)
+        else:
+            mask = numpy.zeros(len(column), dtype=bool)
+            for value in values:
+                mask |= strategy(column, value)
+
+        if self.mask is not None:
+            mask &= self.mask
+        return self._clone(mask=mask)
+
+    def apply_sorts(self, sorts):
+        """Return a query object sorted by a set of columns."""
+        for sort in sorts:
+            self = self.apply_sort(sort)
+        return self
+
+    def apply_sort(self, sort):
+        """Return a query object sorted by a column."""
+        column = self.get_column(sort)
+        return self._clone(sorts=self.sorts + ((column, sort.direction),))
+
+    def apply_paginators(self, paginators, max_size=None):
+        """Return a query object paginated by a limit and offset value.
+
+        :param paginators: List of stategy and value arguments.
+        """
+        limit, offset = self.make_pagination(paginators, max_size)
+        return self._clone(limit=limit, offset=offset)
+
+    def limit(self, limit):
+        return self._clone(limit=limit)
+
+    def offset(self, offset):
+        return self._clone(offset=offset)
+
+    def get_column(self, item):
+        """Return the column addressed by a filter or sort item."""
+        path = [mapper.attribute_name for mapper in item.relationships]
+        path.append(item.attribute.attribute_name)
+        name = '.'.join(path)
+        if name not in self.snapshot:
+            raise errors.InvalidQuery(item=item)
+        return self.snapshot[name]
+
+    def indices(self):
+        """Return the ordered row positions matched by the query."""
+        if self.mask is None:
+            indices = numpy.arange(self.snapshot.size)
+        else:
+            indices = numpy.flatnonzero(self.mask)
+
+        if self.sorts:
+            # `lexsort` treats its last key as the primary key.
+            keys = []
+            for column, direction in reversed(self.sorts):
+                ranks = column.ranks[indices]
+                keys.append(-ranks if direction == '-' else ranks)
+            indices = indices[numpy.lexsort(keys)]
+
+        stop = None
+        if self._limit is not None:
+            stop = self._offset + self._limit
+        return indices[self._offset:stop]
+
+    def all(self):
+        """Return the matched rows as dictionaries."""
+        indices = self.indices()
+        columns = {
+            name: numpy.where(
+                column.nulls[indices], None, column.values[indices]).tolist()
+            for name, column in self.snapshot.columns.items()}
+        return [
+            dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def first(self):
+        rows = self.limit(1).all()
+        return rows[0] if rows else None
+
+    def count(self):
+        if self.mask is None:
+            total = self.snapshot.size
+        else:
+            total = int(numpy.count_nonzero(self.mask))
+
+        total = max(total - self._offset, 0)
+        if self._limit is not None:
+            total = min(total, self._limit)
+        return total
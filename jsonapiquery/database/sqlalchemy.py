@@ -1,14 +1,30 @@
 """SQLAlchemy jsonapi-query adapter."""
-from jsonapiquery import errors
+from concurrent import futures
+from jsonapiquery import errors, instrumentation
 from jsonapiquery.database import BaseQueryMixin
-from sqlalchemy.orm import aliased, joinedload
+from jsonapiquery.utils import include_scope
+from sqlalchemy import distinct, func, inspect, tuple_
+from sqlalchemy.orm import aliased, joinedload, object_session
+
+import asyncio
+import jsonapiquery
+import threading
+
+
+# Python 3.6 has no "get_running_loop"; its "get_event_loop" returns the
+# running loop when called from a coroutine.
+_get_running_loop = getattr(
+    asyncio, 'get_running_loop', asyncio.get_event_loop)
 
 
 class QueryMixin(BaseQueryMixin):
     """SQLAlchemy query class mixin."""
 
-    DEFAULT_LIMIT = 50
-    DEFAULT_OFFSET = 0
+    # Optional `jsonapiquery.advisor.UsageRecorder` instance.
+    usage_recorder = None
+
+    # Dialects computing every facet with a single GROUPING SETS query.
+    GROUPING_SETS_DIALECTS = ('postgresql',)
 
     def apply_filters(self, filters):
         """Return a query object filtered by a set of column, value pairs."""
@@ -19,6 +35,8 @@ class QueryMixin(BaseQueryMixin):
     def apply_filter(self, filter_):
         """Return a query object filtered by a column, value pair."""
         self, column = self.recurse_to_column(filter_)
+        if self.usage_recorder is not None:
+            self.usage_recorder.record_filter(filter_)
         expressions = filter_.attribute.expression(column, filter_.value)
         return self.filter(expressions)
 
@@ -31,6 +49,8 @@ class QueryMixin(BaseQueryMixin):
     def apply_sort(self, sort):
         """Return a query object sorted by a column."""
         self, column = self.recurse_to_column(sort)
+        if self.usage_recorder is not None:
+            self.usage_recorder.record_sort(sort)
         if sort.direction == '-':
             column = column.desc()
         return self.order_by(column)
@@ -40,31 +60,25 @@ class QueryMixin(BaseQueryMixin):
 
         :param paginators: List of stategy and value arguments.
         """
-        pagination = {
-            'limit': self.DEFAULT_LIMIT,
-            'offset': self.DEFAULT_OFFSET
-        }
-        for paginator in paginators:
-            try:
-                value = int(paginator.value)
-
-                # Raise if the maximum page size was exceeded.
-                if max_size is not None and \
-                        paginator.strategy in ['limit', 'number'] and \
-                        value > max_size:
-                    raise ValueError('Maximum query size exceeded.')
-
-                pagination[paginator.strategy] = value
-            except ValueError:
-                raise errors.InvalidPaginationValue(item=paginator)
-        if 'number' in pagination:
-            limit = pagination['limit']
-            pagination['offset'] = pagination['number'] * limit - limit
-        return self.limit(pagination['limit']).offset(pagination['offset'])
-
-    def apply_includes(self, includes):
-        for include in includes:
-            self = self.apply_include(include)
+        limit, offset = self.make_pagination(paginators, max_size)
+        return self.limit(limit).offset(offset)
+
+    def apply_includes(self, includes, limits=()):
+        """Implicitly join the merged include tree of a set of includes.
+
+        Includes sharing a prefix, for example "author.company" and
+        "author.avatar", configure the shared relationships once with
+        one loader branch per child.
+
+        :param limits: Parsed per-parent include limits.  Limited
+            relationships and their descendants are not joined; they
+            are loaded when serialized.
+        """
+        limited = {attribute_names(limit) for limit in limits}
+        tree = jsonapiquery.make_include_tree(includes)
+        opts = self.make_include_options(tree, limited)
+        if opts:
+            self = self.options(*opts)
         return self
 
     def apply_include(self, include):
@@ -81,10 +95,401 @@ class QueryMixin(BaseQueryMixin):
             self = self.options(opts)
         return self
 
+    def make_include_options(self, node, limited=(), path=()):
+        """Return the joined loader options of an include tree node's
+        children.
+
+        :param limited: Attribute name paths which must not be joined.
+        :param path: Attribute name path of the node.
+        """
+        opts = []
+        for child in node.children.values():
+            mapper = child.include.relationships[child.depth]
+            child_path = path + (mapper.attribute_name,)
+            if not mapper.can_join or child_path in limited:
+                continue
+
+            opt = joinedload(mapper.condition)
+            branches = self.make_include_options(child, limited, child_path)
+            if branches:
+                opt = opt.options(*branches)
+            opts.append(opt)
+        return opts
+
+    def apply_facets(self, facets):
+        """Return the row counts of each facet value keyed by facet path.
+
+        Facet columns are joined like filter columns.  Rows are counted
+        once per distinct primary key under the query's filters with
+        one grouped statement per facet, or a single GROUPING SETS
+        statement where the dialect supports it.
+        """
+        query = self.order_by(None).limit(None).offset(None)
+        counts = {make_path(facet): {} for facet in facets}
+
+        dialect = query.session.get_bind().dialect.name
+        if dialect in self.GROUPING_SETS_DIALECTS and len(facets) > 1:
+            query, columns = query.make_grouping_sets_query(facets)
+            for row in query:
+                values, flags = row[:len(columns)], row[len(columns):-1]
+                index = flags.index(0)
+                counts[make_path(facets[index])][values[index]] = row[-1]
+            return counts
+
+        for facet in facets:
+            facet_query, column = query.recurse_to_column(facet)
+            facet_query = facet_query.with_entities(
+                column, query.make_count_expression()).group_by(column)
+            counts[make_path(facet)] = dict(facet_query.all())
+        return counts
+
+    def apply_validator(self, version_column=None):
+        """Return the greatest version and the number of matched rows.
+
+        Both are selected with a single aggregate statement.
+
+        :param version_column: Column versioning the rows.  `None` is
+            returned as the version when omitted.
+        """
+        query = self.order_by(None).limit(None).offset(None)
+        entities = [query.make_count_expression()]
+        if version_column is not None:
+            entities.insert(0, func.max(version_column))
+        row = query.with_entities(*entities).one()
+        if version_column is None:
+            return None, row[0]
+        return row[0], row[1]
+
+    def make_grouping_sets_query(self, facets):
+        """Return a query grouping by every facet and the facet columns.
+
+        Each row holds the facet values, one GROUPING flag per facet and
+        the row count.  Exactly one flag per row is zero: the facet the
+        row's count belongs to.
+        """
+        query, columns = self, []
+        for facet in facets:
+            query, column = query.recurse_to_column(facet)
+            columns.append(column)
+
+        entities = columns + [func.grouping(column) for column in columns]
+        entities.append(self.make_count_expression())
+        query = query.with_entities(*entities).group_by(
+            func.grouping_sets(*[tuple_(column) for column in columns]))
+        return query, columns
+
+    def make_count_expression(self):
+        """Return an expression counting distinct primary entities."""
+        entity = self.column_descriptions[0]['entity']
+        primary_key = inspect(entity).primary_key
+        if len(primary_key) == 1:
+            return func.count(distinct(primary_key[0]))
+        return func.count()
+
+    def apply_counts(self, counts, models):
+        """Return the requested relationship counts of each model.
+
+        Counts are selected with one statement which outer joins a
+        grouped count subquery per relationship to the models' primary
+        keys.  Models must have a single column primary key.
+        """
+        entity = self.column_descriptions[0]['entity']
+        primary_key = inspect(entity).primary_key[0]
+        ids = [inspect(model).identity[0] for model in models]
+
+        query = self.session.query(primary_key)
+        names, columns = [], []
+        for count in counts:
+            if len(count.relationships) != 1:
+                message = 'Relationship counts can not be nested.'
+                raise errors.InvalidPath(message, count)
+
+            mapper = count.relationships[0]
+            local = mapper.local_attribute()
+            keys = {getattr(model, local.key) for model in models}
+            subquery = mapper.make_count_subquery(keys)
+            query = query.outerjoin(subquery, local == subquery.c.key)
+            names.append(make_path(count))
+            columns.append(func.coalesce(subquery.c.count, 0))
+
+        query = query.with_entities(primary_key, *columns).filter(
+            primary_key.in_(ids))
+        rows = {row[0]: row[1:] for row in query}
+        empty = [0] * len(columns)
+        return [dict(zip(names, rows.get(id_, empty))) for id_ in ids]
+
     def recurse_to_column(self, item):
+        if getattr(item.attribute, 'is_count', False):
+            return self.recurse_to_count(item)
+
         mapper = None
         for mapper in item.relationships:
             self = self.outerjoin(mapper.aliased_type, mapper.condition)
 
         column = item.attribute.aliased_column(mapper)
         return self, column
+
+    def recurse_to_count(self, item):
+        """Join the grouped count subquery of an item's last relationship.
+
+        The returned column is the number of related rows, zero when
+        there are none.
+        """
+        *parents, mapper = item.relationships
+        parent = None
+        for parent in parents:
+            self = self.outerjoin(parent.aliased_type, parent.condition)
+
+        subquery = mapper.make_count_subquery()
+        local = mapper.local_attribute(parent and parent.aliased_type)
+        self = self.outerjoin(subquery, local == subquery.c.key)
+        return self, func.coalesce(subquery.c.count, 0)
+
+
+def attribute_names(item):
+    """Return the model attribute names of an item's relationships."""
+    return tuple(mapper.attribute_name for mapper in item.relationships)
+
+
+def make_path(item):
+    """Return the requested dotted path of a parsed item."""
+    while not isinstance(item.source, str):
+        item = item.source
+    if hasattr(item, 'attribute'):
+        return '.'.join(item.relationships + [item.attribute])
+    return '.'.join(item.relationships)
+
+
+def count_query(query):
+    """Return the number of rows matched by an unpaginated query."""
+    return query.order_by(None).count()
+
+
+def execute_query(
+        query, params, base_url, session_factory, count=count_query,
+        max_size=None, executor=None):
+    """Fetch a page of models and the total row count concurrently.
+
+    The page is fetched on the calling thread with the query's own
+    session.  The count is executed by the executor on a new session
+    (and therefore a separate pooled connection) built by the session
+    factory.
+
+    :param query: Filtered, sorted and included but unpaginated query.
+    :param params: Request parameters dictionary.
+    :param base_url: URL used to build the pagination links.
+    :param session_factory: Callable returning a new session.
+    :param count: Count strategy.  Callable accepting the query and
+        returning the total number of rows.
+    :param max_size: Maximum page size.
+    :param executor: `concurrent.futures.Executor` instance.
+    """
+    page, paginators = jsonapiquery.paginate_query(query, params, max_size)
+
+    executor = executor or get_executor()
+    future = executor.submit(
+        instrumentation.bind(_count), query, session_factory, count)
+    try:
+        models = _fetch(page)
+    except BaseException:
+        # The count is either cancelled or awaited so that its session
+        # is released before the error propagates.
+        future.cancel()
+        futures.wait([future])
+        raise
+    total = future.result()
+
+    links = jsonapiquery.make_pagination_links(
+        base_url, paginators, dict(params), total)
+    return models, total, links
+
+
+async def execute_query_async(
+        query, params, base_url, session_factory, count=count_query,
+        max_size=None, executor=None):
+    """Fetch a page of models and the total row count as concurrent tasks.
+
+    Accepts the same arguments as `execute_query`.  Both statements are
+    run by the executor and awaited by the event loop.  The query's own
+    session is only used by the page task.
+    """
+    page, paginators = jsonapiquery.paginate_query(query, params, max_size)
+
+    executor = executor or get_executor()
+    pending = [
+        executor.submit(instrumentation.bind(_fetch), page),
+        executor.submit(
+            instrumentation.bind(_count), query, session_factory, count)]
+    try:
+        models, total = await asyncio.gather(
+            *[asyncio.wrap_future(future) for future in pending])
+    except BaseException:
+        # Running statements can not be interrupted.  Wait for them to
+        # finish so the session is not used after control is returned.
+        for future in pending:
+            future.cancel()
+        await _get_running_loop().run_in_executor(
+            None, futures.wait, pending)
+        raise
+
+    links = jsonapiquery.make_pagination_links(
+        base_url, paginators, dict(params), total)
+    return models, total, links
+
+
+def _fetch(page):
+    with instrumentation.stage('page') as stage:
+        models = page.all()
+    instrumentation.add('hydrate', stage.elapsed - stage.sql)
+    instrumentation.incr('rows', len(models))
+    return models
+
+
+def _count(query, session_factory, count):
+    session = session_factory()
+    try:
+        with instrumentation.stage('count'):
+            return count(query.with_session(session))
+    finally:
+        session.close()
+
+
+def load_includes(includes, models, session_factory, executor=None):
+    """Load the independent include subtrees of a set of models
+    concurrently.
+
+    Each top-level include whose relationship is not loaded is fetched,
+    with the includes nested below it, by the executor on a new session
+    (and therefore a separate pooled connection).  Once every subtree is
+    fetched its models are merged into the models' session, without
+    reloading them, and attached to their parents in one pass.
+    Relationships which are left unloaded are loaded as usual by
+    `jsonapiquery.serialize_includes`.
+
+    :param includes: Includes parsed by a model driver.
+    :param models: Persistent models of a single session.
+    :param session_factory: Callable returning a new session.
+    :param executor: `concurrent.futures.Executor` instance.
+    """
+    plans = _plan_subtrees(includes, models)
+    if not plans:
+        return
+
+    executor = executor or get_executor()
+    with instrumentation.stage('include.load'):
+        pending = _submit_subtrees(plans, session_factory, executor)
+        try:
+            results = [future.result() for future in pending]
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            futures.wait(pending)
+            raise
+        _attach_subtrees(plans, results, object_session(models[0]))
+
+
+async def load_includes_async(
+        includes, models, session_factory, executor=None):
+    """Load the independent include subtrees as concurrent tasks.
+
+    Accepts the same arguments as `load_includes`.  The subtrees are
+    fetched by the executor and awaited by the event loop.
+    """
+    plans = _plan_subtrees(includes, models)
+    if not plans:
+        return
+
+    executor = executor or get_executor()
+    with instrumentation.stage('include.load'):
+        pending = _submit_subtrees(plans, session_factory, executor)
+        try:
+            results = await asyncio.gather(
+                *[asyncio.wrap_future(future) for future in pending])
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            await _get_running_loop().run_in_executor(
+                None, futures.wait, pending)
+            raise
+        _attach_subtrees(plans, results, object_session(models[0]))
+
+
+def _plan_subtrees(includes, models):
+    """Return (node, mapper, keys) triples of the subtrees to fetch."""
+    if not models or object_session(models[0]) is None:
+        return []
+
+    plans = []
+    tree = jsonapiquery.make_include_tree(includes)
+    for node in tree.children.values():
+        mapper = node.include.relationships[node.depth]
+        if hasattr(mapper, 'unloaded_keys'):
+            keys = mapper.unloaded_keys(models)
+            if keys:
+                plans.append((node, mapper, keys))
+    return plans
+
+
+def _submit_subtrees(plans, session_factory, executor):
+    return [
+        executor.submit(
+            instrumentation.bind(_load_subtree), node, mapper,
+            [key for _, key in keys], session_factory)
+        for node, mapper, keys in plans]
+
+
+def _load_subtree(node, mapper, keys, session_factory):
+    """Return the related models of a set of keys grouped by key.
+
+    The includes nested below the node are loaded on the same session.
+    The session is closed so the returned models are detached.
+    """
+    session = session_factory()
+    try:
+        with include_scope(_path(node), mapper):
+            related = mapper.fetch(session, keys)
+
+        parents = [model for models in related.values() for model in models]
+        level = [(child, parents) for child in node.children.values()]
+        while level:
+            next_level = []
+            for child, parents in level:
+                child_mapper = child.include.relationships[child.depth]
+                with include_scope(_path(child), child_mapper):
+                    if hasattr(child_mapper, 'load'):
+                        child_mapper.load(parents)
+                    children = list(
+                        jsonapiquery.iter_related(child_mapper, parents))
+                for grandchild in child.children.values():
+                    next_level.append((grandchild, children))
+            level = next_level
+        return related
+    finally:
+        session.close()
+
+
+def _attach_subtrees(plans, results, session):
+    for (node, mapper, keys), related in zip(plans, results):
+        merged = {
+            key: [session.merge(model, load=False) for model in models]
+            for key, models in related.items()}
+        mapper.attach(keys, merged)
+
+
+def _path(node):
+    return '.'.join(jsonapiquery._iter_names(node.include)[:node.depth + 1])
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the shared query executor."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = futures.ThreadPoolExecutor(
+                    thread_name_prefix='jsonapiquery')
+    return _executor
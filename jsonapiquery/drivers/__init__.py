@@ -54,3 +54,4 @@ class DriverBase(metaclass=ABCMeta):
 
 from .model import *
 from .schema import *
+from .registry import DriverRegistry, driver_registry
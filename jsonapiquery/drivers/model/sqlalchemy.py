@@ -1,11 +1,44 @@
-from jsonapiquery import errors
+from jsonapiquery import errors, instrumentation
 from jsonapiquery.drivers import DriverBase
-from sqlalchemy import orm, or_
-
+from sqlalchemy import (
+    all_, and_, any_, bindparam, func, inspect, orm, or_, select, types)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import ColumnElement
+
+import json
 import operator
 
 
 class DriverModelSQLAlchemy(DriverBase):
+    # Model attribute whose greatest value versions a result set.
+    VERSION_ATTRIBUTE = 'updated_at'
+
+    def __init__(self, obj, version_attribute=None):
+        super().__init__(obj)
+        self.version_attribute = version_attribute or self.VERSION_ATTRIBUTE
+
+    @property
+    def version_column(self):
+        """Return the model's version column or `None`."""
+        return getattr(self.obj, self.version_attribute, None)
+
+    def parse(self, item):
+        """Return a new typed item instance.
+
+        Relationship counts, for example "comments.count", are bound to
+        the last relationship of the item's path.
+        """
+        if not getattr(getattr(item, 'attribute', None), 'is_count', False):
+            return super().parse(item)
+
+        relationships, _ = self.parse_relationships(item, self.obj)
+        init_kwargs = item._asdict()
+        init_kwargs['source'] = item
+        init_kwargs['relationships'] = relationships
+        init_kwargs['attribute'] = RelationshipCount(relationships[-1], item)
+        return self.init_type(type(item), **init_kwargs)
 
     def parse_attribute(self, field, model, item):
         return Column(field.super_attribute, model, item)
@@ -49,8 +82,8 @@ class Column(Attribute):
         '~like': lambda column, value: ~contains(column, value),
         'ilike': lambda column, value: column.ilike('%{}%'.format(value)),
         '~ilike': lambda column, value: ~like(column, value),
-        'in': lambda column, value: column.in_(value),
-        '~in': lambda column, value: column.notin_(value),
+        'in': lambda column, value: InValues(column, value),
+        '~in': lambda column, value: InValues(column, value, negate=True),
     }
 
     @property
@@ -127,17 +160,164 @@ class Column(Attribute):
         return or_(*expressions)
 
 
+class InValues(ColumnElement):
+    """Membership test of a column against a list of values.
+
+    The strategy is chosen by list size when the clause is compiled.
+    Lists of up to `THRESHOLD` values are bound as a single expanding
+    parameter so the statement text does not change with the list's
+    length.  Longer lists are bound as one JSON parameter expanded by
+    "json_each" on SQLite and as one array parameter compared with
+    "ANY" on PostgreSQL.  Other dialects OR together expanding IN
+    clauses of at most `CHUNK_SIZE` values each.
+
+    :param column: Column or attribute expression.
+    :param values: List of values.
+    :param negate: Test for non-membership when "True".
+    """
+
+    __visit_name__ = 'in_values'
+
+    # Largest list bound as a single expanding parameter.
+    THRESHOLD = 500
+    # Largest number of values per IN clause of the chunked fallback.
+    CHUNK_SIZE = 500
+
+    type = types.Boolean()
+    _is_implicitly_boolean = True
+
+    def __init__(self, column, values, negate=False):
+        if hasattr(column, '__clause_element__'):
+            column = column.__clause_element__()
+        self.column = column
+        self.values = list(values)
+        self.negate = negate
+
+    def get_children(self, **kwargs):
+        return [self.column]
+
+    def _copy_internals(self, clone=lambda element, **kw: element, **kw):
+        self.column = clone(self.column, **kw)
+
+    @property
+    def _from_objects(self):
+        return self.column._from_objects
+
+    @property
+    def is_large(self):
+        return len(self.values) > self.THRESHOLD
+
+    def expanding(self, values):
+        """Return an expanding IN clause of a list of values."""
+        param = bindparam(
+            None, values, type_=self.column.type, expanding=True)
+        if self.negate:
+            return self.column.notin_(param)
+        return self.column.in_(param)
+
+    def chunked(self):
+        """Return expanding IN clauses of at most `CHUNK_SIZE` values."""
+        clauses = [
+            self.expanding(self.values[start:start + self.CHUNK_SIZE])
+            for start in range(0, len(self.values), self.CHUNK_SIZE)]
+        if self.negate:
+            return and_(*clauses).self_group()
+        return or_(*clauses).self_group()
+
+
+@compiles(InValues)
+def compile_in_values(element, compiler, **kw):
+    if element.is_large:
+        return compiler.process(element.chunked(), **kw)
+    return compiler.process(element.expanding(element.values), **kw)
+
+
+@compiles(InValues, 'sqlite')
+def compile_in_values_sqlite(element, compiler, **kw):
+    if not element.is_large:
+        return compile_in_values(element, compiler, **kw)
+
+    type_ = element.column.type.dialect_impl(compiler.dialect)
+    processor = type_.bind_processor(compiler.dialect)
+    values = element.values
+    if processor is not None:
+        values = [processor(value) for value in values]
+    param = bindparam(None, json.dumps(values, default=str))
+    return '{} {} (SELECT value FROM json_each({}))'.format(
+        compiler.process(element.column, **kw),
+        'NOT IN' if element.negate else 'IN',
+        compiler.process(param, **kw))
+
+
+@compiles(InValues, 'postgresql')
+def compile_in_values_postgresql(element, compiler, **kw):
+    if not element.is_large:
+        return compile_in_values(element, compiler, **kw)
+
+    param = bindparam(
+        None, element.values, type_=ARRAY(element.column.type))
+    if element.negate:
+        return compiler.process(element.column != all_(param), **kw)
+    return compiler.process(element.column == any_(param), **kw)
+
+
+class RelationshipCount(Column):
+    """Number of related models of the last relationship of a path.
+
+    Queries join the relationship's grouped count subquery rather than a
+    column.  See `Mapper.make_count_subquery`.
+    """
+
+    is_count = True
+    is_enum = False
+    is_foreign_key = False
+    is_primary_key = False
+    python_type = int
+    type = None
+
+    def __init__(self, mapper, item):
+        self.attribute_name = 'count'
+        self.mapper = mapper
+        self.model = mapper.model
+        self.item = item
+        self.attribute = None
+
+    def __repr__(self):
+        return '{}.count'.format(self.mapper)
+
+    @property
+    def column(self):
+        """Return the column the related rows are grouped by."""
+        return self.mapper.remote_column
+
+    def aliased_column(self, mapper):
+        raise errors.InvalidQuery(item=self.item)
+
+
 class Mapper(Attribute):
+    """Relationship segment of a parsed item's path.
+
+    The related class and its alias are resolved on construction and
+    never modified afterwards so parsed items may be shared between
+    threads.
+    """
+
+    # Maximum number of keys bound to a single batched load statement.
+    BATCH_SIZE = 500
+
+    def __init__(self, attribute_name, model, item):
+        super().__init__(attribute_name, model, item)
+        try:
+            self._type = self.attribute.property.mapper.class_
+        except AttributeError:
+            self._type = self._aliased_type = None
+        else:
+            self._aliased_type = orm.aliased(self._type)
 
     @property
     def can_join(self):
         """Return "True" if the mapper can be joined to a query."""
-        try:
-            self.type
-        except errors.JSONAPIQueryError:
-            return False
-        else:
-            return True
+        return self._type is not None
 
     @property
     def condition(self):
@@ -147,14 +327,226 @@ class Mapper(Attribute):
     @property
     def type(self):
         """Return the table of the mapper."""
-        try:
-            return self.attribute.property.mapper.class_
-        except AttributeError:
+        if self._type is None:
             raise errors.InvalidQuery(item=self.item)
+        return self._type
 
     @property
     def aliased_type(self):
         """Return the aliased table of the mapper."""
-        if not hasattr(self, '_aliased_type'):
-            self._aliased_type = orm.aliased(self.type)
+        if self._aliased_type is None:
+            raise errors.InvalidQuery(item=self.item)
         return self._aliased_type
+
+    @property
+    def remote_column(self):
+        """Return the column holding the keys of related rows."""
+        return self._count_columns()[1]
+
+    def make_count_subquery(self, keys=None):
+        """Return a subquery of the number of related rows per key.
+
+        The subquery's columns are "key" and "count".  Rows are counted
+        through the relationship's full join condition so rows it
+        excludes, for example soft deleted rows, are not counted.
+
+        :param keys: Optional keys the counted rows are restricted to.
+        """
+        join, key = self._parent_join()
+        query = select([key.label('key'), func.count().label('count')])
+        query = query.select_from(join)
+        if keys is not None:
+            query = query.where(key.in_(keys))
+        return query.group_by(key).alias()
+
+    def local_attribute(self, parent_type=None):
+        """Return the attribute of the parent joined to the count keys.
+
+        :param parent_type: Aliased parent class.  Defaults to the
+            mapper's model.
+        """
+        local = self._count_columns()[0]
+        key = inspect(self.model).get_property_by_column(local).key
+        return getattr(self.model if parent_type is None else parent_type, key)
+
+    def load(self, models):
+        """Load the relationship of every model where it is not loaded.
+
+        Unloaded relationships are fetched with one IN-batched query per
+        chunk of keys rather than one lazy load per model.  Relationships
+        joined on more than one column are left to their lazy loader.
+        """
+        keys = self.unloaded_keys(models)
+        if not keys:
+            return
+
+        session = orm.object_session(keys[0][0])
+        if session is None:
+            return
+        self.attach(keys, self.fetch(session, [key for _, key in keys]))
+
+    def unloaded_keys(self, models):
+        """Return (model, key) pairs of the models whose relationship is
+        not loaded.
+
+        Nothing is returned for relationships which can not be batch
+        loaded.
+        """
+        columns = self._batch_columns()
+        if columns is None:
+            return []
+
+        models = [
+            model for model in models
+            if self.attribute_name in inspect(model).unloaded]
+        return self.parent_keys(models)
+
+    def parent_keys(self, models):
+        """Return (model, key) pairs of a set of models."""
+        columns = self._batch_columns()
+        if columns is None or not models:
+            return []
+
+        parent = inspect(models[0]).mapper
+        local_key = parent.get_property_by_column(columns[0]).key
+        return [(model, getattr(model, local_key)) for model in models]
+
+    def load_limited(self, models, limit, sorts=()):
+        """Load at most "limit" related models of every model.
+
+        The relationship is replaced whether loaded or not.  The loaded
+        collections are truncated and must not be modified.  To-one
+        relationships and relationships which can not be batch loaded
+        are loaded in full.
+
+        :param limit: Maximum number of related models per model.
+        :param sorts: Parsed sorts of the related models' attributes.
+        """
+        keys = self.parent_keys(models)
+        if not keys or not self.attribute.property.uselist:
+            return self.load(models)
+
+        session = orm.object_session(keys[0][0])
+        if session is None:
+            return
+        related = self.fetch_limited(
+            session, [key for _, key in keys], limit, sorts)
+        self.attach(keys, related)
+
+    def fetch_limited(self, session, keys, limit, sorts=()):
+        """Return at most "limit" related models per key grouped by key.
+
+        Related rows are numbered per key with "ROW_NUMBER() OVER
+        (PARTITION BY key ORDER BY ...)" and fetched with one statement.
+        They are ordered by the sorts, then the relationship's own order
+        and primary key.  Rows are numbered through the relationship's
+        full join condition so rows it excludes are never counted.
+        """
+        prop = self.attribute.property
+        target = prop.mapper
+        related_join, key = self._parent_join()
+
+        order_by = []
+        for sort in sorts:
+            column = sort.attribute.attribute
+            order_by.append(column.desc() if sort.direction == '-' else column)
+        order_by.extend(prop.order_by or ())
+        order_by.extend(target.primary_key)
+
+        row_number = func.row_number().over(
+            partition_by=key, order_by=order_by)
+        primary_key = [
+            column.label('pk_{}'.format(index))
+            for index, column in enumerate(target.primary_key)]
+        numbered = session.query(
+            key.label('key'), row_number.label('row_number'),
+            *primary_key).select_from(related_join)
+        values = sorted({value for value in keys if value is not None})
+        numbered = numbered.filter(InValues(key, values)).subquery()
+
+        join = and_(*[
+            column == numbered.c['pk_{}'.format(index)]
+            for index, column in enumerate(target.primary_key)])
+        query = session.query(target, numbered.c.key).join(numbered, join)
+        query = query.filter(numbered.c.row_number <= limit).order_by(
+            numbered.c.key, numbered.c.row_number)
+
+        related = {}
+        for model, key in query:
+            related.setdefault(key, []).append(model)
+        instrumentation.incr('rows', sum(map(len, related.values())))
+        return related
+
+    def fetch(self, session, keys):
+        """Return the related models of a set of keys grouped by key.
+
+        The models are loaded with the given session through the
+        relationship's full join condition.  Used by `load` and by
+        `jsonapiquery.database.sqlalchemy.load_includes`.
+        """
+        values = sorted({key for key in keys if key is not None})
+        related = {}
+        for start in range(0, len(values), self.BATCH_SIZE):
+            chunk = values[start:start + self.BATCH_SIZE]
+            for key, model in self._load_chunk(session, chunk):
+                related.setdefault(key, []).append(model)
+        return related
+
+    def attach(self, keys, related):
+        """Set the relationship of each (model, key) pair as loaded."""
+        uselist = self.attribute.property.uselist
+        for model, key in keys:
+            value = related.get(key, [])
+            if not uselist:
+                value = value[0] if value else None
+            set_committed_value(model, self.attribute_name, value)
+
+    def _count_columns(self):
+        columns = self._batch_columns()
+        if columns is None:
+            message = 'Relationship "{}" can not be counted.'.format(
+                self.attribute_name)
+            raise errors.InvalidFieldType(message, self.item)
+        return columns
+
+    def _batch_columns(self):
+        """Return the (local, remote) column pair joining the relationship
+        or `None` if it is not joined on a single column.
+        """
+        prop = self.attribute.property
+        if not isinstance(prop, orm.RelationshipProperty):
+            return None
+
+        if prop.secondary is None:
+            pairs = prop.local_remote_pairs
+        else:
+            pairs = prop.synchronize_pairs
+        if len(pairs) != 1:
+            return None
+        return pairs[0]
+
+    def _parent_join(self):
+        """Return the join of an aliased parent to the related class and
+        the aliased parent's key attribute.
+
+        The join uses the relationship's full "primaryjoin" (and
+        "secondaryjoin") so extra join criteria, for example a soft
+        delete flag, restrict the related rows like the lazy loader.
+        """
+        parent = orm.aliased(self.model)
+        join = orm.join(
+            parent, self.type, getattr(parent, self.attribute_name))
+        return join, self.local_attribute(parent)
+
+    def _load_chunk(self, session, keys):
+        """Return (key, model) pairs related to a chunk of keys."""
+        prop = self.attribute.property
+        join, key = self._parent_join()
+        query = session.query(prop.mapper, key).select_from(join)
+        query = query.filter(key.in_(keys))
+        if prop.order_by:
+            query = query.order_by(*prop.order_by)
+
+        pairs = [(value, model) for model, value in query]
+        instrumentation.incr('rows', len(pairs))
+        return pairs
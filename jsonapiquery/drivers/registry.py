@@ -0,0 +1,63 @@
+from jsonapiquery.drivers.model import DriverModelSQLAlchemy
+from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
+
+import threading
+
+
+def make_drivers(schema, model):
+    """Return the default (schema driver, model driver) pair.
+
+    :param schema: Schema class or instance.
+    :param model: Model class.
+    """
+    if isinstance(schema, type):
+        schema = schema()
+    return (DriverSchemaMarshmallow(schema), DriverModelSQLAlchemy(model))
+
+
+class DriverRegistry:
+    """Process-wide registry of drivers keyed by (schema, model) pair.
+
+    Drivers are built once per pair and shared between threads.  Parsing
+    never mutates a driver and parsed items are immutable after
+    construction, so lookups of registered pairs take no lock.  Only the
+    first lookup of a pair builds its drivers under a lock.
+
+    :param factory: Callable accepting a schema and a model and
+        returning the ordered drivers of the pair.
+    """
+
+    def __init__(self, factory=make_drivers):
+        self.factory = factory
+        self._drivers = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def __repr__(self):
+        return '{}(size={})'.format(self.__class__.__name__, len(self))
+
+    def get(self, schema, model):
+        """Return the drivers of a schema and model pair."""
+        key = (schema, model)
+        drivers = self._drivers.get(key)
+        if drivers is None:
+            with self._lock:
+                drivers = self._drivers.get(key)
+                if drivers is None:
+                    drivers = tuple(self.factory(schema, model))
+                    self._drivers[key] = drivers
+        return drivers
+
+    def register(self, schema, model, drivers):
+        """Register custom drivers for a schema and model pair."""
+        with self._lock:
+            self._drivers[(schema, model)] = tuple(drivers)
+
+    def clear(self):
+        with self._lock:
+            self._drivers = {}
+
+
+driver_registry = DriverRegistry()
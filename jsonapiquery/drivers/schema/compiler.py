@@ -0,0 +1,300 @@
+"""Compiled marshmallow_jsonapi resource serializers.
+
+`Schema.dump` runs every field through marshmallow's marshaller and
+then reformats each item as a resource object.  For schemas which only
+use the stock serialization hooks the same resource objects can be
+built by a generated function which reads each attribute once and
+writes it straight into the resource object.
+
+A schema is only compiled when its output is known to match
+`Schema.dump`: no custom dump processors, resource links, document or
+resource meta fields, included data, key prefixes or extra data.  A
+missing attribute or an invalid value falls back to `Schema.dump` so
+that errors and defaults are reported by marshmallow itself; any other
+error is raised.
+
+The compiler inlines private marshmallow 2 and marshmallow_jsonapi 0.20
+behavior.  Schemas are never compiled with other versions.
+
+::
+
+    data = serialize(schema, models)  # == schema.dump(models, many=True)
+"""
+from marshmallow import fields as ma_fields, missing, ValidationError
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+from marshmallow.utils import ensure_text_type, get_value, isoformat
+from marshmallow_jsonapi import fields, Schema
+from marshmallow_jsonapi.fields import BaseRelationship, _stringify
+
+import marshmallow
+import marshmallow_jsonapi
+import threading
+import weakref
+
+
+# Schema methods whose stock behavior is inlined by the compiler.
+INLINED_METHODS = [
+    'dump', 'get_attribute', 'format_json_api_response', 'format_items',
+    'format_item', 'get_resource_links', '_postprocess',
+    '_invoke_dump_processors']
+
+# Whether the installed versions are the ones the compiler inlines.
+IS_SUPPORTED = marshmallow.__version__.split('.')[0] == '2' and \
+    marshmallow_jsonapi.__version__.split('.')[:2] == ['0', '20']
+
+_serializers = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+class MissingValue(Exception):
+    """Raised by compiled serializers to defer to `Schema.dump`."""
+
+
+def serialize(schema, models):
+    """Return the resource objects of a list of models.
+
+    The output is equal to `schema.dump(models, many=True)`'s "data"
+    member.  A `ValueError` is raised if marshmallow reports errors.
+    """
+    serializer = get_serializer(schema)
+    if serializer is not None:
+        try:
+            return serializer(models)
+        except (MissingValue, ValidationError):
+            pass
+
+    data, errors = schema.dump(models, many=True)
+    if errors:
+        raise ValueError(errors)
+    return data.get('data', [])
+
+
+def get_serializer(schema):
+    """Return the compiled serializer of a schema or `None`.
+
+    Serializers are compiled once per schema instance and recompiled
+    if the schema's fields are replaced.
+    """
+    with _lock:
+        serializer = _serializers.get(schema)
+        if serializer is None or serializer.fields is not schema.fields:
+            serializer = compile_schema(schema)
+            _serializers[schema] = serializer
+    return serializer.serialize
+
+
+def is_compilable(schema):
+    """Return `True` if a compiled serializer can match `Schema.dump`."""
+    if not IS_SUPPORTED or not isinstance(schema, Schema):
+        return False
+
+    cls = schema.__class__
+    for name in INLINED_METHODS:
+        if getattr(cls, name) is not getattr(Schema, name):
+            return False
+
+    processors = schema.__processors__
+    if processors.get((PRE_DUMP, False)) or \
+            processors.get((PRE_DUMP, True)) or \
+            processors.get((POST_DUMP, False)):
+        return False
+    if processors.get((POST_DUMP, True)) != ['format_json_api_response']:
+        return False
+
+    if schema.opts.self_url or schema.include_data or schema.prefix or \
+            schema.extra or schema.ordered:
+        return False
+
+    keys = set()
+    for name, field in schema.fields.items():
+        if field.load_only:
+            continue
+        if name not in schema.declared_fields:
+            return False
+        if not is_compilable_field(field):
+            return False
+        key = field.dump_to or name
+        if key in keys:
+            return False
+        keys.add(key)
+    return True
+
+
+def is_compilable_field(field):
+    """Return `True` if a field uses the stock value lookup."""
+    cls = field.__class__
+    if cls.serialize is not ma_fields.Field.serialize or \
+            cls.get_value is not ma_fields.Field.get_value:
+        return False
+    if isinstance(field, (fields.DocumentMeta, fields.ResourceMeta)):
+        return False
+    if isinstance(field, BaseRelationship) and \
+            getattr(field, 'include_data', False):
+        return False
+    return True
+
+
+class CompiledSerializer:
+    """Generated resource serializer of a single schema instance."""
+
+    def __init__(self, schema, fields, serialize):
+        self.schema = schema
+        self.fields = fields
+        self.serialize = serialize
+
+    def __repr__(self):
+        return '{}(schema={})'.format(self.__class__.__name__, self.schema)
+
+
+def compile_schema(schema):
+    """Return a `CompiledSerializer` of a schema.
+
+    The serializer's "serialize" member is `None` if the schema is not
+    compilable.
+    """
+    if not is_compilable(schema):
+        return CompiledSerializer(schema, schema.fields, None)
+
+    namespace = {
+        'missing': missing,
+        'MissingValue': MissingValue,
+        'ValidationError': ValidationError,
+        'get_value': get_value,
+        'ensure_text_type': ensure_text_type,
+        'isoformat': isoformat,
+        'stringify': _stringify,
+    }
+    source = '\n'.join([
+        _compile_item(schema, namespace, 'serialize_object', False),
+        _compile_item(schema, namespace, 'serialize_mapping', True),
+        'def serialize(models):',
+        '    output = []',
+        '    append = output.append',
+        '    for obj in models:',
+        '        if hasattr(type(obj), "__getitem__"):',
+        '            append(serialize_mapping(obj))',
+        '        else:',
+        '            append(serialize_object(obj))',
+        '    return output',
+    ])
+    code = compile(source, '<{} serializer>'.format(
+        schema.__class__.__name__), 'exec')
+    exec(code, namespace)
+    return CompiledSerializer(schema, schema.fields, namespace['serialize'])
+
+
+def _compile_item(schema, namespace, name, mapping):
+    """Return the source of a function serializing a single object.
+
+    :param mapping: Generate `get_value` lookups for objects supporting
+        item access instead of attribute lookups.
+    """
+    lines = [
+        'def {}(obj):'.format(name),
+        '    ret = {{"type": {!r}}}'.format(schema.opts.type_)]
+    has_attributes = False
+
+    for position, (field_name, field) in enumerate(schema.fields.items()):
+        if field.load_only:
+            continue
+
+        key = schema.inflect(field.dump_to or field_name)
+        is_relationship = isinstance(field, BaseRelationship)
+
+        if type(field) is fields.Relationship and \
+                not field.related_url and not field.self_url:
+            # Relationship objects without links or linkage are empty
+            # and are dropped from the resource object.
+            if not field.include_resource_linkage:
+                continue
+            namespace['get_id_{}'.format(position)] = field._get_id
+            lines.extend(_compile_lookup(field, field_name, mapping))
+            lines.extend(_compile_linkage(field, position))
+        else:
+            lines.extend(_compile_lookup(field, field_name, mapping))
+            lines.extend(_compile_value(field, field_name, position, namespace))
+
+        if field_name == 'id':
+            lines.append('    ret["id"] = value')
+        elif is_relationship:
+            lines.append('    if value:')
+            lines.append(
+                '        ret.setdefault("relationships", {{}})[{!r}] = '
+                'value'.format(key))
+        else:
+            if not has_attributes:
+                lines.append('    attributes = ret["attributes"] = {}')
+                has_attributes = True
+            lines.append('    attributes[{!r}] = value'.format(key))
+
+    lines.append('    return ret')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _compile_lookup(field, field_name, mapping):
+    if not field._CHECK_ATTRIBUTE:
+        return ['    value = None']
+
+    attribute = field.attribute or field_name
+    if mapping or '.' in attribute:
+        return [
+            '    value = get_value({!r}, obj, missing)'.format(attribute),
+            '    if value is missing:',
+            '        raise MissingValue({!r})'.format(attribute)]
+    return [
+        '    value = getattr(obj, {!r}, missing)'.format(attribute),
+        '    if value is missing:',
+        '        raise MissingValue({!r})'.format(attribute),
+        '    if callable(value):',
+        '        value = value()']
+
+
+def _compile_value(field, field_name, position, namespace):
+    cls = type(field)
+    if cls is ma_fields.String:
+        return [
+            '    if value is not None and type(value) is not str:',
+            '        value = ensure_text_type(value)']
+    if cls in (ma_fields.Integer, ma_fields.Float) and not field.as_string:
+        return [
+            '    if value is not None and type(value) is not {}:'.format(
+                field.num_type.__name__),
+            '        try:',
+            '            value = {}(value)'.format(field.num_type.__name__),
+            '        except (TypeError, ValueError):',
+            '            raise ValidationError({!r})'.format(field_name)]
+    if cls is ma_fields.DateTime and \
+            field.dateformat in (None, 'iso', 'iso8601'):
+        return [
+            '    if value is not None:',
+            '        value = isoformat(value, localtime={!r})'.format(
+                field.localtime)]
+    if cls is ma_fields.Date:
+        return [
+            '    if value is not None:',
+            '        value = value.isoformat()']
+
+    name = 'serialize_{}'.format(position)
+    namespace[name] = field._serialize
+    return [
+        '    value = {}(value, {!r}, obj)'.format(name, field_name),
+        '    if value is missing:',
+        '        raise MissingValue({!r})'.format(field_name)]
+
+
+def _compile_linkage(field, position):
+    get_id = 'get_id_{}'.format(position)
+    if field.many:
+        linkage = '[{{"type": {!r}, "id": stringify({}(each))}} ' \
+            'for each in value]'.format(field.type_, get_id)
+        empty = '[]'
+    else:
+        linkage = '{{"type": {!r}, "id": stringify({}(value))}}'.format(
+            field.type_, get_id)
+        empty = 'None'
+    return [
+        '    if value is None:',
+        '        value = {{"data": {}}}'.format(empty),
+        '    else:',
+        '        value = {{"data": {}}}'.format(linkage)]
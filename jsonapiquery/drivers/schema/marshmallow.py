@@ -1,10 +1,17 @@
+from collections import OrderedDict
 from jsonapiquery import errors
 from jsonapiquery.drivers import DriverBase
+from jsonapiquery.drivers.schema import compiler
 from marshmallow import ValidationError
+from marshmallow.base import SchemaABC
 from marshmallow_jsonapi import fields
 
+import threading
+
 
 class DriverSchemaMarshmallow(DriverBase):
+    # Attribute name counting a relationship's resources: "comments.count".
+    COUNT_ATTRIBUTE = 'count'
 
     def parse_if_attribute(self, item, obj):
         init_kwargs = super().parse_if_attribute(item, obj)
@@ -14,6 +21,9 @@ class DriverSchemaMarshmallow(DriverBase):
         return init_kwargs
 
     def parse_attribute(self, field_name, schema, item):
+        if field_name == self.COUNT_ATTRIBUTE and item.relationships and \
+                field_name not in schema.declared_fields:
+            return RelationshipCount(field_name, schema, item)
         return Attribute(field_name, schema, item)
 
     def parse_relationship(self, field_name, schema, item):
@@ -81,18 +91,178 @@ class Attribute(Field):
             raise errors.InvalidValue(message, self.item)
 
 
+class RelationshipCount(Attribute):
+    """Number of related resources of the last relationship of a path."""
+
+    is_count = True
+
+    def __init__(self, field_name, schema, item):
+        self.request_name = field_name
+        self.field_name = field_name
+        self.item = item
+        self.schema = schema
+        self.field = fields.Integer()
+
+
+class SchemaPool:
+    """Bounded pool of nested schema instances per thread.
+
+    Schemas are keyed by class, fieldset and context so relationship
+    schemas are built once per thread and reused between drivers and
+    requests.  Instances are never shared between threads, and the
+    state marshmallow-jsonapi keeps on a schema while dumping (included
+    data, document meta and context) is reset whenever one is returned.
+
+    :param max_size: Maximum number of pooled schemas per thread.  The
+        least recently used schema is discarded first.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def __repr__(self):
+        return '{}(size={})'.format(self.__class__.__name__, len(self))
+
+    @property
+    def _schemas(self):
+        schemas = getattr(self._local, 'schemas', None)
+        if schemas is None:
+            schemas = self._local.schemas = OrderedDict()
+        return schemas
+
+    def get(self, schema_class, only=None, exclude=(), context=None):
+        """Return this thread's pooled instance of "schema_class"."""
+        # Pooled schemas keep a copy so a parent's context mutated later
+        # neither leaks into other requests nor diverges from the key.
+        context = dict(context or {})
+        key = make_pool_key(schema_class, only, exclude, context)
+        if key is None:
+            return schema_class(only=only, exclude=exclude, context=context)
+
+        schemas = self._schemas
+        schema = schemas.get(key)
+        with self._lock:
+            if schema is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if schema is None:
+            schema = schemas[key] = schema_class(
+                only=only, exclude=exclude, context=context)
+            while len(schemas) > self.max_size:
+                schemas.popitem(last=False)
+        else:
+            schemas.move_to_end(key)
+            reset_schema(schema, context)
+        return schema
+
+    def clear(self):
+        """Discard the pooled schemas of every thread."""
+        self._local = threading.local()
+
+
+def reset_schema(schema, context):
+    """Reset the state a schema keeps between dumps."""
+    schema.context = dict(context)
+    if hasattr(schema, 'included_data'):
+        schema.included_data = {}
+    if hasattr(schema, 'document_meta'):
+        schema.document_meta = {}
+
+
+def make_pool_key(schema_class, only, exclude, context):
+    """Return a schema pool key or `None` if the arguments are unhashable."""
+    try:
+        return (
+            schema_class, None if only is None else frozenset(only),
+            frozenset(exclude or ()), frozenset(context.items()))
+    except TypeError:
+        return None
+
+
+schema_pool = SchemaPool()
+
+
 class Relationship(Field):
+    """Relationship segment of a parsed item's path.
+
+    The related schema's class and options are resolved on construction
+    and never modified afterwards so parsed items may be shared between
+    threads.  Each thread reads its own pooled schema instance.
+    """
+
+    # Pool used to build nested schemas.  `None` defers to the field.
+    pool = schema_pool
+
+    def __init__(self, field_name, schema, item):
+        super().__init__(field_name, schema, item)
+        self._schema = self.resolve_type()
+        self._pool_args = None
+        if isinstance(self._schema, SchemaABC):
+            field = self.field
+            self._pool_args = (
+                type(self._schema), getattr(field, 'only', None),
+                getattr(field, 'exclude', ()),
+                getattr(field, 'context', None))
 
     @property
     def type(self):
+        """Return the schema of the relationship's related resources."""
+        if self.pool is None or self._pool_args is None:
+            return self._schema
+        return self.pool.get(*self._pool_args)
+
+    def resolve_type(self):
+        """Return the field's schema of the relationship's related
+        resources.
+
+        The field builds and caches its schema once; it is only used to
+        read the schema's class when a pool is set.
+        """
         try:
             return self.field.schema
         except AttributeError:
             message = 'Field "{}" is not a relationship.'.format(self.request_name)
             raise errors.InvalidFieldType(message, self.item)
 
-    def serialize(self, models):
-        data, errors = self.type.dump(models, many=True)
-        if errors:
-            raise ValueError(errors)
-        return data.get('data', [])
+    @property
+    def schema_key(self):
+        """Return a key shared by relationships which serialize alike."""
+        return make_schema_key(self.type)
+
+    def identify(self, model):
+        """Return the (type, id) pair identifying a related model."""
+        return identify(self.type, model)
+
+    def identify_parent(self, model):
+        """Return the (type, id) pair identifying the relationship's owner."""
+        return identify(self.schema, model)
+
+    def serialize(self, models, cache=None):
+        """Return the resource objects of a list of models.
+
+        :param cache: Optional `jsonapiquery.cache.FragmentCache`.
+        """
+        if cache is not None:
+            return cache.serialize(self.type, models)
+        return compiler.serialize(self.type, models)
+
+
+def identify(schema, model):
+    """Return the (type, id) pair identifying a model serialized by schema."""
+    field = schema.fields['id']
+    value = schema.get_attribute(field.attribute or 'id', model, None)
+    return schema.opts.type_, str(value)
+
+
+def make_schema_key(schema):
+    """Return a key shared by schemas which serialize alike."""
+    only = None if schema.only is None else frozenset(schema.only)
+    return schema.__class__, only, frozenset(schema.exclude)
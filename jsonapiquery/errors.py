@@ -57,6 +57,7 @@ InvalidQuery = functools.partial(
     JSONAPIQueryError, detail='Invalid query specified.', code=4)
 InvalidPaginationValue = InvalidQuery = functools.partial(
     JSONAPIQueryError, detail='Pagination values must be integers.', code=5)
+UnindexedField = functools.partial(JSONAPIQueryError, code=6)
 
 
 def make_error_response(errors: list) -> dict:
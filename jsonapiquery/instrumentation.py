@@ -0,0 +1,321 @@
+"""Request lifecycle instrumentation.
+
+A trace collects per-stage timings and counters for a single request.
+Library functions report their stages to the current trace; when no
+trace is active each report costs a single context variable lookup.
+
+::
+
+    histograms = HistogramSink()
+    instrument_engine(engine)
+
+    with trace(histograms):
+        query, filters = jsonapiquery.filter_query(query, params, drivers)
+        ...
+
+    body = render_prometheus(histograms)
+
+Stages reported by the library:
+
+- "parse": URL parameter parsing.
+- "resolve": driver resolution of the parsed parameters.
+- "build.filter", "build.sort", "build.include", "build.paginate":
+  query construction.
+- "page" and "count": fetching a page and counting its total rows.
+  SQL execution within a stage is reported as "sql.<stage>" and the
+  remainder of "page" as "hydrate".
+- "include.load" and "include.serialize": compound document includes.
+
+Counters: "statements" executed, "rows" fetched by the library and
+"bytes" streamed.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from jsonapiquery.utils import make_context_var
+
+import bisect
+import functools
+import threading
+import time
+
+
+_trace = make_context_var('jsonapiquery_trace')
+_stage = make_context_var('jsonapiquery_stage')
+
+
+class Trace:
+    """Stage timings, in seconds, and counters of a single request."""
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        # Objects notified of stage boundaries through their "enter" and
+        # "exit" methods.  See `jsonapiquery.profiling`.
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{}(timings={}, counters={})'.format(
+            self.__class__.__name__, dict(self.timings), dict(self.counters))
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.timings[name] += seconds
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+
+class Stage:
+    """Timer of a named stage of the current trace."""
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.elapsed = 0.0
+        self.sql = 0.0
+
+    def __enter__(self):
+        self._token = _stage.set(self)
+        for listener in self.trace.listeners:
+            listener.enter(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self._start
+        for listener in self.trace.listeners:
+            listener.exit(self)
+        _stage.reset(self._token)
+        self.trace.add(self.name, self.elapsed)
+        if self.sql:
+            self.trace.add('sql.' + self.name, self.sql)
+
+
+class NullStage:
+    """Stage used when no trace is active."""
+
+    elapsed = 0.0
+    sql = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_stage = NullStage()
+
+
+@contextmanager
+def trace(*sinks, **labels):
+    """Collect a trace of the enclosed request.
+
+    The trace's total duration is recorded as the "request" stage and
+    the trace is passed to every sink's "record" method on exit.
+    """
+    current = Trace(labels)
+    token = _trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.add('request', time.perf_counter() - start)
+        _trace.reset(token)
+        for sink in sinks:
+            sink.record(current)
+
+
+def current_trace():
+    """Return the active trace or `None`."""
+    return _trace.get()
+
+
+def stage(name):
+    """Return a context manager timing a stage of the active trace."""
+    trace = _trace.get()
+    if trace is None:
+        return _null_stage
+    return Stage(trace, name)
+
+
+def add(name, seconds):
+    """Add a duration to the active trace."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def incr(name, value=1):
+    """Increment a counter of the active trace."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.incr(name, value)
+
+
+def bind(fn):
+    """Return a function running "fn" within the caller's trace and stage.
+
+    Used to report work submitted to other threads.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return fn
+    parent = _stage.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        trace_token = _trace.set(trace)
+        stage_token = _stage.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _stage.reset(stage_token)
+            _trace.reset(trace_token)
+    return wrapper
+
+
+def instrument_engine(engine):
+    """Report statement counts and SQL time of an engine's statements."""
+    from sqlalchemy import event
+
+    if not event.contains(engine, 'before_cursor_execute', _before_execute):
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        event.listen(engine, 'after_cursor_execute', _after_execute)
+
+
+def uninstrument_engine(engine):
+    from sqlalchemy import event
+
+    if event.contains(engine, 'before_cursor_execute', _before_execute):
+        event.remove(engine, 'before_cursor_execute', _before_execute)
+        event.remove(engine, 'after_cursor_execute', _after_execute)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, many):
+    # Start times are kept on the statement's execution context so a
+    # failing statement leaves nothing behind on the pooled connection.
+    if context is not None and _trace.get() is not None:
+        context.jsonapiquery_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, many):
+    trace = _trace.get()
+    start = getattr(context, 'jsonapiquery_start', None)
+    if trace is None or start is None:
+        return
+
+    elapsed = time.perf_counter() - start
+    trace.incr('statements')
+    trace.add('sql', elapsed)
+    current = _stage.get()
+    if current is not None:
+        current.sql += elapsed
+
+
+DEFAULT_BUCKETS = (
+    .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Cumulative histogram of observed durations."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, cumulative count) pairs."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket containing quantile "q"."""
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class HistogramSink:
+    """In-process sink aggregating traces into per-stage histograms."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = defaultdict(int)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        with self._lock:
+            self.requests += 1
+            for name, seconds in trace.timings.items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram(
+                        self.buckets)
+                histogram.observe(seconds)
+            for name, value in trace.counters.items():
+                self.counters[name] += value
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = defaultdict(int)
+            self.requests = 0
+
+
+def render_prometheus(sink, prefix='jsonapiquery'):
+    """Return a sink's metrics in the Prometheus text exposition format."""
+    with sink._lock:
+        requests = sink.requests
+        histograms = sorted(sink.histograms.items())
+        counters = sorted(sink.counters.items())
+
+    lines = [
+        '# HELP {}_requests_total Traced requests.'.format(prefix),
+        '# TYPE {}_requests_total counter'.format(prefix),
+        '{}_requests_total {}'.format(prefix, requests)]
+
+    name = '{}_stage_seconds'.format(prefix)
+    lines.append('# HELP {} Request stage durations.'.format(name))
+    lines.append('# TYPE {} histogram'.format(name))
+    for stage_name, histogram in histograms:
+        label = 'stage="{}"'.format(_escape(stage_name))
+        for bound, count in histogram.cumulative():
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, label, _format_bound(bound), count))
+        lines.append('{}_sum{{{}}} {}'.format(name, label, histogram.sum))
+        lines.append('{}_count{{{}}} {}'.format(
+            name, label, histogram.count))
+
+    for counter_name, value in counters:
+        name = '{}_{}_total'.format(prefix, counter_name)
+        lines.append('# TYPE {} counter'.format(name))
+        lines.append('{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
@@ -0,0 +1,377 @@
+"""Sampled per-request CPU and memory profiling.
+
+A sampled request is profiled with cProfile and tracemalloc.  Profiles
+are attributed to the instrumentation stages (see
+`jsonapiquery.instrumentation`): each stage has its own profiler, which
+is paused while nested stages run, and its own traced memory delta.
+Time spent outside of any library stage is attributed to "request".
+
+Requests are sampled when they carry the trigger header or at random
+with the configured rate.  At most one request is profiled at a time
+per process; requests arriving meanwhile run unprofiled.  Unsampled
+requests cost a random draw.
+
+::
+
+    profiler = Profiler(ProfileStore(directory='/tmp/profiles'), rate=0.001)
+
+    with profiler.profile(headers=request.headers, url=request.url):
+        query, filters = jsonapiquery.filter_query(query, params, drivers)
+        ...
+
+    profiler.store.list()
+"""
+from collections import OrderedDict
+from jsonapiquery import instrumentation
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+
+REQUEST_STAGE = 'request'
+
+
+class StageProfile:
+    """CPU and memory profile of a stage of a sampled request.
+
+    :param stats: `pstats.Stats` of the stage's own calls.
+    :param allocated: Net bytes allocated, and still alive on exit, by
+        the stage's own code.
+    :param calls: Number of times the stage was entered.
+    """
+
+    def __init__(self, name, stats, allocated, calls):
+        self.name = name
+        self.stats = stats
+        self.allocated = allocated
+        self.calls = calls
+
+    def __repr__(self):
+        return '{}(name={!r}, allocated={}, calls={})'.format(
+            self.__class__.__name__, self.name, self.allocated, self.calls)
+
+    def top(self, n=20, sort='cumulative'):
+        """Return the "n" most expensive functions as dictionaries."""
+        stats = self.stats
+        stats.sort_stats(sort)
+        rows = []
+        for function in stats.fcn_list[:n]:
+            calls, primitive, tottime, cumtime, _ = stats.stats[function]
+            rows.append({
+                'function': '{}:{}({})'.format(*function),
+                'calls': calls,
+                'tottime': tottime,
+                'cumtime': cumtime,
+            })
+        return rows
+
+    def format(self, n=20, sort='cumulative'):
+        """Return the "n" most expensive functions as pstats text."""
+        output = io.StringIO()
+        self.stats.stream = output
+        self.stats.sort_stats(sort).print_stats(n)
+        return output.getvalue()
+
+
+class Profile:
+    """CPU and memory profile of a sampled request.
+
+    :param stages: Mapping of stage names to `StageProfile` instances.
+    :param allocations: Largest allocation sites alive at the end of the
+        request as (location, bytes, count) tuples.
+    """
+
+    def __init__(self, id, labels, started, duration, stages, allocations):
+        self.id = id
+        self.labels = labels
+        self.started = started
+        self.duration = duration
+        self.stages = stages
+        self.allocations = allocations
+
+    def __repr__(self):
+        return '{}(id={!r}, duration={:.3f}, stages={})'.format(
+            self.__class__.__name__, self.id, self.duration,
+            list(self.stages))
+
+    def to_dict(self, n=20):
+        return {
+            'id': self.id,
+            'labels': self.labels,
+            'started': self.started,
+            'duration': self.duration,
+            'stages': {
+                name: {
+                    'allocated': stage.allocated,
+                    'calls': stage.calls,
+                    'functions': stage.top(n),
+                }
+                for name, stage in self.stages.items()},
+            'allocations': [
+                {'location': location, 'size': size, 'count': count}
+                for location, size, count in self.allocations[:n]],
+        }
+
+
+class ProfileStore:
+    """Bounded store of the most recent profiles.
+
+    Profiles are kept in memory and, when a directory is given, written
+    as "<id>.json" summaries and "<id>.<stage>.prof" files readable by
+    `pstats`.  The oldest profiles and their files are discarded first.
+    """
+
+    def __init__(self, max_profiles=20, directory=None):
+        self.max_profiles = max_profiles
+        self.directory = directory
+        self.profiles = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def add(self, profile):
+        if self.directory is not None:
+            self._write(profile)
+
+        with self._lock:
+            self.profiles[profile.id] = profile
+            discarded = []
+            while len(self.profiles) > self.max_profiles:
+                discarded.append(self.profiles.popitem(last=False)[1])
+
+        if self.directory is not None:
+            for profile in discarded:
+                self._remove(profile)
+
+    def get(self, id):
+        with self._lock:
+            return self.profiles.get(id)
+
+    def list(self):
+        """Return the stored profiles, most recent first."""
+        with self._lock:
+            return list(reversed(self.profiles.values()))
+
+    def clear(self):
+        with self._lock:
+            profiles = list(self.profiles.values())
+            self.profiles.clear()
+        if self.directory is not None:
+            for profile in profiles:
+                self._remove(profile)
+
+    def _paths(self, profile):
+        paths = [os.path.join(self.directory, profile.id + '.json')]
+        for name in profile.stages:
+            paths.append(os.path.join(
+                self.directory, '{}.{}.prof'.format(profile.id, name)))
+        return paths
+
+    def _write(self, profile):
+        summary, *stages = self._paths(profile)
+        with open(summary, 'w') as output:
+            json.dump(profile.to_dict(), output, indent=2)
+        for path, stage in zip(stages, profile.stages.values()):
+            stage.stats.dump_stats(path)
+
+    def _remove(self, profile):
+        for path in self._paths(profile):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class Profiler:
+    """Sample requests and profile them into a store.
+
+    :param store: `ProfileStore` receiving the profiles.
+    :param rate: Fraction of requests sampled at random.
+    :param header: Name of the request header forcing a sample.  Header
+        lookups are case insensitive; WSGI environ keys also match.
+    :param min_interval: Minimum number of seconds between two sampled
+        requests, forced or not.
+    :param authorize: Callable accepting the request headers and
+        returning whether the request may force a sample.  The header is
+        ignored without it so clients can not load the server at will.
+    :param memory: Whether memory allocations are traced.
+    :param frames: Number of frames tracemalloc stores per allocation.
+    """
+
+    def __init__(
+            self, store=None, rate=0.0, header='X-Profile', min_interval=0.0,
+            memory=True, frames=1, authorize=None):
+        self.store = store if store is not None else ProfileStore()
+        self.rate = rate
+        self.header = header
+        self.min_interval = min_interval
+        self.authorize = authorize
+        self.memory = memory
+        self.frames = frames
+        self._keys = {
+            header.lower(),
+            'http_' + header.lower().replace('-', '_')}
+        self._busy = threading.Lock()
+        self._last = float('-inf')
+
+    def is_sampled(self, headers=None):
+        """Return whether a request with the given headers is sampled."""
+        if time.monotonic() - self._last < self.min_interval:
+            return False
+        if headers and self.authorize is not None and \
+                any(key.lower() in self._keys for key in headers):
+            return bool(self.authorize(headers))
+        return bool(self.rate) and random.random() < self.rate
+
+    def profile(self, headers=None, **labels):
+        """Return a context manager profiling the enclosed request.
+
+        The context manager returns the `_Recorder` of a sampled request
+        and `None` otherwise.  Its "profile" attribute is set on exit.
+        """
+        if not self.is_sampled(headers):
+            return _null_scope
+        if not self._busy.acquire(blocking=False):
+            return _null_scope
+        self._last = time.monotonic()
+        return _ProfileScope(self, labels)
+
+
+class _NullScope:
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_scope = _NullScope()
+
+
+class _Recorder:
+    """Trace listener switching profilers at stage boundaries."""
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.thread = threading.get_ident()
+        self.profilers = {}
+        self.allocated = {}
+        self.calls = {}
+        self.stack = []
+        self.profile = None
+
+    def start(self):
+        self._push(REQUEST_STAGE)
+
+    def stop(self):
+        self._pop()
+
+    def enter(self, stage):
+        # Stages reported by worker threads are not profiled.
+        if threading.get_ident() == self.thread:
+            self._push(stage.name)
+
+    def exit(self, stage):
+        if threading.get_ident() == self.thread and \
+                self.stack and self.stack[-1][0] == stage.name:
+            self._pop()
+
+    def _push(self, name):
+        if self.stack:
+            self._suspend(*self.stack[-1])
+        profiler = self.profilers.get(name)
+        if profiler is None:
+            profiler = self.profilers[name] = cProfile.Profile()
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.stack.append((name, self._traced()))
+        profiler.enable()
+
+    def _pop(self):
+        name, memory = self.stack.pop()
+        self._suspend(name, memory)
+        if self.stack:
+            parent = self.stack.pop()[0]
+            self.stack.append((parent, self._traced()))
+            self.profilers[parent].enable()
+
+    def _suspend(self, name, memory):
+        self.profilers[name].disable()
+        self.allocated[name] = \
+            self.allocated.get(name, 0) + self._traced() - memory
+
+    def _traced(self):
+        if not self.memory:
+            return 0
+        return tracemalloc.get_traced_memory()[0]
+
+
+class _ProfileScope:
+
+    def __init__(self, profiler, labels):
+        self.profiler = profiler
+        self.labels = labels
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.recorder = _Recorder(profiler.memory)
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._tracing = profiler.memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start(profiler.frames)
+
+        self._trace = None
+        if instrumentation.current_trace() is None:
+            self._trace = instrumentation.trace(**self.labels)
+            self._trace.__enter__()
+        instrumentation.current_trace().listeners.append(self.recorder)
+        try:
+            self.recorder.start()
+        except Exception:
+            self._release()
+            raise
+        return self.recorder
+
+    def __exit__(self, *args):
+        recorder = self.recorder
+        try:
+            recorder.stop()
+            duration = time.perf_counter() - self._start
+            allocations = []
+            if self.profiler.memory:
+                snapshot = tracemalloc.take_snapshot()
+                allocations = [
+                    (str(stat.traceback), stat.size, stat.count)
+                    for stat in snapshot.statistics('lineno')[:50]]
+        finally:
+            self._release()
+
+        stages = OrderedDict(
+            (name, StageProfile(
+                name, pstats.Stats(profiler), recorder.allocated.get(name, 0),
+                recorder.calls[name]))
+            for name, profiler in recorder.profilers.items())
+        recorder.profile = Profile(
+            uuid.uuid4().hex, self.labels, self.started, duration, stages,
+            allocations)
+        self.profiler.store.add(recorder.profile)
+
+    def _release(self):
+        instrumentation.current_trace().listeners.remove(self.recorder)
+        if self._trace is not None:
+            self._trace.__exit__(None, None, None)
+        if self._tracing:
+            tracemalloc.stop()
+        self.profiler._busy.release()
@@ -0,0 +1,282 @@
+"""Slow request log keyed by normalized request shapes.
+
+Requests are fingerprinted by their parsed shape: filter paths and
+strategies, sort keys, include paths and paginator strategies, without
+any literal values.  Requests slower than a threshold are aggregated
+per fingerprint with the SQL they executed.  Statements slower than a
+second threshold also capture their query plan, fetched on a separate
+pooled connection once the request ends.
+
+::
+
+    recorder = SlowRequestRecorder(engine, threshold=0.25)
+
+    with recorder.request(filters, sorts, includes, paginators):
+        models, total, links = execute_query(...)
+
+    report = recorder.dump()
+"""
+from collections import namedtuple
+from jsonapiquery.utils import make_context_var
+from sqlalchemy import event
+
+import threading
+import time
+
+
+_request = make_context_var('jsonapiquery_slow_request')
+
+Statement = namedtuple('Statement', ['statement', 'seconds', 'plan'])
+
+
+def fingerprint_request(filters=(), sorts=(), includes=(), paginators=()):
+    """Return a literal-free description of a parsed request.
+
+    Filters and paginators are order independent; sorts and includes
+    keep their requested order.
+    """
+    parts = []
+    filters = sorted(
+        '{}:{}'.format(_path(item), _strategy(item)) for item in filters)
+    if filters:
+        parts.append('filter=' + ','.join(filters))
+    if sorts:
+        parts.append('sort=' + ','.join(
+            '{}{}'.format('-' if item.direction == '-' else '', _path(item))
+            for item in sorts))
+    if includes:
+        parts.append('include=' + ','.join(
+            '.'.join(_raw(item).relationships) for item in includes))
+    if paginators:
+        parts.append('page=' + ','.join(
+            sorted(item.strategy for item in paginators)))
+    return '&'.join(parts)
+
+
+def _raw(item):
+    """Return the URL parsed item a driver parsed item was built from."""
+    while not isinstance(item.source, str):
+        item = item.source
+    return item
+
+
+def _path(item):
+    raw = _raw(item)
+    return '.'.join(raw.relationships + [raw.attribute])
+
+
+def _strategy(item):
+    if isinstance(item.value, tuple):
+        return item.value[0]
+    # Unparsed values may carry a strategy prefix: "ilike:value".
+    strategy, separator, _ = str(item.value).partition(':')
+    return strategy if separator else 'eq'
+
+
+class RequestProfile:
+    """Aggregated timings of the slow requests sharing a fingerprint.
+
+    The statements of the slowest request are kept as a sample.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.statements = []
+
+    def __repr__(self):
+        return '{}(fingerprint={!r}, count={}, total={:.3f})'.format(
+            self.__class__.__name__, self.fingerprint, self.count, self.total)
+
+    def add(self, seconds, statements):
+        self.count += 1
+        self.total += seconds
+        if seconds >= self.max:
+            self.max = seconds
+            self.statements = statements
+
+    def to_dict(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else 0.0,
+            'statements': [
+                {'statement': item.statement, 'seconds': item.seconds,
+                 'plan': item.plan}
+                for item in self.statements],
+        }
+
+
+class _Request:
+
+    def __init__(self, recorder, fingerprint):
+        self.recorder = recorder
+        self.fingerprint = fingerprint
+        self.statements = []
+        self.starts = []
+        # (position, statement, parameters) of statements to explain.
+        self.pending = []
+
+
+class SlowRequestRecorder:
+    """Record slow requests and their SQL per request fingerprint.
+
+    Only statements executed in the request's own context (thread or
+    task) are recorded.
+
+    :param engine: SQLAlchemy engine whose statements are recorded.
+    :param threshold: Minimum request duration, in seconds, recorded.
+    :param explain_threshold: Minimum statement duration, in seconds,
+        for which the query plan is captured.  `None` disables plans.
+    :param max_fingerprints: Number of fingerprints kept.  The
+        fingerprint with the least total time is discarded first.
+    :param max_statements: Number of statements kept per request.
+    """
+
+    def __init__(
+            self, engine, threshold=0.5, explain_threshold=0.1,
+            max_fingerprints=100, max_statements=50):
+        self.engine = engine
+        self.threshold = threshold
+        self.explain_threshold = explain_threshold
+        self.max_fingerprints = max_fingerprints
+        self.max_statements = max_statements
+        self.profiles = {}
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def __repr__(self):
+        return '{}(fingerprints={})'.format(
+            self.__class__.__name__, len(self.profiles))
+
+    def close(self):
+        """Stop recording the engine's statements."""
+        event.remove(self.engine, 'before_cursor_execute', self._before_execute)
+        event.remove(self.engine, 'after_cursor_execute', self._after_execute)
+
+    def request(self, filters=(), sorts=(), includes=(), paginators=()):
+        """Return a context manager recording the enclosed request."""
+        fingerprint = fingerprint_request(filters, sorts, includes, paginators)
+        return _RequestScope(self, fingerprint)
+
+    def add(self, fingerprint, seconds, statements):
+        """Aggregate a request if it is slower than the threshold."""
+        if seconds < self.threshold:
+            return
+        with self._lock:
+            profile = self.profiles.get(fingerprint)
+            if profile is None:
+                profile = self.profiles[fingerprint] = RequestProfile(
+                    fingerprint)
+            profile.add(seconds, statements)
+
+            if len(self.profiles) > self.max_fingerprints:
+                fastest = min(
+                    self.profiles.values(), key=lambda item: item.total)
+                del self.profiles[fastest.fingerprint]
+
+    def top(self, n=10):
+        """Return the "n" profiles with the greatest total time."""
+        with self._lock:
+            profiles = list(self.profiles.values())
+        return sorted(profiles, key=lambda item: item.total, reverse=True)[:n]
+
+    def dump(self, n=None):
+        """Return the top profiles as JSON serializable dictionaries."""
+        return [
+            profile.to_dict()
+            for profile in self.top(n or self.max_fingerprints)]
+
+    def clear(self):
+        with self._lock:
+            self.profiles.clear()
+
+    def explain_statements(self, request):
+        """Fill in the query plans of a finished request's statements.
+
+        Plans are fetched on a separate pooled connection after the
+        request so a failing EXPLAIN never aborts the request's own
+        transaction.
+        """
+        try:
+            with self.engine.connect() as conn:
+                for position, statement, parameters in request.pending:
+                    plan = self.explain(conn, statement, parameters)
+                    request.statements[position] = \
+                        request.statements[position]._replace(plan=plan)
+        except Exception as error:
+            plan = ['{}: {}'.format(error.__class__.__name__, error)]
+            for position, _, _ in request.pending:
+                if request.statements[position].plan is None:
+                    request.statements[position] = \
+                        request.statements[position]._replace(plan=plan)
+        request.pending = []
+
+    def explain(self, conn, statement, parameters):
+        """Return the query plan of a statement as a list of rows.
+
+        :param conn: Connection the plan is fetched with.  It must not
+            be the connection of a transaction in progress.
+        """
+        if conn.dialect.name == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            prefix = 'EXPLAIN '
+
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return [tuple(row) for row in cursor.fetchall()]
+        except Exception as error:
+            return ['{}: {}'.format(error.__class__.__name__, error)]
+        finally:
+            cursor.close()
+
+    def _before_execute(
+            self, conn, cursor, statement, parameters, context, many):
+        request = _request.get()
+        if request is not None and request.recorder is self:
+            request.starts.append(time.perf_counter())
+
+    def _after_execute(
+            self, conn, cursor, statement, parameters, context, many):
+        request = _request.get()
+        if request is None or request.recorder is not self or \
+                not request.starts:
+            return
+
+        seconds = time.perf_counter() - request.starts.pop()
+        if len(request.statements) >= self.max_statements:
+            return
+
+        if self.explain_threshold is not None and not many and \
+                seconds >= self.explain_threshold and \
+                statement.lstrip()[:6].upper() == 'SELECT':
+            request.pending.append(
+                (len(request.statements), statement, parameters))
+        request.statements.append(Statement(statement, seconds, None))
+
+
+class _RequestScope:
+
+    def __init__(self, recorder, fingerprint):
+        self.request = _Request(recorder, fingerprint)
+
+    def __enter__(self):
+        self._token = _request.set(self.request)
+        self._start = time.perf_counter()
+        return self.request
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self._start
+        _request.reset(self._token)
+        request = self.request
+        if request.pending and seconds >= request.recorder.threshold:
+            request.recorder.explain_statements(request)
+        request.recorder.add(
+            request.fingerprint, seconds, request.statements)
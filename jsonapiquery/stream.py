@@ -0,0 +1,304 @@
+"""Streaming JSON:API document generation.
+
+Large pages are serialized in chunks and yielded as encoded bytes so a
+WSGI or ASGI response can send them as they are produced.
+
+::
+
+    def serialize(models):
+        return schema.dump(models, many=True).data['data']
+
+    query, includes = ...  # Filtered, sorted and paginated query.
+    body = stream_document(query, serialize, includes, links, meta)
+    return Response(body, content_type='application/vnd.api+json')
+
+Bulk exports stream the whole filtered and sorted result instead of a
+page, as newline delimited JSON or CSV::
+
+    query, includes = jsonapiquery.export_query(
+        query, params, drivers, max_rows=100000)
+    body = stream_ndjson(query, serialize, includes)
+    return Response(body, content_type='application/x-ndjson')
+"""
+from collections import OrderedDict
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+
+from jsonapiquery import instrumentation
+
+import csv
+import io
+import json
+import jsonapiquery
+
+
+def stream_document(
+        query, serialize, includes=(), links=None, meta=None,
+        chunk_size=500, dumps=json.dumps, spool_size=1024 * 1024,
+        cache=None, max_seen=100000):
+    """Return a generator of encoded JSON:API document chunks.
+
+    Rows are fetched "chunk_size" at a time with `yield_per` and each
+    chunk is serialized to the "data" array before it is released.  The
+    chunk's included resources are serialized at the same time,
+    deduplicated against every previous chunk, and buffered in a spooled
+    temporary file until the "data" array is closed.  A resource which
+    is primary data in a later chunk than the one including it is
+    dropped from the buffer when the "included" array is written.
+
+    The identities remembered for deduplication are capped at
+    "max_seen", the least recently seen being forgotten first, so memory
+    stays bounded on large exports.  Past the cap a resource may be
+    included more than once, or also be primary data, and the document
+    is then not strictly JSON:API compliant.
+
+    Relationships are batch loaded per chunk by `serialize_includes` so
+    the query should not eagerly join included collections.
+
+    :param query: SQLAlchemy query.
+    :param serialize: Callable returning a list of resource objects for
+        a list of models.
+    :param includes: Parsed include items.
+    :param links: Top-level links object.
+    :param meta: Top-level meta object.
+    :param chunk_size: Number of rows fetched and serialized at a time.
+    :param dumps: JSON encoding function.
+    :param spool_size: Included bytes buffered in memory before the
+        buffer is moved to disk.
+    :param cache: Optional `jsonapiquery.cache.FragmentCache` used to
+        serialize included resources.
+    :param max_seen: Number of (type, id) pairs remembered to
+        deduplicate included resources.  `None` removes the cap.
+    """
+    # The generator may be consumed after the request's trace has ended
+    # so the trace is captured when the document is created.
+    chunks = _iter_document(
+        query, serialize, includes, links, meta, chunk_size, dumps,
+        spool_size, cache, max_seen)
+    return _instrument(chunks)
+
+
+def stream_ndjson(
+        query, serialize, includes=(), chunk_size=500, dumps=json.dumps,
+        cache=None, max_seen=100000):
+    """Return a generator of encoded newline delimited JSON chunks.
+
+    Each resource object is written on its own line.  Rows are fetched
+    "chunk_size" at a time with `yield_per`, which streams results from
+    a server-side cursor where the driver supports it.  Each chunk's
+    primary resources are followed by its included resources, which are
+    batch loaded per chunk and deduplicated against every previous
+    chunk.
+
+    Accepts the same arguments as `stream_document`.
+    """
+    return _instrument(
+        _iter_ndjson(
+            query, serialize, includes, chunk_size, dumps, cache, max_seen))
+
+
+def stream_csv(query, serialize, fields=None, chunk_size=500, **fmtparams):
+    """Return a generator of encoded CSV chunks.
+
+    The header row holds "id" followed by the attribute names.  Each
+    resource object is written as a row of its id and attributes; values
+    which are neither strings nor numbers are JSON encoded and missing
+    values are left empty.
+
+    :param query: SQLAlchemy query.
+    :param serialize: Callable returning a list of resource objects for
+        a list of models.
+    :param fields: Attribute names written, for example the requested
+        fieldset.  Defaults to the attributes of the first resource.
+    :param chunk_size: Number of rows fetched and serialized at a time.
+    :param fmtparams: `csv.writer` formatting parameters.
+    """
+    return _instrument(
+        _iter_csv(query, serialize, fields, chunk_size, fmtparams))
+
+
+def _instrument(chunks):
+    trace = instrumentation.current_trace()
+    if trace is None:
+        return chunks
+    return _count_bytes(chunks, trace)
+
+
+def _count_bytes(chunks, trace):
+    for chunk in chunks:
+        trace.incr('bytes', len(chunk))
+        yield chunk
+
+
+class _SeenSet:
+    """Set of identities holding at most "max_size" of them.
+
+    The least recently added or found identity is discarded first.
+    Identities of included resources are flagged as such.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        if key not in self._items:
+            return False
+        self._items.move_to_end(key)
+        return True
+
+    def is_included(self, key):
+        return self._items.get(key, False)
+
+    def add(self, key, included=False):
+        self._items[key] = included
+        self._items.move_to_end(key)
+        if self.max_size is not None and len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+
+def _iter_document(
+        query, serialize, includes, links, meta, chunk_size, dumps,
+        spool_size, cache, max_seen):
+    seen = _SeenSet(max_seen)
+    # Identities included by a chunk and primary data in a later one.
+    dropped = set()
+    with SpooledTemporaryFile(max_size=spool_size) as included:
+        yield b'{"data":['
+        separator = b''
+        for models in iter_chunks(query, chunk_size):
+            # Includes are loaded first so that resource linkage in the
+            # primary data does not lazy load the same relationships.
+            if includes:
+                for key in jsonapiquery.identify_models(includes, models):
+                    if seen.is_included(key):
+                        dropped.add(key)
+                    seen.add(key)
+                data = jsonapiquery.serialize_includes(
+                    includes, models, seen, cache)
+                for item in data:
+                    key = (item['type'], str(item['id']))
+                    seen.add(key, included=True)
+                    included.write(_encode_included(key, item, dumps))
+
+            data = serialize(models)
+            if data:
+                yield separator + _encode_items(data, dumps)
+                separator = b','
+        yield b']'
+
+        if includes:
+            yield b',"included":['
+            included.seek(0)
+            yield from _iter_included(included, dropped)
+            yield b']'
+
+    if links is not None:
+        yield b',"links":' + dumps(links).encode('utf-8')
+    if meta is not None:
+        yield b',"meta":' + dumps(meta).encode('utf-8')
+    yield b'}'
+
+
+def _encode_included(key, item, dumps):
+    """Return a spooled line of an included resource and its identity.
+
+    Line breaks in the encoded resource can only be whitespace and are
+    replaced so each resource takes one line.
+    """
+    data = dumps(item).encode('utf-8').replace(b'\n', b' ')
+    return json.dumps(key).encode('utf-8') + b'\t' + data + b'\n'
+
+
+def _iter_included(spool, dropped, size=64 * 1024):
+    """Yield the comma separated spooled resources not in "dropped"."""
+    buffer = []
+    length = 0
+    separator = b''
+    for line in spool:
+        key, _, data = line.rstrip(b'\n').partition(b'\t')
+        if dropped and tuple(json.loads(key.decode('utf-8'))) in dropped:
+            continue
+        buffer.append(separator + data)
+        length += len(data) + 1
+        separator = b','
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _iter_ndjson(
+        query, serialize, includes, chunk_size, dumps, cache, max_seen):
+    seen = _SeenSet(max_seen)
+    for models in iter_chunks(query, chunk_size):
+        included = []
+        if includes:
+            seen.update(jsonapiquery.identify_models(includes, models))
+            included = jsonapiquery.serialize_includes(
+                includes, models, seen, cache)
+
+        lines = [dumps(item) for item in serialize(models)]
+        lines.extend(dumps(item) for item in included)
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _iter_csv(query, serialize, fields, chunk_size, fmtparams):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, **fmtparams)
+    if fields is not None:
+        fields = list(fields)
+        writer.writerow(['id'] + fields)
+
+    for models in iter_chunks(query, chunk_size):
+        resources = serialize(models)
+        if fields is None and resources:
+            fields = list(resources[0].get('attributes', {}))
+            writer.writerow(['id'] + fields)
+
+        for resource in resources:
+            attributes = resource.get('attributes', {})
+            writer.writerow([resource.get('id')] + [
+                _format_csv_value(attributes.get(field)) for field in fields])
+        yield from _flush(buffer)
+    yield from _flush(buffer)
+
+
+def _flush(buffer):
+    value = buffer.getvalue()
+    if value:
+        buffer.seek(0)
+        buffer.truncate()
+        yield value.encode('utf-8')
+
+
+def _format_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (str, int, float)):
+        return value
+    return json.dumps(value)
+
+
+def iter_chunks(query, chunk_size):
+    """Return a generator of model lists fetched with `yield_per`."""
+    rows = iter(query.yield_per(chunk_size))
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        instrumentation.incr('rows', len(chunk))
+        yield chunk
+
+
+def _encode_items(items, dumps):
+    return b','.join(dumps(item).encode('utf-8') for item in items)
@@ -5,4 +5,18 @@ FieldSet = namedtuple('FieldSet', ['source', 'type', 'fields'])
 Filter = namedtuple('Filter', ['source', 'relationships', 'attribute', 'value'])
 Include = namedtuple('Include', ['source', 'relationships'])
 Sort = namedtuple('Sort', ['source', 'relationships', 'attribute', 'direction'])
+Count = namedtuple('Count', ['source', 'relationships'])
+Facet = namedtuple('Facet', ['source', 'relationships', 'attribute'])
 Paginator = namedtuple('Paginator', ['source', 'strategy', 'value'])
+IncludeLimit = namedtuple(
+    'IncludeLimit', ['source', 'relationships', 'limit', 'sorts'])
+Validator = namedtuple('Validator', ['etag', 'last_modified', 'total'])
+IncludeNode = namedtuple('IncludeNode', ['include', 'depth', 'children'])
+
+
+class Includes(list):
+    """Parsed includes and the per-parent limits they were joined with."""
+
+    def __init__(self, includes=(), limits=()):
+        super().__init__(includes)
+        self.limits = list(limits)
@@ -1,4 +1,5 @@
-from jsonapiquery.types import FieldSet, Filter, Include, Sort, Paginator
+from jsonapiquery.types import (
+    Count, Facet, FieldSet, Filter, Include, IncludeLimit, Sort, Paginator)
 from typing import Any, Generator
 
 
@@ -18,6 +19,28 @@ def iter_filters(params: dict) -> Generator[Filter, None, None]:
         yield Filter('filter[{}]'.format(key), relationships, attribute, value)
 
 
+def iter_counts(params: dict) -> Generator[Count, None, None]:
+    """Return a generator of relationship count instructions."""
+    counts = params.get('meta[counts]', '')
+    counts = counts.split(',')
+    for count in counts:
+        if count == '':
+            continue
+        yield Count('meta[counts]', count.split('.'))
+
+
+def iter_facets(params: dict) -> Generator[Facet, None, None]:
+    """Return a generator of facet instructions."""
+    facets = params.get('meta[facets]', '')
+    facets = facets.split(',')
+    for facet in facets:
+        if facet == '':
+            continue
+        relationships = facet.split('.')
+        attribute = relationships.pop()
+        yield Facet('meta[facets]', relationships, attribute)
+
+
 def iter_paginators(params: dict) -> Generator[Paginator, None, None]:
     """Return a generator of pagination instructions."""
     for key, value in iter_namespace(params, 'page'):
@@ -26,6 +49,25 @@ def iter_paginators(params: dict) -> Generator[Paginator, None, None]:
         yield Paginator('page[{}]'.format(key), key, value)
 
 
+def iter_include_limits(
+        params: dict) -> Generator[IncludeLimit, None, None]:
+    """Return a generator of per-parent included relationship limits.
+
+    For example, "page[comments][limit]=5" limits every parent to five
+    comments ordered by the relationship's "sort[comments]" parameter.
+    """
+    for key, value in iter_namespace(params, 'page'):
+        path, separator, strategy = key.partition('][')
+        if not separator or strategy != 'limit' or path == '':
+            continue
+        relationships = path.split('.')
+        sort_source = 'sort[{}]'.format(path)
+        sorts = _iter_sorts(
+            sort_source, params.get(sort_source, ''), relationships)
+        yield IncludeLimit(
+            'page[{}]'.format(key), relationships, value, list(sorts))
+
+
 def iter_includes(params: dict) -> Generator[Include, None, None]:
     """Return a generator of include instructions."""
     includes = params.get('include', '')
@@ -38,7 +80,14 @@ def iter_includes(params: dict) -> Generator[Include, None, None]:
 
 def iter_sorts(params: dict) -> Generator[Sort, None, None]:
     """Return a generator of sort instructions."""
-    sorts = params.get('sort', '')
+    return _iter_sorts('sort', params.get('sort', ''))
+
+
+def _iter_sorts(source, sorts, prefix=()):
+    """Return a generator of the sort instructions of a parameter value.
+
+    :param prefix: Relationship path the sorted attributes belong to.
+    """
     sorts = sorts.split(',')
     for sort in sorts:
         if sort == '':
@@ -48,9 +97,9 @@ def iter_sorts(params: dict) -> Generator[Sort, None, None]:
         if sort.startswith('-') or sort.startswith('+'):
             direction, sort = sort[0], sort[1:]
 
-        relationships = sort.split('.')
+        relationships = list(prefix) + sort.split('.')
         attribute = relationships.pop()
-        yield Sort('sort', relationships, attribute, direction)
+        yield Sort(source, relationships, attribute, direction)
 
 
 def iter_namespace(params: dict, namespace: str) -> Generator[Any, None, None]:
@@ -1,4 +1,46 @@
-import sqlalchemy
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+import random
+import re
+import threading
+import warnings
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python 3.6
+    ContextVar = None
+
+
+class LocalVar:
+    """Thread-local stand-in for `contextvars.ContextVar`.
+
+    Values do not follow asyncio tasks; only used where `contextvars`
+    is unavailable.
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, 'value', self.default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+def make_context_var(name, default=None):
+    """Return a context variable, thread-local on Python 3.6."""
+    if ContextVar is None:
+        return LocalVar(name, default)
+    return ContextVar(name, default=default)
 
 
 class QueryCounter:
@@ -7,7 +49,8 @@ class QueryCounter:
         self.session = session
         self.engine = session.bind
         self.is_counting = False
-        sqlalchemy.event.listen(
+        from sqlalchemy import event
+        event.listen(
             self.engine, 'before_cursor_execute', self.callback)
 
     def __enter__(self):
@@ -24,3 +67,171 @@ class QueryCounter:
     def callback(self, *args, **kwargs):
         if self.is_counting:
             self.count += 1
+
+
+_include = make_context_var('jsonapiquery_include')
+_detector = make_context_var('jsonapiquery_detector')
+
+
+@contextmanager
+def include_scope(path, relationship):
+    """Attribute the enclosed statements to an include path.
+
+    :param path: Dotted include path, for example "student.school".
+    :param relationship: Relationship being loaded or serialized.
+    """
+    token = _include.set((path, relationship))
+    try:
+        yield
+    finally:
+        _include.reset(token)
+
+
+def current_include():
+    """Return the active (include path, relationship) pair or `None`."""
+    return _include.get()
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])\d+(?:\.\d+)?(?![\w.])')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\$\d+')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint_statement(statement):
+    """Return a statement with literals and placeholders normalized.
+
+    String and numeric literals and bind placeholders are replaced with
+    "?" and lists of them are collapsed so statements differing only by
+    their values (or the length of an IN list) share a fingerprint.
+    """
+    statement = _STRING.sub('?', statement)
+    statement = _PLACEHOLDER.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _LIST.sub('(?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+Detection = namedtuple(
+    'Detection', ['fingerprint', 'count', 'include', 'relationship'])
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+class _DetectorScope:
+    """Statements fingerprinted by a single entry of a detector."""
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.engine = detector.engine.engine
+        self.counts = Counter()
+        self.sources = {}
+        self.token = None
+
+    def record(self, statement):
+        fingerprint = fingerprint_statement(statement)
+        self.counts[fingerprint] += 1
+        if fingerprint not in self.sources:
+            self.sources[fingerprint] = current_include() or (None, None)
+
+
+_listen_lock = threading.Lock()
+
+
+def _listen_statements(engine):
+    """Install the engine's statement listener shared by every detector.
+
+    The listener stays installed; it only records statements while a
+    detector scope is active in the executing context.
+    """
+    from sqlalchemy import event
+
+    with _listen_lock:
+        if not event.contains(engine, 'before_cursor_execute', _on_execute):
+            event.listen(engine, 'before_cursor_execute', _on_execute)
+
+
+def _on_execute(conn, cursor, statement, *args):
+    scope = _detector.get()
+    if scope is not None and scope.engine is conn.engine:
+        scope.record(statement)
+
+
+class NPlusOneDetector:
+    """Detect statements repeated within a request scope.
+
+    Statements executed on the engine within the ``with`` block, and in
+    the same context, are fingerprinted.  A fingerprint executed more
+    than "threshold" times is reported once on exit with the include
+    path and relationship which were being loaded when it first ran.
+
+    One statement listener per engine is installed with the first
+    detector and never removed.  A detector may be shared and entered
+    concurrently from several threads or tasks; "detections" holds the
+    result of the last scope to exit.
+
+    ::
+
+        with NPlusOneDetector(engine, threshold=3, action='raise'):
+            jsonapiquery.serialize_includes(includes, models)
+
+    :param engine: SQLAlchemy engine or connection.
+    :param threshold: Executions of a fingerprint allowed per scope.
+    :param action: "warn" to emit an `NPlusOneWarning` or "raise" to
+        raise an `NPlusOneError`.
+    :param sample_rate: Fraction of scopes which are inspected.
+    """
+
+    ACTIONS = ['warn', 'raise']
+
+    def __init__(self, engine, threshold=10, action='warn', sample_rate=1.0):
+        if action not in self.ACTIONS:
+            raise ValueError('Unknown action: {}.'.format(action))
+        self.engine = engine
+        self.threshold = threshold
+        self.action = action
+        self.sample_rate = sample_rate
+        self.detections = []
+        self.is_sampled = False
+        _listen_statements(engine.engine)
+
+    def __enter__(self):
+        self.detections = []
+        self.is_sampled = random.random() < self.sample_rate
+        if self.is_sampled:
+            scope = _DetectorScope(self)
+            scope.token = _detector.set(scope)
+        return self
+
+    def __exit__(self, exc_type, *args):
+        scope = _detector.get()
+        if scope is None or scope.detector is not self:
+            return
+        _detector.reset(scope.token)
+
+        self.detections = [
+            Detection(fingerprint, count, *scope.sources[fingerprint])
+            for fingerprint, count in scope.counts.items()
+            if count > self.threshold]
+        if not self.detections or exc_type is not None:
+            return
+
+        message = '\n'.join(map(self.format, self.detections))
+        if self.action == 'raise':
+            raise NPlusOneError(message)
+        warnings.warn(message, NPlusOneWarning, stacklevel=2)
+
+    def format(self, detection):
+        source = ''
+        if detection.include is not None:
+            source = ' while loading include "{}" ({})'.format(
+                detection.include, detection.relationship)
+        return 'Statement executed {} times (threshold {}){}: {}'.format(
+            detection.count, self.threshold, source, detection.fingerprint)
@@ -14,12 +14,13 @@ setup(
     author_email='colton.allen@caxiam.com',
     description='A JSONAPI compliant query library.',
     long_description=__doc__,
-    packages=find_packages(exclude=("test*", )),
+    packages=find_packages(exclude=("test*", "benchmarks*")),
     package_dir={'jsonapi-query': 'jsonapi-query'},
     zip_safe=False,
     include_package_data=True,
     platforms='any',
     install_requires=[],
+    extras_require={'numpy': ['numpy']},
     classifiers=[
         'Environment :: Web Environment',
         'Intended Audience :: Developers',
@@ -1,15 +1,23 @@
+from nose.tools import assert_raises
+from unittest import mock
+
 from sqlalchemy.orm import Query
 
+from jsonapiquery import errors
 from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
 from jsonapiquery.database.sqlalchemy import QueryMixin
+from jsonapiquery.drivers.model.sqlalchemy import Mapper
+from jsonapiquery.drivers.schema.marshmallow import Relationship
 from jsonapiquery.types import *
+from jsonapiquery.utils import QueryCounter
 from tests.marshmallow_jsonapi import Category as CategorySchema
+from tests.marshmallow_jsonapi import Person as PersonSchema
 from tests.sqlalchemy import *
 
 import jsonapiquery
 
 
-class SerializationTestCase(BaseSQLAlchemyTestCase):
+class BaseSerializationTestCase(BaseSQLAlchemyTestCase):
 
     def setUp(self):
         """Set the query class and create a set of rows to test against."""
@@ -26,6 +34,9 @@ class SerializationTestCase(BaseSQLAlchemyTestCase):
             include = driver.parse(include)
         return include
 
+
+class SerializationTestCase(BaseSerializationTestCase):
+
     def make_category_structure(self):
         category1 = Category(name='parent')
         self.session.add(category1)
@@ -44,9 +55,11 @@ class SerializationTestCase(BaseSQLAlchemyTestCase):
 
         include = self.make_include(['category', 'categories'], drivers)
         result = jsonapiquery.serialize_includes([include], [category2])
+
+        # The child category is primary data and is not included.
         self.assertTrue(result == [
-            {'type': 'categories', 'attributes': {'name': 'parent'}, 'id': 1},
-            {'type': 'categories', 'attributes': {'name': 'child'}, 'id': 2}
+            {'type': 'categories', 'attributes': {'name': 'parent'},
+             'id': category1.id}
         ])
 
     def test_serialize_null_one_to_many_relationship(self):
@@ -61,9 +74,11 @@ class SerializationTestCase(BaseSQLAlchemyTestCase):
 
         include = self.make_include(['categories', 'category'], drivers)
         result = jsonapiquery.serialize_includes([include], [category1])
+
+        # The parent category is primary data and is not included.
         self.assertTrue(result == [
-            {'type': 'categories', 'attributes': {'name': 'child'}, 'id': 2},
-            {'type': 'categories', 'attributes': {'name': 'parent'}, 'id': 1}
+            {'type': 'categories', 'attributes': {'name': 'child'},
+             'id': category2.id}
         ])
 
     def test_serialize_null_many_to_many_relationship(self):
@@ -72,3 +87,267 @@ class SerializationTestCase(BaseSQLAlchemyTestCase):
         include = self.make_include(['categories', 'category'], drivers)
         result = jsonapiquery.serialize_includes([include], [category2])
         self.assertTrue(result == [])
+
+    def test_serialize_deduplicated_relationships(self):
+        """Test shared related models are included once."""
+        drivers, category1, category2 = self.make_category_structure()
+        category3 = Category(name='sibling', category=category1)
+        self.session.add(category3)
+        self.session.commit()
+
+        include = self.make_include(['category'], drivers)
+        result = jsonapiquery.serialize_includes(
+            [include], [category2, category3])
+        self.assertTrue(result == [
+            {'type': 'categories', 'attributes': {'name': 'parent'},
+             'id': category1.id}
+        ])
+
+    def test_serialize_deduplicated_include_paths(self):
+        """Test resources reached by several include paths are included once."""
+        drivers, category1, category2 = self.make_category_structure()
+        category3 = Category(name='sibling', category=category1)
+        self.session.add(category3)
+        self.session.commit()
+
+        includes = [
+            self.make_include(['category'], drivers),
+            self.make_include(['category', 'categories'], drivers)]
+        result = jsonapiquery.serialize_includes(includes, [category2])
+        self.assertTrue(result == [
+            {'type': 'categories', 'attributes': {'name': 'parent'},
+             'id': category1.id},
+            {'type': 'categories', 'attributes': {'name': 'sibling'},
+             'id': category3.id}
+        ])
+
+    def test_serialize_batched_levels(self):
+        """Test each include level is serialized with one dump."""
+        drivers, category1, category2 = self.make_category_structure()
+        category3 = Category(name='grandchild', category=category2)
+        self.session.add(category3)
+        self.session.commit()
+
+        def serialize(relationship, models, cache=None):
+            return [model.id for model in models]
+
+        includes = [
+            self.make_include(['category'], drivers),
+            self.make_include(['categories'], drivers)]
+        with mock.patch.object(
+                Relationship, 'serialize', autospec=True,
+                side_effect=serialize) as mock_serialize:
+            result = jsonapiquery.serialize_includes(includes, [category2])
+
+        self.assertTrue(mock_serialize.call_count == 1)
+        self.assertTrue(result == [category1.id, category3.id])
+
+    def test_make_include_tree(self):
+        """Test include paths are merged by their shared prefixes."""
+        drivers, category1, category2 = self.make_category_structure()
+        includes = [
+            self.make_include(['category', 'categories'], drivers),
+            self.make_include(['category', 'category'], drivers),
+            self.make_include(['categories'], drivers)]
+
+        tree = jsonapiquery.make_include_tree(includes)
+        self.assertTrue(list(tree.children) == ['category', 'categories'])
+
+        node = tree.children['category']
+        self.assertTrue(node.include is includes[0])
+        self.assertTrue(node.depth == 0)
+        self.assertTrue(list(node.children) == ['categories', 'category'])
+        self.assertTrue(node.children['category'].include is includes[1])
+
+
+class BatchedLoadingTestCase(BaseSerializationTestCase):
+    """Test relationships which were not joined are loaded in bulk."""
+
+    def setUp(self):
+        super().setUp()
+        self.counter = QueryCounter(self.session)
+        self.drivers = [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+
+        schools = [School(name='School'), School(name='College')]
+        for index in range(6):
+            person = Person(name='Person {}'.format(index))
+            student = Student(school=schools[index % 2], person=person)
+            self.session.add(student)
+        self.session.commit()
+
+    def serialize_page(self, size):
+        include = self.make_include(['student', 'school'], self.drivers)
+        with self.counter as query_counter:
+            models = self.session.query(Person).limit(size).all()
+            result = jsonapiquery.serialize_includes([include], models)
+            return result, query_counter.count
+
+    def test_serialize_constant_query_count(self):
+        """Test the query count does not depend on the page size."""
+        result, small_count = self.serialize_page(2)
+        self.assertTrue(len(result) == 4)
+
+        result, large_count = self.serialize_page(6)
+        self.assertTrue(len(result) == 8)
+        self.assertTrue(small_count == large_count == 3)
+
+    def test_load_chunks(self):
+        """Test keys are chunked across batched statements."""
+        mapper = Mapper('student', Person, None)
+        with mock.patch.object(Mapper, 'BATCH_SIZE', 4):
+            with self.counter as query_counter:
+                models = self.session.query(Person).all()
+                mapper.load(models)
+                self.assertTrue(query_counter.count == 3)
+
+        for model in models:
+            self.assertTrue(len(model.student) == 1)
+
+    def test_load_filtered(self):
+        """Test extra join criteria restrict batch loaded models."""
+        categories = [Category(name='first'), Category(name='second')]
+        for category in categories:
+            for name in ['product', None]:
+                self.session.add(Product(name=name, primary_category=category))
+        self.session.flush()
+        self.session.expire_all()
+
+        lazy = [
+            [product.name for product in category.named_products]
+            for category in categories]
+        self.session.expire_all()
+        Mapper('named_products', Category, None).load(categories)
+        loaded = [
+            [product.name for product in category.named_products]
+            for category in categories]
+        self.assertTrue(lazy == loaded == [['product'], ['product']])
+
+
+class LimitedIncludeTestCase(BaseSerializationTestCase):
+    """Test included relationships limited per parent."""
+
+    def setUp(self):
+        super().setUp()
+        self.counter = QueryCounter(self.session)
+        self.drivers = [
+            DriverSchemaMarshmallow(CategorySchema()),
+            DriverModelSQLAlchemy(Category)]
+
+        self.parents = [Category(name='first'), Category(name='second')]
+        for parent, size in zip(self.parents, [5, 2]):
+            for index in range(size):
+                Category(name='{} {}'.format(parent.name, index),
+                         category=parent)
+            self.session.add(parent)
+        self.session.commit()
+
+    def serialize(self, params):
+        query, includes = jsonapiquery.include_query(
+            self.session.query(Category), params, self.drivers)
+        with self.counter as query_counter:
+            models = query.filter(
+                Category.name.in_(['first', 'second'])).all()
+            result = jsonapiquery.serialize_includes(includes, models)
+            return result, query_counter.count
+
+    def test_serialize_limited(self):
+        """Test each parent includes at most "limit" sorted children."""
+        params = {
+            'include': 'categories',
+            'page[categories][limit]': '3',
+            'sort[categories]': '-name'}
+        result, count = self.serialize(params)
+
+        self.assertTrue(count == 2)
+        self.assertTrue(
+            [resource['attributes']['name'] for resource in result] ==
+            ['first 4', 'first 3', 'first 2', 'second 1', 'second 0'])
+
+    def test_serialize_limited_nested(self):
+        """Test the children of a limited relationship are included."""
+        params = {
+            'include': 'categories.category',
+            'page[categories][limit]': '1'}
+        result, _ = self.serialize(params)
+
+        self.assertTrue(
+            [resource['attributes']['name'] for resource in result] ==
+            ['first 0', 'second 0'])
+
+    def test_include_query_limits(self):
+        """Test the parsed limits are returned with the includes."""
+        params = {'include': 'categories', 'page[categories][limit]': '3'}
+        _, includes = jsonapiquery.include_query(
+            self.session.query(Category), params, self.drivers)
+        self.assertTrue([limit.limit for limit in includes.limits] == [3])
+
+    def test_include_limits_max(self):
+        """Test per-parent limits are capped like page sizes."""
+        params = {'include': 'categories', 'page[categories][limit]': '101'}
+        assert_raises(
+            errors.JSONAPIQueryError, jsonapiquery.include_query,
+            self.session.query(Category), params, self.drivers)
+
+        _, includes = jsonapiquery.include_query(
+            self.session.query(Category), params, self.drivers,
+            max_limit=None)
+        self.assertTrue(includes.limits[0].limit == 101)
+
+    def test_include_limits_invalid(self):
+        params = {'include': 'categories', 'page[categories][limit]': '0'}
+        assert_raises(
+            errors.JSONAPIQueryError, jsonapiquery.include_limits, params,
+            self.drivers)
+
+        params = {
+            'include': 'categories', 'page[categories][limit]': '1',
+            'sort[categories]': 'category.name'}
+        assert_raises(
+            errors.JSONAPIQueryError, jsonapiquery.include_limits, params,
+            self.drivers)
+
+    def test_fetch_limited_secondary(self):
+        """Test many-to-many relationships are limited per parent."""
+        schools = [School(name='first'), School(name='second')]
+        for school, size in zip(schools, [3, 1]):
+            for index in range(size):
+                person = Person(name='{} {}'.format(school.name, index))
+                self.session.add(Student(school=school, person=person))
+        self.session.flush()
+
+        mapper = Mapper('people', School, None)
+        keys = [school.id for school in schools] + [0]
+        related = mapper.fetch_limited(self.session, keys, 2)
+
+        self.assertTrue(set(related) == {school.id for school in schools})
+        self.assertTrue(
+            [person.name for person in related[schools[0].id]] ==
+            ['first 0', 'first 1'])
+        self.assertTrue(
+            [person.name for person in related[schools[1].id]] ==
+            ['second 0'])
+
+    def test_fetch_limited_filtered(self):
+        """Test extra join criteria restrict the numbered models."""
+        parent = self.parents[0]
+        for name in [None, 'b', 'a']:
+            self.session.add(Product(name=name, primary_category=parent))
+        self.session.flush()
+
+        mapper = Mapper('named_products', Category, None)
+        related = mapper.fetch_limited(self.session, [parent.id], 1)
+        self.assertTrue(
+            [product.name for product in related[parent.id]] == ['b'])
+
+        school = School(name='first')
+        for index, status in enumerate(['inactive', 'active']):
+            person = Person(name='person {}'.format(index), status=status)
+            self.session.add(Student(school=school, person=person))
+        self.session.flush()
+
+        mapper = Mapper('active_people', School, None)
+        related = mapper.fetch_limited(self.session, [school.id], 1)
+        self.assertTrue(
+            [person.name for person in related[school.id]] == ['person 1'])
@@ -0,0 +1,158 @@
+from sqlalchemy.orm import Query
+
+from jsonapiquery.database.sqlalchemy import QueryMixin
+from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
+from jsonapiquery.stream import stream_csv, stream_document, stream_ndjson
+from jsonapiquery.types import *
+from tests.marshmallow_jsonapi import Category as CategorySchema
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.sqlalchemy import *
+
+import json
+import jsonapiquery
+
+
+class StreamTestCase(BaseSQLAlchemyTestCase):
+
+    def setUp(self):
+        """Set the query class and create a set of rows to test against."""
+        super().setUp()
+
+        class BaseQuery(QueryMixin, Query):
+            pass
+        self.session = sessionmaker(bind=self.engine, query_cls=BaseQuery)()
+        self.session.begin_nested()
+
+        self.schema = PersonSchema(only=('id', 'name'))
+        self.drivers = [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+
+        school = School(name='School')
+        for name in ['Fred', 'Carl', 'Bob']:
+            self.session.add(Student(school=school, person=Person(name=name)))
+        self.session.commit()
+        self.school = school
+
+    def serialize(self, models):
+        return self.schema.dump(models, many=True).data['data']
+
+    def make_include(self, relationships):
+        include = Include('include', relationships)
+        for driver in self.drivers:
+            include = driver.parse(include)
+        return include
+
+    def test_stream_document(self):
+        """Test streaming a document in chunks."""
+        query = self.session.query(Person).order_by(Person.id)
+        chunks = list(stream_document(
+            query, self.serialize, links={'self': '/people'},
+            meta={'total': 3}, chunk_size=2))
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+
+        document = json.loads(b''.join(chunks).decode('utf-8'))
+        self.assertTrue(
+            [item['attributes']['name'] for item in document['data']] ==
+            ['Fred', 'Carl', 'Bob'])
+        self.assertTrue('included' not in document)
+        self.assertTrue(document['links'] == {'self': '/people'})
+        self.assertTrue(document['meta'] == {'total': 3})
+
+    def test_stream_document_empty(self):
+        query = self.session.query(Person).filter(Person.id < 0)
+        document = b''.join(stream_document(query, self.serialize))
+        self.assertTrue(json.loads(document.decode('utf-8')) == {'data': []})
+
+    def test_stream_document_included(self):
+        """Test included resources are deduplicated across chunks."""
+        includes = [
+            self.make_include(['student']),
+            self.make_include(['student', 'school'])]
+        query = self.session.query(Person).order_by(Person.id)
+        document = b''.join(stream_document(
+            query, self.serialize, includes, chunk_size=1, spool_size=10))
+        document = json.loads(document.decode('utf-8'))
+
+        included = [(item['type'], item['id']) for item in document['included']]
+        self.assertTrue(len(document['data']) == 3)
+        self.assertTrue(len(included) == 4)
+        self.assertTrue(included.count(('schools', self.school.id)) == 1)
+
+    def test_stream_document_included_primary(self):
+        """Test resources which are primary data later are not included."""
+        parent = Category(name='parent')
+        for name in ['first', 'second']:
+            self.session.add(Category(name=name, category=parent))
+        self.session.flush()
+
+        schema = CategorySchema(only=('id', 'name'))
+        include = Include('include', ['categories'])
+        for driver in [
+                DriverSchemaMarshmallow(CategorySchema()),
+                DriverModelSQLAlchemy(Category)]:
+            include = driver.parse(include)
+        query = self.session.query(Category).order_by(Category.id)
+        document = b''.join(stream_document(
+            query, lambda models: schema.dump(models, many=True).data['data'],
+            [include], chunk_size=1))
+        document = json.loads(document.decode('utf-8'))
+
+        self.assertTrue(len(document['data']) == 3)
+        self.assertTrue(document['included'] == [])
+
+    def test_stream_document_max_seen(self):
+        """Test forgotten identities are included again past the cap."""
+        includes = [self.make_include(['student', 'school'])]
+        query = self.session.query(Person).order_by(Person.id)
+        document = b''.join(stream_document(
+            query, self.serialize, includes, chunk_size=1, max_seen=1))
+        document = json.loads(document.decode('utf-8'))
+
+        included = [(item['type'], item['id']) for item in document['included']]
+        self.assertTrue(included.count(('schools', self.school.id)) > 1)
+
+    def test_stream_ndjson(self):
+        """Test streaming resources and their includes as lines."""
+        includes = [self.make_include(['student', 'school'])]
+        query = self.session.query(Person).order_by(Person.id)
+        chunks = list(stream_ndjson(
+            query, self.serialize, includes, chunk_size=2))
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        items = [json.loads(line) for line in lines]
+
+        self.assertTrue(len(chunks) == 2)
+        self.assertTrue(
+            [item['type'] for item in items] ==
+            ['people', 'people', 'students', 'students', 'schools', 'people',
+             'students'])
+
+    def test_stream_csv(self):
+        query = self.session.query(Person).order_by(Person.id)
+        chunks = list(stream_csv(query, self.serialize, chunk_size=2))
+        rows = b''.join(chunks).decode('utf-8').splitlines()
+
+        self.assertTrue(len(chunks) == 2)
+        self.assertTrue(rows[0] == 'id,name')
+        self.assertTrue([row.split(',')[1] for row in rows[1:]] ==
+                        ['Fred', 'Carl', 'Bob'])
+
+    def test_stream_csv_empty(self):
+        query = self.session.query(Person).filter(Person.id < 0)
+        document = b''.join(stream_csv(query, self.serialize, ['name']))
+        self.assertTrue(document == b'id,name\r\n')
+
+    def test_export_query(self):
+        """Test exports are filtered and sorted but not paginated."""
+        params = {
+            'filter[name]': 'ilike:r', 'sort': '-name', 'include': 'student',
+            'page[limit]': '1'}
+        query, includes = jsonapiquery.export_query(
+            self.session.query(Person), params, self.drivers)
+        self.assertTrue(
+            [model.name for model in query] == ['Fred', 'Carl'])
+        self.assertTrue(len(includes) == 1)
+
+        query, _ = jsonapiquery.export_query(
+            self.session.query(Person), params, self.drivers, max_rows=1)
+        self.assertTrue([model.name for model in query] == ['Fred'])
@@ -50,11 +50,21 @@ class Category(Schema):
     name = fields.String()
     category = fields.Relationship(schema='Category')
     categories = fields.Relationship(schema='Category')
+    named_products = fields.Relationship(schema='Product')
 
     class Meta:
         inflect = dasherize
         type_ = 'categories'
 
 
+class Product(Schema):
+    id = fields.Integer()
+    name = fields.String()
+
+    class Meta:
+        inflect = dasherize
+        type_ = 'products'
+
+
 class BaseMarshmallowJSONAPITestCase(UnitTestCase):
     pass
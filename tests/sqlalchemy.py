@@ -22,6 +22,10 @@ class Category(Base):
 
     category = relationship(
         'Category', backref='categories', remote_side=[id], uselist=False)
+    named_products = relationship(
+        'Product', viewonly=True, primaryjoin=(
+            'and_(Category.id == Product.primary_category_id, '
+            'Product.name != None)'))
 
 
 class Product(Base):
@@ -92,6 +96,12 @@ class School(Base):
     image_id = Column(Integer, ForeignKey('image.id'))
 
     image = relationship('Image', backref='school')
+    people = relationship('Person', secondary='student', viewonly=True)
+    active_people = relationship(
+        'Person', secondary='student', viewonly=True,
+        primaryjoin='School.id == Student.school_id',
+        secondaryjoin=(
+            "and_(Student.person_id == Person.id, Person.status == 'active')"))
 
 
 class Flower(Base):
@@ -0,0 +1,95 @@
+"""Test filter and sort usage recording."""
+from nose.tools import assert_raises
+from sqlalchemy import Index, MetaData, Table
+from sqlalchemy.orm import Query, sessionmaker
+
+from jsonapiquery import errors
+from jsonapiquery.advisor import UsageRecorder, is_indexed
+from jsonapiquery.database.sqlalchemy import QueryMixin
+from jsonapiquery.drivers.model.sqlalchemy import Mapper, Column as ColumnType
+from jsonapiquery.types import Filter, Sort
+from tests.sqlalchemy import *
+
+
+class UsageRecorderTestCase(BaseSQLAlchemyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recorder = UsageRecorder()
+
+        class BaseQuery(QueryMixin, Query):
+            usage_recorder = self.recorder
+
+        self.session = sessionmaker(bind=self.engine, query_cls=BaseQuery)()
+        self.session.begin_nested()
+
+    def test_record_filters_and_sorts(self):
+        """Test recording filter strategies and sort directions."""
+        filter_ = Filter(
+            '', [], ColumnType('name', Person, None), ('ilike', ['Fred']))
+        sort = Sort('', [
+            Mapper('student', Person, None)],
+            ColumnType('school_id', Student, None), '-')
+
+        query = self.session.query(Person)
+        query.apply_filters([filter_, filter_]).apply_sorts([sort]).all()
+
+        usage = dict(self.recorder.usage)
+        self.assertTrue(usage[(Person, 'name', 'ilike', None)] == 2)
+        self.assertTrue(usage[(Student, 'student.school_id', None, '-')] == 1)
+
+    def test_advise_unindexed_columns(self):
+        """Test advising on hot unindexed columns."""
+        query = self.session.query(Person)
+        for _ in range(3):
+            query = query.apply_filter(Filter(
+                '', [], ColumnType('age', Person, None), ('gt', [1])))
+        query = query.apply_sort(
+            Sort('', [], ColumnType('name', Person, None), '+'))
+        query = query.apply_sort(
+            Sort('', [], ColumnType('id', Person, None), '+'))
+
+        advice = self.recorder.advise()
+        self.assertTrue(len(advice) == 2)
+        self.assertTrue(advice[0].column == 'age')
+        self.assertTrue(advice[0].count == 3)
+        self.assertTrue(
+            advice[0].statement == 'CREATE INDEX ix_person_age ON person (age)')
+        self.assertTrue(advice[1].column == 'name')
+
+    def test_enforce_indexed_sorts(self):
+        """Test enforcement mode rejects unindexed sorts."""
+        self.recorder.enforce = True
+        query = self.session.query(Person)
+
+        query.apply_sort(Sort('', [], ColumnType('id', Person, None), '-'))
+        sort = Sort('', [], ColumnType('name', Person, None), '-')
+        assert_raises(errors.JSONAPIQueryError, query.apply_sort, sort)
+
+    def test_enforce_restricted_strategies(self):
+        """Test enforcement mode only rejects restricted strategies."""
+        self.recorder.enforce = True
+        query = self.session.query(Person)
+
+        query.apply_filter(Filter(
+            '', [], ColumnType('name', Person, None), ('eq', ['Fred'])))
+        filter_ = Filter(
+            '', [], ColumnType('name', Person, None), ('like', ['Fred']))
+        assert_raises(errors.JSONAPIQueryError, query.apply_filter, filter_)
+
+    def test_is_indexed(self):
+        self.assertTrue(is_indexed(Person.__table__.c.id))
+        self.assertFalse(is_indexed(Person.__table__.c.name))
+
+    def test_is_indexed_composite(self):
+        """Test only the leading column of a composite key is indexed."""
+        table = Table(
+            'membership', MetaData(),
+            Column('group_id', Integer, primary_key=True),
+            Column('user_id', Integer, primary_key=True),
+            Column('role', Integer), Column('rank', Integer),
+            Index('ix_membership_role_rank', 'role', 'rank'))
+        self.assertTrue(is_indexed(table.c.group_id))
+        self.assertFalse(is_indexed(table.c.user_id))
+        self.assertTrue(is_indexed(table.c.role))
+        self.assertFalse(is_indexed(table.c.rank))
@@ -0,0 +1,163 @@
+"""Test serialized fragment caching."""
+from datetime import datetime
+from unittest import mock
+
+from jsonapiquery.cache import FragmentCache
+from jsonapiquery.drivers.schema import compiler
+from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
+from jsonapiquery.types import Include
+from tests.marshmallow_jsonapi import Category as CategorySchema
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.sqlalchemy import *
+
+import jsonapiquery
+
+
+class FragmentCacheTestCase(BaseSQLAlchemyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = FragmentCache()
+        self.schema = CategorySchema(only=('id', 'name'))
+
+        self.categories = [Category(name=name) for name in 'abc']
+        self.session.add_all(self.categories)
+        self.session.commit()
+
+    def tearDown(self):
+        self.cache.remove_listeners(Base, self.session)
+        super().tearDown()
+
+    def test_serialize(self):
+        """Test cached fragments equal marshmallow's output."""
+        expected = self.schema.dump(self.categories, many=True).data['data']
+        self.assertTrue(
+            self.cache.serialize(self.schema, self.categories) == expected)
+        self.assertTrue(self.cache.misses == 3)
+
+        self.assertTrue(
+            self.cache.serialize(self.schema, self.categories) == expected)
+        self.assertTrue(self.cache.hits == 3)
+        self.assertTrue(self.cache.hit_ratio == 0.5)
+
+    def test_fieldsets_are_keyed_separately(self):
+        self.cache.serialize(self.schema, self.categories)
+        data = self.cache.serialize(
+            CategorySchema(only=('id',)), self.categories)
+        self.assertTrue(self.cache.hits == 0)
+        self.assertTrue('attributes' not in data[0])
+
+    def test_contexts_are_keyed_separately(self):
+        """Test schemas serializing differently do not share fragments."""
+        self.cache.serialize(self.schema, self.categories)
+        schema = CategorySchema(only=('id', 'name'), context={'a': 1})
+        self.cache.serialize(schema, self.categories)
+        self.assertTrue(self.cache.hits == 0)
+        self.assertTrue(len(self.cache) == 6)
+
+        only = ('id', 'name', 'categories')
+        schema = CategorySchema(only=only, include_data=('categories',))
+        self.assertTrue(
+            self.cache.make_key(schema, self.categories[0]) !=
+            self.cache.make_key(CategorySchema(only=only), self.categories[0]))
+
+        schema = CategorySchema(only=('id', 'name'), context={'a': []})
+        self.assertTrue(self.cache.make_key(schema, self.categories[0]) is None)
+        self.cache.serialize(schema, self.categories)
+        self.assertTrue(len(self.cache) == 6)
+
+    def test_version_attribute(self):
+        """Test changed versions are not served from the cache."""
+        schema = PersonSchema(only=('id', 'name', 'updated_at'))
+        person = Person(name='Fred')
+        self.session.add(person)
+        self.session.commit()
+
+        self.cache.serialize(schema, [person])
+        person.updated_at = datetime(2000, 1, 1)
+        self.cache.serialize(schema, [person])
+        self.assertTrue(self.cache.misses == 2)
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_entries = 2
+        self.cache.serialize(self.schema, self.categories[:2])
+        self.cache.serialize(self.schema, self.categories[:1])
+        self.cache.serialize(self.schema, self.categories[2:])
+
+        self.assertTrue(len(self.cache) == 2)
+        self.assertTrue(self.cache.evictions == 1)
+        self.cache.serialize(self.schema, self.categories[:1])
+        self.assertTrue(self.cache.hits == 2)
+
+    def test_evict_memory_cap(self):
+        self.cache.serialize(self.schema, self.categories[:1])
+        self.cache.max_bytes = self.cache.size * 2
+        self.cache.serialize(self.schema, self.categories)
+
+        self.assertTrue(len(self.cache) == 2)
+        self.assertTrue(self.cache.size <= self.cache.max_bytes)
+
+    def test_invalidate_on_write(self):
+        """Test updated rows are removed from the cache."""
+        self.cache.listen(Base, self.session)
+        self.cache.serialize(self.schema, self.categories)
+
+        self.categories[0].name = 'z'
+        self.session.commit()
+        self.assertTrue(len(self.cache) == 2)
+
+        data = self.cache.serialize(self.schema, self.categories[:1])
+        self.assertTrue(data[0]['attributes']['name'] == 'z')
+
+    def test_invalidate_on_bulk_write(self):
+        """Test bulk updates remove every fragment of the class."""
+        self.cache.listen(Base, self.session)
+        self.cache.serialize(self.schema, self.categories)
+
+        self.session.query(Category).filter(
+            Category.name == 'a').update({'name': 'z'})
+        self.assertTrue(len(self.cache) == 0)
+
+    def test_bulk_write_other_session(self):
+        """Test bulk updates of unrelated sessions are not listened to."""
+        self.cache.listen(Base, self.session)
+        self.cache.serialize(self.schema, self.categories)
+
+        session = sessionmaker(bind=self.session.connection())()
+        session.query(Category).filter(
+            Category.name == 'a').update({'name': 'z'})
+        session.close()
+        self.assertTrue(len(self.cache) == 3)
+
+    def test_invalidate_during_serialize(self):
+        """Test fragments dumped during an invalidation are not stored."""
+        serialize = compiler.serialize
+
+        def invalidating_serialize(schema, models):
+            self.cache.invalidate(models[0])
+            return serialize(schema, models)
+
+        with mock.patch.object(
+                compiler, 'serialize', invalidating_serialize):
+            data = self.cache.serialize(self.schema, self.categories)
+        self.assertTrue(len(data) == 3)
+        self.assertTrue(len(self.cache) == 0)
+
+    def test_serialize_includes(self):
+        """Test included resources are served from the cache."""
+        child = Category(name='child', category=self.categories[0])
+        self.session.add(child)
+        self.session.commit()
+
+        include = Include('include', ['category'])
+        for driver in [
+                DriverSchemaMarshmallow(CategorySchema()),
+                DriverModelSQLAlchemy(Category)]:
+            include = driver.parse(include)
+
+        expected = jsonapiquery.serialize_includes([include], [child])
+        for _ in range(2):
+            result = jsonapiquery.serialize_includes(
+                [include], [child], cache=self.cache)
+            self.assertTrue(result == expected)
+        self.assertTrue(self.cache.hits == 1)
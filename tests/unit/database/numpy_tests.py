@@ -0,0 +1,178 @@
+"""Test in-memory columnar query interactions."""
+from datetime import date
+
+from nose.tools import assert_raises
+
+from jsonapiquery import errors
+from jsonapiquery.database.numpy import ColumnarDataset
+from jsonapiquery.drivers.model.sqlalchemy import Mapper, Column as ColumnType
+from jsonapiquery.types import Filter, Sort, Paginator
+from tests.sqlalchemy import Person, School, Student
+from tests.unit import UnitTestCase
+
+
+class BaseColumnarTestCase(UnitTestCase):
+
+    def setUp(self):
+        self.dataset = ColumnarDataset.from_records([
+            (1, 'Fred', 5, date(2014, 1, 1), 'School'),
+            (2, 'Carl', 10, date(2015, 1, 1), 'College'),
+            (3, 'Bob', 10, None, 'School'),
+            (4, None, None, date(2013, 1, 1), None),
+        ], ['id', 'name', 'age', 'birth_date', 'student.school.name'])
+
+    def filter(self, name, value, relationships=()):
+        model = School if relationships else Person
+        return Filter(
+            '', list(relationships), ColumnType(name, model, None), value)
+
+    def names(self, query):
+        return [row['name'] for row in query.all()]
+
+
+class FilterColumnarTestCase(BaseColumnarTestCase):
+
+    def test_filter_strategy_eq(self):
+        query = self.dataset.query().apply_filter(
+            self.filter('name', ('eq', ['Fred'])))
+        self.assertTrue(self.names(query) == ['Fred'])
+
+    def test_filter_strategy_ne(self):
+        """Test negated strategies exclude null values like SQL."""
+        query = self.dataset.query().apply_filter(
+            self.filter('name', ('ne', ['Fred'])))
+        self.assertTrue(self.names(query) == ['Carl', 'Bob'])
+
+    def test_filter_strategy_null(self):
+        query = self.dataset.query().apply_filter(
+            self.filter('name', ('eq', [None])))
+        self.assertTrue(self.names(query) == [None])
+
+    def test_filter_strategy_ranges(self):
+        query = self.dataset.query()
+        filter_ = self.filter('age', ('gt', [5]))
+        self.assertTrue(query.apply_filter(filter_).count() == 2)
+        filter_ = self.filter('age', ('~gt', [5]))
+        self.assertTrue(query.apply_filter(filter_).count() == 1)
+        filter_ = self.filter('age', ('gte', [5]))
+        self.assertTrue(query.apply_filter(filter_).count() == 3)
+        filter_ = self.filter('birth_date', ('lt', [date(2015, 1, 1)]))
+        self.assertTrue(query.apply_filter(filter_).count() == 2)
+        filter_ = self.filter('birth_date', ('lte', [date(2015, 1, 1)]))
+        self.assertTrue(query.apply_filter(filter_).count() == 3)
+
+    def test_filter_strategy_like(self):
+        query = self.dataset.query()
+        filter_ = self.filter('name', ('like', ['red']))
+        self.assertTrue(self.names(query.apply_filter(filter_)) == ['Fred'])
+        filter_ = self.filter('name', ('like', ['RED']))
+        self.assertTrue(self.names(query.apply_filter(filter_)) == [])
+        filter_ = self.filter('name', ('ilike', ['RED']))
+        self.assertTrue(self.names(query.apply_filter(filter_)) == ['Fred'])
+        filter_ = self.filter('name', ('~ilike', ['RED']))
+        self.assertTrue(
+            self.names(query.apply_filter(filter_)) == ['Carl', 'Bob'])
+
+    def test_filter_strategy_like_numeric(self):
+        """Test string values of non-string columns are converted once."""
+        query = self.dataset.query()
+        filter_ = self.filter('age', ('like', ['1']))
+        self.assertTrue(
+            self.names(query.apply_filter(filter_)) == ['Carl', 'Bob'])
+        column = self.dataset.snapshot['age']
+        self.assertTrue(column.strings is column.strings)
+
+    def test_filter_strategy_in(self):
+        query = self.dataset.query()
+        filter_ = self.filter('name', ('in', ['Fred', 'Bob']))
+        self.assertTrue(
+            self.names(query.apply_filter(filter_)) == ['Fred', 'Bob'])
+        filter_ = self.filter('name', ('~in', ['Fred', 'Bob']))
+        self.assertTrue(self.names(query.apply_filter(filter_)) == ['Carl'])
+
+    def test_filter_multiple_values(self):
+        query = self.dataset.query().apply_filter(
+            self.filter('name', ('eq', ['Fred', 'Carl'])))
+        self.assertTrue(self.names(query) == ['Fred', 'Carl'])
+
+    def test_filter_multiple_filters(self):
+        query = self.dataset.query().apply_filters([
+            self.filter('age', ('eq', [10])),
+            self.filter('name', ('eq', ['Bob']))])
+        self.assertTrue(self.names(query) == ['Bob'])
+
+    def test_filter_joined(self):
+        """Test filtering a flattened relationship column."""
+        relationships = [
+            Mapper('student', Person, None), Mapper('school', Student, None)]
+        filter_ = self.filter('name', ('eq', ['School']), relationships)
+
+        query = self.dataset.query().apply_filter(filter_)
+        self.assertTrue(self.names(query) == ['Fred', 'Bob'])
+
+    def test_filter_invalid_strategy(self):
+        query = self.dataset.query()
+        filter_ = self.filter('name', ('qq', ['Fred']))
+        assert_raises(errors.JSONAPIQueryError, query.apply_filter, filter_)
+
+    def test_filter_unknown_column(self):
+        query = self.dataset.query()
+        filter_ = self.filter('updated_at', ('eq', ['Fred']))
+        assert_raises(errors.JSONAPIQueryError, query.apply_filter, filter_)
+
+
+class SortColumnarTestCase(BaseColumnarTestCase):
+
+    def test_sort_ascending(self):
+        sort = Sort('', [], ColumnType('name', Person, None), '+')
+        query = self.dataset.query().apply_sort(sort)
+        self.assertTrue(self.names(query) == [None, 'Bob', 'Carl', 'Fred'])
+
+    def test_sort_descending(self):
+        sort = Sort('', [], ColumnType('name', Person, None), '-')
+        query = self.dataset.query().apply_sort(sort)
+        self.assertTrue(self.names(query) == ['Fred', 'Carl', 'Bob', None])
+
+    def test_sort_multiple_keys(self):
+        sorts = [
+            Sort('', [], ColumnType('age', Person, None), '-'),
+            Sort('', [], ColumnType('name', Person, None), '+')]
+        query = self.dataset.query().apply_sorts(sorts)
+        self.assertTrue(self.names(query) == ['Bob', 'Carl', 'Fred', None])
+
+
+class PaginateColumnarTestCase(BaseColumnarTestCase):
+
+    def test_paginate_limit_offset(self):
+        paginators = [Paginator('', 'limit', '2'), Paginator('', 'offset', '1')]
+        query = self.dataset.query().apply_paginators(paginators)
+        self.assertTrue(self.names(query) == ['Carl', 'Bob'])
+        self.assertTrue(query.count() == 2)
+
+    def test_paginate_number(self):
+        paginators = [Paginator('', 'limit', '3'), Paginator('', 'number', '2')]
+        query = self.dataset.query().apply_paginators(paginators)
+        self.assertTrue(query.all() == [
+            {'id': 4, 'name': None, 'age': None,
+             'birth_date': date(2013, 1, 1), 'student.school.name': None}])
+
+    def test_paginate_invalid_value(self):
+        query = self.dataset.query()
+        assert_raises(
+            errors.JSONAPIQueryError, query.apply_paginators,
+            [Paginator('', 'limit', 'q')])
+
+
+class ReloadColumnarTestCase(BaseColumnarTestCase):
+
+    def test_reload_snapshot(self):
+        """Test reloading does not affect existing queries."""
+        query = self.dataset.query()
+        self.dataset.reload({'id': [1], 'name': ['Zed']})
+
+        self.assertTrue(query.count() == 4)
+        self.assertTrue(self.names(self.dataset.query()) == ['Zed'])
+
+    def test_reload_mismatched_columns(self):
+        assert_raises(
+            ValueError, self.dataset.reload, {'id': [1], 'name': []})
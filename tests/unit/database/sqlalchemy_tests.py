@@ -1,16 +1,33 @@
 """Test database interactions."""
 from datetime import datetime
+from unittest import mock
 
 from nose.tools import assert_raises
-from sqlalchemy.orm import Query, sessionmaker
-
-from jsonapiquery import errors
-from jsonapiquery.database.sqlalchemy import QueryMixin
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import default
+from sqlalchemy.orm import object_session, Query, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from jsonapiquery import errors, url
+from jsonapiquery.database.sqlalchemy import (
+    QueryMixin, count_query, execute_query, execute_query_async,
+    load_includes, load_includes_async)
+from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
 from jsonapiquery.drivers.model.sqlalchemy import Mapper, Column as ColumnType
 from jsonapiquery.types import Filter, Include, Sort, Paginator
 from jsonapiquery.utils import QueryCounter
+from tests.marshmallow_jsonapi import Category as CategorySchema
+from tests.marshmallow_jsonapi import Person as PersonSchema
 from tests.sqlalchemy import *
 
+import asyncio
+import jsonapiquery
+import os
+import tempfile
+import threading
+import time
+
 
 class BaseDatabaseSQLAlchemyTests(BaseSQLAlchemyTestCase):
     """Base database SQLAlchemy test case for establishing mock environment."""
@@ -135,6 +152,55 @@ class FilterSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
         self.assertTrue(len(models) == 1)
         self.assertTrue(models[0].name == 'Carl')
 
+    def test_query_filter_in_large_values(self):
+        """Test filtering by lists longer than the expanding threshold."""
+        names = ['Fred'] + ['name-{}'.format(index) for index in range(2000)]
+        filter_ = Filter('', [], ColumnType('name', Person, None), ('in', names))
+        models = self.session.query(Person).apply_filter(filter_).all()
+        self.assertTrue([model.name for model in models] == ['Fred'])
+
+        filter_ = Filter('', [], ColumnType('name', Person, None), ('~in', names))
+        models = self.session.query(Person).apply_filter(filter_).all()
+        self.assertTrue([model.name for model in models] == ['Carl'])
+
+    def test_query_filter_in_large_datetime_values(self):
+        """Test long lists of datetimes are bound as stored."""
+        fred = self.session.query(Person).filter(Person.name == 'Fred').one()
+        fred.updated_at = datetime(2020, 1, 1)
+        self.session.flush()
+        values = [datetime(2020, 1, 1)] + [
+            datetime(2000, 1, 1, second=index % 60, microsecond=index)
+            for index in range(1000)]
+        column = ColumnType('updated_at', Person, None)
+
+        filter_ = Filter('', [], column, ('in', values))
+        models = self.session.query(Person).apply_filter(filter_).all()
+        self.assertTrue([model.name for model in models] == ['Fred'])
+
+        filter_ = Filter('', [], column, ('~in', values))
+        models = self.session.query(Person).apply_filter(filter_).all()
+        self.assertTrue([model.name for model in models] == ['Carl'])
+
+    def test_query_filter_in_values_compiled(self):
+        """Test the statement compiled for each list size and dialect."""
+        def compile_(values, dialect=sqlite.dialect(), strategy='in'):
+            filter_ = Filter(
+                '', [], ColumnType('age', Person, None), (strategy, values))
+            query = self.session.query(Person.id).apply_filter(filter_)
+            return str(query.statement.compile(dialect=dialect))
+
+        self.assertTrue('IN ([EXPANDING_' in compile_([1, 2]))
+        self.assertTrue('json_each' in compile_(list(range(1000))))
+        self.assertTrue(
+            'person.age = ANY' in
+            compile_(list(range(1000)), postgresql.dialect()))
+        self.assertTrue(
+            'person.age != ALL' in
+            compile_(list(range(1000)), postgresql.dialect(), '~in'))
+
+        statement = compile_(list(range(1000)), default.DefaultDialect())
+        self.assertTrue(statement.count('IN ([EXPANDING_') == 2)
+
     def test_query_filter_multiple_values(self):
         """Test filtering a query by multiple values."""
         filter_ = Filter('', [], ColumnType('name', Person, None), ('eq', ['Fred', 'Carl']))
@@ -270,6 +336,22 @@ class IncludeSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
             model.student[0].school
             self.assertTrue(query_counter.count == 1)
 
+    def test_include_shared_prefix(self):
+        """Test includes sharing a prefix are merged into one option."""
+        drivers = [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+        params = {'include': 'student.school,student.person,student'}
+        query, _ = jsonapiquery.include_query(
+            self.session.query(Person), params, drivers)
+        self.assertTrue(len(query._with_options) == 1)
+
+        with self.counter as query_counter:
+            model = query.filter(Person.name == 'Fred').first()
+            model.student[0].school
+            model.student[0].person
+            self.assertTrue(query_counter.count == 1)
+
     def test_include_self_referential_relationship(self):
         """Test including a self-referential relationship."""
         self.session.add(Category(name='Category A'))
@@ -329,6 +411,203 @@ class IncludeSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
             self.assertTrue(query_counter.count == 3)
 
 
+class FacetSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
+    """Test facet counts."""
+
+    @property
+    def drivers(self):
+        return [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+
+    def test_facet_counts(self):
+        """Test counting each facet's values."""
+        params = {'meta[facets]': 'name,student.school.title'}
+        query = self.session.query(Person)
+        counts, facets = jsonapiquery.facet_query(query, params, self.drivers)
+
+        self.assertTrue(len(facets) == 2)
+        self.assertTrue(counts == {
+            'name': {'Fred': 1, 'Carl': 1},
+            'student.school.title': {'School': 1, 'College': 1}})
+
+    def test_facet_counts_filtered(self):
+        """Test facets are counted under the query's filters."""
+        params = {
+            'filter[age]': 'gt:5',
+            'meta[facets]': 'name,student.school.title'}
+        query = self.session.query(Person)
+        query, _ = jsonapiquery.filter_query(query, params, self.drivers)
+        counts, _ = jsonapiquery.facet_query(query, params, self.drivers)
+
+        self.assertTrue(counts == {
+            'name': {'Carl': 1}, 'student.school.title': {'College': 1}})
+
+    def test_facet_counts_none(self):
+        query = self.session.query(Person)
+        counts, facets = jsonapiquery.facet_query(query, {}, self.drivers)
+        self.assertTrue(counts == {})
+        self.assertTrue(facets == [])
+
+    def test_facet_grouping_sets(self):
+        """Test every facet is grouped in a single statement."""
+        params = {'meta[facets]': 'name,student.school.title'}
+        facets = jsonapiquery.iter_by_type(
+            url.iter_facets, params, self.drivers)
+        query = self.session.query(Person)
+        query, columns = query.make_grouping_sets_query(list(facets))
+
+        statement = str(query.statement.compile(dialect=postgresql.dialect()))
+        self.assertTrue(len(columns) == 2)
+        self.assertTrue('GROUP BY GROUPING SETS((person.name), (' in statement)
+        self.assertTrue('grouping(person.name)' in statement)
+
+
+class CountSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
+    """Test relationship counts."""
+
+    def setUp(self):
+        super().setUp()
+        fred = self.session.query(Person).filter_by(name='Fred').one()
+        self.session.add(Student(person=fred))
+        self.session.flush()
+
+    @property
+    def drivers(self):
+        return [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+
+    def test_relationship_counts(self):
+        """Test counting the relationships of a page of models."""
+        params = {'meta[counts]': 'student'}
+        query = self.session.query(Person)
+        models = query.order_by(Person.name).all()
+        counts, items = jsonapiquery.relationship_counts(
+            query, models, params, self.drivers)
+
+        self.assertTrue(len(items) == 1)
+        self.assertTrue(counts == [{'student': 1}, {'student': 2}])
+
+        resources = jsonapiquery.attach_counts([{}, {}], counts)
+        self.assertTrue(resources[1] == {'meta': {'counts': {'student': 2}}})
+
+    def test_relationship_counts_filtered(self):
+        """Test extra join criteria restrict the counted rows."""
+        categories = [Category(name='first'), Category(name='second')]
+        for category, names in zip(categories, [['a', None, None], ['b']]):
+            for name in names:
+                self.session.add(Product(name=name, primary_category=category))
+        self.session.flush()
+        drivers = [
+            DriverSchemaMarshmallow(CategorySchema()),
+            DriverModelSQLAlchemy(Category)]
+
+        params = {'meta[counts]': 'named-products'}
+        query = self.session.query(Category).order_by(Category.name)
+        counts, _ = jsonapiquery.relationship_counts(
+            query, query.all(), params, drivers)
+        self.assertTrue(
+            counts == [{'named-products': 1}, {'named-products': 1}])
+
+        params = {'filter[named-products.count]': 'gt:1'}
+        query, _ = jsonapiquery.filter_query(
+            self.session.query(Category), params, drivers)
+        self.assertTrue(query.all() == [])
+
+    def test_relationship_counts_nested(self):
+        params = {'meta[counts]': 'student.school'}
+        query = self.session.query(Person)
+        assert_raises(
+            errors.JSONAPIQueryError, jsonapiquery.relationship_counts, query,
+            query.all(), params, self.drivers)
+
+    def test_sort_count(self):
+        """Test sorting by a relationship count."""
+        params = {'sort': '-student.count,name'}
+        query = self.session.query(Person)
+        query, _ = jsonapiquery.sort_query(query, params, self.drivers)
+        self.assertTrue([model.name for model in query] == ['Fred', 'Carl'])
+
+        params = {'sort': 'student.count'}
+        query = self.session.query(Person)
+        query, _ = jsonapiquery.sort_query(query, params, self.drivers)
+        self.assertTrue([model.name for model in query] == ['Carl', 'Fred'])
+
+    def test_filter_count(self):
+        params = {'filter[student.count]': 'gt:1'}
+        query = self.session.query(Person)
+        query, _ = jsonapiquery.filter_query(query, params, self.drivers)
+        self.assertTrue([model.name for model in query] == ['Fred'])
+
+
+class ValidatorSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
+    """Test conditional request validators."""
+
+    def make_drivers(self, **kwargs):
+        return [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person, **kwargs)]
+
+    def test_make_validator(self):
+        """Test the tag changes with the request and the matched rows."""
+        params = {'filter[age]': 'gt:1', 'page[limit]': '1'}
+        drivers = self.make_drivers()
+        query, _ = jsonapiquery.filter_query(
+            self.session.query(Person), params, drivers)
+        validator = jsonapiquery.make_validator(query, params, drivers)
+
+        self.assertTrue(validator.total == 2)
+        self.assertTrue(validator.etag.startswith('W/"'))
+        self.assertTrue(
+            jsonapiquery.make_validator(query, params, drivers) == validator)
+
+        params = {'filter[age]': 'gt:1', 'page[limit]': '2'}
+        other = jsonapiquery.make_validator(query, params, drivers)
+        self.assertTrue(other.etag != validator.etag)
+
+        person = self.session.query(Person).first()
+        person.updated_at = datetime(2100, 1, 1)
+        self.session.flush()
+        changed = jsonapiquery.make_validator(query, params, drivers)
+        self.assertTrue(changed.etag != other.etag)
+        self.assertTrue(changed.last_modified == datetime(2100, 1, 1))
+
+    def test_make_validator_version_attribute(self):
+        drivers = self.make_drivers(version_attribute='birth_date')
+        validator = jsonapiquery.make_validator(
+            self.session.query(Person), {}, drivers)
+        self.assertTrue(str(validator.last_modified) == '2015-01-01')
+
+    def test_make_validator_no_version(self):
+        """Test validation is disabled without a version column."""
+        drivers = self.make_drivers(version_attribute='missing')
+        validator = jsonapiquery.make_validator(
+            self.session.query(Person), {}, drivers)
+        self.assertTrue(validator is None)
+        self.assertFalse(jsonapiquery.is_not_modified(validator, '*'))
+
+    def test_is_not_modified(self):
+        validator = jsonapiquery.make_validator(
+            self.session.query(Person), {}, self.make_drivers())
+        etag = validator.etag
+
+        self.assertTrue(jsonapiquery.is_not_modified(validator, etag))
+        self.assertTrue(jsonapiquery.is_not_modified(validator, etag[2:]))
+        self.assertTrue(jsonapiquery.is_not_modified(
+            validator, '"other", ' + etag))
+        self.assertTrue(jsonapiquery.is_not_modified(validator, '*'))
+        self.assertFalse(jsonapiquery.is_not_modified(validator, '"other"'))
+        self.assertFalse(jsonapiquery.is_not_modified(validator))
+
+        self.assertTrue(jsonapiquery.is_not_modified(
+            validator, if_modified_since='Fri, 01 Jan 2100 00:00:00 GMT'))
+        self.assertFalse(jsonapiquery.is_not_modified(
+            validator, if_modified_since='Thu, 01 Jan 1970 00:00:00 GMT'))
+        self.assertFalse(jsonapiquery.is_not_modified(
+            validator, '"other"', 'Fri, 01 Jan 2100 00:00:00 GMT'))
+
+
 class PaginateSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
     """Test query pagination related methods."""
 
@@ -364,3 +643,207 @@ class PaginateSQLAlchemyTestCase(BaseDatabaseSQLAlchemyTests):
         assert_raises(
             errors.JSONAPIQueryError, query.apply_paginators,
             paginators=[paginator])
+
+
+class ExecuteSQLAlchemyTestCase(BaseSQLAlchemyTestCase):
+    """Test concurrent count and page execution.
+
+    The count runs on a separate connection so the rows are committed to
+    a database file rather than an in-memory database.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine(
+            'sqlite:///{}'.format(self.path), poolclass=QueuePool,
+            connect_args={'check_same_thread': False})
+        Base.metadata.create_all(self.engine)
+
+        class BaseQuery(QueryMixin, Query):
+            pass
+
+        self.session_factory = sessionmaker(
+            bind=self.engine, query_cls=BaseQuery)
+        self.session = self.session_factory()
+        for name in ['Fred', 'Carl', 'Bob']:
+            self.session.add(Person(name=name))
+        self.session.commit()
+
+        self.params = {'page[limit]': '2'}
+        self.base_url = 'http://site.com/people'
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def run_coroutine(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_execute_query(self):
+        """Test fetching the page and count concurrently."""
+        query = self.session.query(Person)
+        models, total, links = execute_query(
+            query, self.params, self.base_url, self.session_factory)
+
+        self.assertTrue(len(models) == 2)
+        self.assertTrue(total == 3)
+        self.assertTrue(links['self'] == self.base_url)
+        self.assertTrue('page%5Boffset%5D=2' in links['next'])
+
+    def test_execute_query_count_strategy(self):
+        """Test executing a custom count strategy."""
+        query = self.session.query(Person)
+        _, total, _ = execute_query(
+            query, self.params, self.base_url, self.session_factory,
+            count=lambda query: 100)
+        self.assertTrue(total == 100)
+
+    def test_execute_query_count_error(self):
+        """Test count errors are propagated."""
+        def count(query):
+            raise ValueError
+
+        query = self.session.query(Person)
+        assert_raises(
+            ValueError, execute_query, query, self.params, self.base_url,
+            self.session_factory, count=count)
+
+    def test_execute_query_page_error(self):
+        """Test page errors are propagated."""
+        query = self.session.query(Person)
+        params = {'page[limit]': 'q'}
+        assert_raises(
+            errors.JSONAPIQueryError, execute_query, query, params,
+            self.base_url, self.session_factory)
+
+    def test_execute_query_fetch_error(self):
+        """Test page fetch errors propagate once a running count finished."""
+        started = threading.Event()
+        finished = []
+
+        def count(query):
+            started.set()
+            time.sleep(0.05)
+            finished.append(count_query(query))
+            return finished[-1]
+
+        def fetch(*args):
+            started.wait(1)
+            raise ValueError
+
+        query = self.session.query(Person)
+        with mock.patch.object(type(query), 'all', fetch):
+            assert_raises(
+                ValueError, execute_query, query, self.params,
+                self.base_url, self.session_factory, count=count)
+            self.assertTrue(finished == [3])
+
+            started.clear()
+            coroutine = execute_query_async(
+                query, self.params, self.base_url, self.session_factory,
+                count=count)
+            assert_raises(ValueError, self.run_coroutine, coroutine)
+            self.assertTrue(finished == [3, 3])
+
+    def test_execute_query_async(self):
+        """Test fetching the page and count as concurrent tasks."""
+        query = self.session.query(Person)
+        coroutine = execute_query_async(
+            query, self.params, self.base_url, self.session_factory)
+        models, total, links = self.run_coroutine(coroutine)
+
+        self.assertTrue(len(models) == 2)
+        self.assertTrue(total == 3)
+
+    def test_execute_query_async_count_error(self):
+        """Test count errors are propagated from tasks."""
+        def count(query):
+            raise ValueError
+
+        query = self.session.query(Person)
+        coroutine = execute_query_async(
+            query, self.params, self.base_url, self.session_factory,
+            count=count)
+        assert_raises(ValueError, self.run_coroutine, coroutine)
+
+    def make_includes(self):
+        school = School(name='School')
+        for person in self.session.query(Person):
+            person.student = [Student(school=school)]
+        self.session.commit()
+        self.session.expire_all()
+
+        include = Include('include', ['student', 'school'])
+        for driver in [
+                DriverSchemaMarshmallow(PersonSchema()),
+                DriverModelSQLAlchemy(Person)]:
+            include = driver.parse(include)
+        return [include]
+
+    def count_statements(self):
+        statements = []
+        event.listen(
+            self.engine, 'before_cursor_execute',
+            lambda *args: statements.append(args[2]))
+        return statements
+
+    def test_load_includes(self):
+        """Test include subtrees are loaded and merged into the session."""
+        includes = self.make_includes()
+        models = self.session.query(Person).all()
+        load_includes(includes, models, self.session_factory)
+
+        statements = self.count_statements()
+        included = jsonapiquery.serialize_includes(includes, models)
+        self.assertTrue(statements == [])
+        self.assertTrue(len(included) == 4)
+
+        student = models[0].student[0]
+        self.assertTrue(object_session(student) is self.session)
+        self.assertTrue(student.school is models[1].student[0].school)
+
+    def test_load_includes_async(self):
+        includes = self.make_includes()
+        models = self.session.query(Person).all()
+        self.run_coroutine(load_includes_async(
+            includes, models, self.session_factory))
+
+        statements = self.count_statements()
+        jsonapiquery.serialize_includes(includes, models)
+        self.assertTrue(statements == [])
+
+    def test_load_includes_filtered(self):
+        """Test extra join criteria restrict the fetched models."""
+        category = Category(name='category')
+        for name in ['product', None]:
+            self.session.add(Product(name=name, primary_category=category))
+        self.session.commit()
+
+        include = Include('include', ['named_products'])
+        for driver in [
+                DriverSchemaMarshmallow(CategorySchema()),
+                DriverModelSQLAlchemy(Category)]:
+            include = driver.parse(include)
+        models = self.session.query(Category).all()
+        load_includes([include], models, self.session_factory)
+
+        statements = self.count_statements()
+        products = models[0].named_products
+        self.assertTrue(statements == [])
+        self.assertTrue([product.name for product in products] == ['product'])
+
+    def test_load_includes_loaded(self):
+        """Test loaded relationships are not fetched again."""
+        includes = self.make_includes()
+        models = self.session.query(Person).all()
+        jsonapiquery.serialize_includes(includes, models)
+
+        statements = self.count_statements()
+        load_includes(includes, models, self.session_factory)
+        self.assertTrue(statements == [])
@@ -0,0 +1,163 @@
+"""Test compiled serializers against marshmallow_jsonapi's output."""
+from datetime import date, datetime
+from unittest import mock
+from marshmallow import post_dump
+from marshmallow_jsonapi import fields, Schema
+from nose.tools import assert_raises
+
+from jsonapiquery.drivers.schema import compiler
+from tests.marshmallow_jsonapi import Category as CategorySchema
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.marshmallow_jsonapi import School as SchoolSchema
+from tests.marshmallow_jsonapi import Student as StudentSchema
+from tests.sqlalchemy import *
+
+import json
+
+
+class Record:
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Article(Schema):
+    id = fields.String()
+    title = fields.String(dump_to='headline')
+    views = fields.Integer(as_string=True)
+    score = fields.Float()
+    published = fields.Boolean()
+    secret = fields.String(load_only=True)
+    author_name = fields.String(attribute='author.name')
+    summary = fields.Method('get_summary')
+    author = fields.Relationship(
+        schema='Author', include_resource_linkage=True, type_='authors')
+    tags = fields.Relationship(
+        include_resource_linkage=True, type_='tags', many=True)
+    comments = fields.Relationship(related_url='/articles/{id}/comments',
+                                   related_url_kwargs={'id': '<id>'})
+
+    def get_summary(self, obj):
+        return obj.title[:3]
+
+    class Meta:
+        type_ = 'articles'
+
+
+class Author(Schema):
+    id = fields.Integer()
+    name = fields.String()
+
+    class Meta:
+        type_ = 'authors'
+
+
+class LinkedAuthor(Author):
+
+    class Meta:
+        type_ = 'authors'
+        self_url = '/authors/{id}'
+        self_url_kwargs = {'id': '<id>'}
+
+
+class ProcessedAuthor(Author):
+
+    @post_dump
+    def upper_name(self, data):
+        data['name'] = data['name'].upper()
+        return data
+
+
+class CompilerTestCase(BaseSQLAlchemyTestCase):
+
+    def assert_equivalent(self, schema, models):
+        expected = schema.dump(models, many=True).data['data']
+        result = compiler.serialize(schema, models)
+        self.assertTrue(result == expected)
+        self.assertTrue(json.dumps(result) == json.dumps(expected))
+
+    def test_sqlalchemy_models(self):
+        """Test compiled output of the test schemas."""
+        image = Image()
+        school = School(name='School', image=image)
+        person = Person(
+            name='Fred', age=10, birth_date=date(2000, 1, 1), image=image,
+            updated_at=datetime(2010, 1, 1, 12, 30))
+        student = Student(school=school, person=person)
+        category = Category(name='parent')
+        child = Category(name='child', category=category)
+        self.session.add_all([student, child])
+        self.session.commit()
+
+        for schema, models in [
+                (PersonSchema(), [person, Person()]),
+                (PersonSchema(only=('id', 'age')), [person]),
+                (PersonSchema(exclude=('name',)), [person]),
+                (StudentSchema(), [student, Student()]),
+                (SchoolSchema(), [school]),
+                (CategorySchema(), [category, child])]:
+            self.assertTrue(compiler.get_serializer(schema) is not None)
+            self.assert_equivalent(schema, models)
+
+    def test_field_options(self):
+        """Test dump keys, load only, dotted, method and linkage fields."""
+        author = Record(id=1, name='Ann')
+        tags = [Record(id=1), Record(id=2)]
+        models = [
+            Record(id='a', title='First', views=10, score=1, published=1,
+                   secret='x', author=author, tags=tags, comments=[]),
+            Record(id='b', title='Second', views=None, score=None,
+                   published=None, secret=None, author=author, tags=None,
+                   comments=None),
+        ]
+        schema = Article()
+        self.assertTrue(compiler.get_serializer(schema) is not None)
+        self.assert_equivalent(schema, models)
+
+    def test_mappings(self):
+        """Test objects supporting item access."""
+        self.assert_equivalent(Author(), [{'id': 1, 'name': 'Ann'}])
+
+    def test_uncompilable_schemas(self):
+        """Test schemas with links or dump processors use marshmallow."""
+        models = [Record(id=1, name='Ann')]
+        for schema in [LinkedAuthor(), ProcessedAuthor()]:
+            self.assertTrue(compiler.get_serializer(schema) is None)
+            self.assert_equivalent(schema, models)
+        self.assertFalse(compiler.is_compilable(Author(prefix='x')))
+
+    def test_fallback(self):
+        """Test missing attributes and errors fall back to marshmallow."""
+        schema = Author()
+        self.assert_equivalent(schema, [Record(id=1)])
+        assert_raises(
+            ValueError, compiler.serialize, schema, [Record(id='x', name='')])
+
+    def test_errors_raised(self):
+        """Test serializer errors are raised rather than hidden."""
+        class Failing(Author):
+            name = fields.Method('get_name')
+
+            def get_name(self, obj):
+                raise KeyError(obj.id)
+
+        schema = Failing()
+        self.assertTrue(compiler.get_serializer(schema) is not None)
+        with mock.patch.object(schema, 'dump') as dump:
+            assert_raises(
+                KeyError, compiler.serialize, schema, [Record(id=1)])
+        self.assertFalse(dump.called)
+
+    def test_unsupported_versions(self):
+        """Test schemas are not compiled with other library versions."""
+        with mock.patch.object(compiler, 'IS_SUPPORTED', False):
+            self.assertFalse(compiler.is_compilable(Author()))
+        self.assertTrue(compiler.IS_SUPPORTED)
+
+    def test_recompile_replaced_fields(self):
+        schema = Author()
+        serializer = compiler.get_serializer(schema)
+        self.assertTrue(compiler.get_serializer(schema) is serializer)
+
+        schema.fields = dict(schema.fields)
+        self.assertTrue(compiler.get_serializer(schema) is not serializer)
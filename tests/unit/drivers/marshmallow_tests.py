@@ -2,9 +2,12 @@ from datetime import date, datetime
 
 from jsonapiquery.drivers.schema import DriverSchemaMarshmallow
 from jsonapiquery.drivers.schema.marshmallow import Relationship, Attribute
+from jsonapiquery.drivers.schema.marshmallow import SchemaPool, schema_pool
 from jsonapiquery.types import *
 from tests.marshmallow_jsonapi import *
 
+import threading
+
 
 class DriverSchemaMarshmallowTestCase(BaseMarshmallowJSONAPITestCase):
 
@@ -80,3 +83,81 @@ class DriverSchemaMarshmallowTestCase(BaseMarshmallowJSONAPITestCase):
         field = Attribute('updated-at', Person(), None)
         value = field.deserialize_value('eq:2018-01-01T00:00:00.000000')
         assert value == ('eq', [datetime(2018, 1, 1, 0, 0, 0, 0)])
+
+
+class SchemaPoolTestCase(BaseMarshmallowJSONAPITestCase):
+
+    def setUp(self):
+        self.pool = SchemaPool(max_size=2)
+        Relationship.pool = self.pool
+
+    def tearDown(self):
+        Relationship.pool = schema_pool
+
+    def test_relationship_type(self):
+        """Test related schemas are shared between parent schemas."""
+        first = Relationship('student', Person(), None)
+        second = Relationship('student', Person(), None)
+
+        assert isinstance(first.type, Student)
+        assert first.type is second.type
+        assert self.pool.misses == 1
+
+    def test_keys(self):
+        """Test fieldsets and contexts are pooled separately."""
+        schema = self.pool.get(Person)
+        assert self.pool.get(Person, exclude=[]) is schema
+        assert self.pool.get(Person, only=['id']) is not schema
+        assert self.pool.get(Person, context={'a': 1}) is not schema
+
+        schema = self.pool.get(Person, context={'a': []})
+        assert schema.context == {'a': []}
+        assert self.pool.get(Person, context={'a': []}) is not schema
+
+    def test_context_copied(self):
+        """Test pooled schemas do not share the caller's context."""
+        context = {'a': 1}
+        schema = self.pool.get(Person, context=context)
+        context['b'] = 2
+
+        assert schema.context == {'a': 1}
+        assert self.pool.get(Person, context={'a': 1}) is schema
+
+    def test_max_size(self):
+        person = self.pool.get(Person)
+        self.pool.get(Student)
+        self.pool.get(Person)
+        self.pool.get(School)
+
+        assert len(self.pool) == 2
+        assert self.pool.get(Person) is person
+        assert self.pool.misses == 3
+
+    def test_state_reset(self):
+        """Test per-dump state is cleared before a schema is reused."""
+        schema = self.pool.get(Person, context={'a': 1})
+        schema.included_data[('students', '1')] = {}
+        schema.document_meta['total'] = 1
+        schema.context['b'] = 2
+
+        assert self.pool.get(Person, context={'a': 1}) is schema
+        assert schema.included_data == {}
+        assert schema.document_meta == {}
+        assert schema.context == {'a': 1}
+
+    def test_threads(self):
+        """Test each thread uses its own instances."""
+        self.pool.max_size = 100
+        schemas = []
+
+        def get():
+            for _ in range(100):
+                schemas.append(self.pool.get(Person))
+
+        threads = [threading.Thread(target=get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len({id(schema) for schema in schemas}) == 4
+        assert self.pool.misses == 4
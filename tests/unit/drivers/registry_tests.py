@@ -0,0 +1,69 @@
+"""Driver registry module."""
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Query
+
+from jsonapiquery.database.sqlalchemy import QueryMixin
+from jsonapiquery.drivers import (
+    DriverModelSQLAlchemy, DriverRegistry, DriverSchemaMarshmallow)
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.sqlalchemy import Person, BaseSQLAlchemyTestCase
+
+import jsonapiquery
+import threading
+
+
+class BaseQuery(QueryMixin, Query):
+    pass
+
+
+PARAMS = {
+    'filter[student.school.title]': 'ilike:a',
+    'filter[age]': 'gt:10',
+    'sort': '-student.school.title,name',
+    'include': 'student.school',
+}
+
+
+def build(drivers):
+    query = BaseQuery(Person)
+    query, _ = jsonapiquery.filter_query(query, PARAMS, drivers)
+    query, _ = jsonapiquery.sort_query(query, PARAMS, drivers)
+    query, _ = jsonapiquery.include_query(query, PARAMS, drivers)
+    return str(query.statement.compile())
+
+
+class DriverRegistryTestCase(BaseSQLAlchemyTestCase):
+
+    def test_get(self):
+        """Test drivers are built once per pair."""
+        registry = DriverRegistry()
+        drivers = registry.get(PersonSchema, Person)
+
+        self.assertTrue(registry.get(PersonSchema, Person) is drivers)
+        self.assertTrue(isinstance(drivers[0], DriverSchemaMarshmallow))
+        self.assertTrue(isinstance(drivers[1], DriverModelSQLAlchemy))
+        self.assertTrue(isinstance(drivers[0].obj, PersonSchema))
+        self.assertTrue(len(registry) == 1)
+
+    def test_register(self):
+        registry = DriverRegistry()
+        drivers = [DriverModelSQLAlchemy(Person)]
+        registry.register('people', Person, drivers)
+        self.assertTrue(registry.get('people', Person) == tuple(drivers))
+
+    def test_shared_parsing(self):
+        """Test parsing with shared drivers from many threads at once."""
+        registry = DriverRegistry()
+        expected = build(registry.get(PersonSchema, Person))
+        barrier = threading.Barrier(8)
+
+        def run(_):
+            barrier.wait()
+            drivers = registry.get(PersonSchema, Person)
+            return {build(drivers) for _ in range(25)}
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(run, range(8)))
+
+        self.assertTrue(len(registry) == 1)
+        self.assertTrue(all(result == {expected} for result in results))
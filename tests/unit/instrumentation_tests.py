@@ -0,0 +1,137 @@
+"""Test request lifecycle instrumentation."""
+from nose.tools import assert_raises
+from sqlalchemy import create_engine, exc
+from sqlalchemy.orm import Query, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from jsonapiquery import instrumentation
+from jsonapiquery.database.sqlalchemy import QueryMixin, execute_query
+from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
+from jsonapiquery.instrumentation import (
+    Histogram, HistogramSink, render_prometheus, trace)
+from jsonapiquery.stream import stream_document
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.sqlalchemy import *
+
+import jsonapiquery
+import os
+import tempfile
+
+
+class InstrumentationTestCase(BaseSQLAlchemyTestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine(
+            'sqlite:///{}'.format(self.path), poolclass=QueuePool,
+            connect_args={'check_same_thread': False})
+        Base.metadata.create_all(self.engine)
+        instrumentation.instrument_engine(self.engine)
+
+        class BaseQuery(QueryMixin, Query):
+            pass
+
+        self.session_factory = sessionmaker(
+            bind=self.engine, query_cls=BaseQuery)
+        self.session = self.session_factory()
+        for name in ['Fred', 'Carl', 'Bob']:
+            self.session.add(Person(name=name, student=[Student()]))
+        self.session.commit()
+        self.drivers = [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_disabled(self):
+        """Test reporting without an active trace is a no-op."""
+        self.assertTrue(instrumentation.current_trace() is None)
+        with instrumentation.stage('page') as stage:
+            pass
+        self.assertTrue(stage.elapsed == 0)
+        instrumentation.incr('rows')
+        self.assertTrue(instrumentation.bind(len) is len)
+
+    def test_request_stages(self):
+        """Test stages and counters of a request."""
+        params = {
+            'filter[name]': 'ilike:r', 'sort': '-name',
+            'include': 'student', 'page[limit]': '1'}
+        sink = HistogramSink()
+        with trace(sink) as current:
+            query = self.session.query(Person)
+            query, _ = jsonapiquery.filter_query(query, params, self.drivers)
+            query, _ = jsonapiquery.sort_query(query, params, self.drivers)
+            _, includes = jsonapiquery.include_query(
+                query, params, self.drivers)
+            models, total, _ = execute_query(
+                query, params, '/people', self.session_factory)
+            jsonapiquery.serialize_includes(includes, models)
+
+        timings = current.timings
+        for name in [
+                'parse', 'resolve', 'build.filter', 'build.sort',
+                'build.include', 'build.paginate', 'page', 'sql.page',
+                'hydrate', 'count', 'sql.count', 'include.load',
+                'sql.include.load', 'include.serialize', 'request']:
+            self.assertTrue(name in timings, name)
+        self.assertTrue(timings['hydrate'] >= 0)
+        self.assertTrue(timings['request'] >= timings['page'])
+        self.assertTrue(current.counters['statements'] == 3)
+        self.assertTrue(current.counters['rows'] == 2)
+
+        self.assertTrue(sink.requests == 1)
+        self.assertTrue(sink.histograms['page'].count == 1)
+        self.assertTrue(sink.counters['statements'] == 3)
+
+    def test_failed_statement(self):
+        """Test a failing statement leaves no state on its connection."""
+        with trace() as current:
+            with self.engine.connect() as conn:
+                assert_raises(
+                    exc.OperationalError, conn.execute, 'SELECT * FROM nope')
+                conn.execute('SELECT 1')
+                self.assertTrue(not any(
+                    key.startswith('jsonapiquery') for key in conn.info))
+        self.assertTrue(current.counters['statements'] == 1)
+
+    def test_stream_bytes(self):
+        with trace() as current:
+            query = self.session.query(Person)
+            body = b''.join(stream_document(query, lambda models: []))
+        self.assertTrue(current.counters['bytes'] == len(body))
+        self.assertTrue(current.counters['rows'] == 3)
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=[1, 2])
+        for value in [0.5, 1, 1.5, 3]:
+            histogram.observe(value)
+
+        self.assertTrue(
+            histogram.cumulative() == [(1, 2), (2, 3), (float('inf'), 4)])
+        self.assertTrue(histogram.quantile(0.5) == 1)
+        self.assertTrue(histogram.sum == 6)
+
+    def test_render_prometheus(self):
+        sink = HistogramSink(buckets=[0.1])
+        with trace(sink):
+            with instrumentation.stage('parse'):
+                pass
+            instrumentation.incr('rows', 5)
+
+        text = render_prometheus(sink)
+        self.assertTrue('jsonapiquery_requests_total 1\n' in text)
+        self.assertTrue('# TYPE jsonapiquery_stage_seconds histogram' in text)
+        self.assertTrue(
+            'jsonapiquery_stage_seconds_bucket{stage="parse",le="0.1"} 1'
+            in text)
+        self.assertTrue(
+            'jsonapiquery_stage_seconds_bucket{stage="parse",le="+Inf"} 1'
+            in text)
+        self.assertTrue(
+            'jsonapiquery_stage_seconds_count{stage="parse"} 1' in text)
+        self.assertTrue('jsonapiquery_rows_total 5\n' in text)
@@ -0,0 +1,114 @@
+"""Test sampled request profiling."""
+from sqlalchemy.orm import Query, sessionmaker
+
+from jsonapiquery import instrumentation
+from jsonapiquery.database.sqlalchemy import QueryMixin
+from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
+from jsonapiquery.profiling import Profiler, ProfileStore
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.sqlalchemy import *
+
+import jsonapiquery
+import os
+import pstats
+import shutil
+import tempfile
+import tracemalloc
+
+
+class ProfilingTestCase(BaseSQLAlchemyTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        class BaseQuery(QueryMixin, Query):
+            pass
+
+        self.session = sessionmaker(bind=self.engine, query_cls=BaseQuery)()
+        self.session.begin_nested()
+        self.drivers = [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+        self.directory = tempfile.mkdtemp()
+        self.store = ProfileStore(max_profiles=2, directory=self.directory)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def request(self, profiler, headers=None):
+        params = {'filter[name]': 'ilike:r', 'sort': '-name'}
+        with profiler.profile(headers, url='/people') as recorder:
+            query = self.session.query(Person)
+            query, _ = jsonapiquery.filter_query(query, params, self.drivers)
+            query, _ = jsonapiquery.sort_query(query, params, self.drivers)
+            [str(i) for i in range(1000)]
+        return recorder
+
+    def test_unsampled(self):
+        profiler = Profiler(self.store)
+        self.assertTrue(self.request(profiler) is None)
+        self.assertTrue(len(self.store) == 0)
+
+    def test_header_sampled(self):
+        """Test a forced request is profiled per stage."""
+        profiler = Profiler(self.store, authorize=lambda headers: True)
+        recorder = self.request(profiler, {'HTTP_X_PROFILE': '1'})
+
+        profile = recorder.profile
+        self.assertTrue(self.store.get(profile.id) is profile)
+        self.assertTrue(profile.labels == {'url': '/people'})
+        for name in ['request', 'parse', 'resolve', 'build.filter']:
+            self.assertTrue(name in profile.stages, name)
+        self.assertTrue(profile.stages['resolve'].calls == 2)
+        self.assertTrue(profile.allocations)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertTrue(instrumentation.current_trace() is None)
+
+        # Nested stages are excluded from the "request" stage.
+        functions = [
+            row['function'] for row in profile.stages['request'].top(100)]
+        self.assertFalse(any('apply_filters' in row for row in functions))
+        functions = [
+            row['function']
+            for row in profile.stages['build.filter'].top(100)]
+        self.assertTrue(any('apply_filters' in row for row in functions))
+
+        path = os.path.join(self.directory, profile.id + '.parse.prof')
+        self.assertTrue(pstats.Stats(path).total_calls > 0)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, profile.id + '.json')))
+
+    def test_header_unauthorized(self):
+        """Test the header is ignored unless the request is authorized."""
+        headers = {'X-Profile': '1'}
+        self.assertFalse(Profiler(self.store).is_sampled(headers))
+        profiler = Profiler(self.store, authorize=lambda headers: False)
+        self.assertFalse(profiler.is_sampled(headers))
+
+    def test_header_min_interval(self):
+        """Test forced requests respect the minimum interval."""
+        profiler = Profiler(
+            self.store, min_interval=60, memory=False,
+            authorize=lambda headers: True)
+        self.assertTrue(self.request(profiler, {'X-Profile': '1'}) is not None)
+        self.assertTrue(self.request(profiler, {'X-Profile': '1'}) is None)
+
+    def test_one_at_a_time(self):
+        profiler = Profiler(self.store, rate=1)
+        with profiler.profile() as outer:
+            with profiler.profile() as inner:
+                pass
+        self.assertTrue(outer is not None)
+        self.assertTrue(inner is None)
+
+    def test_bounded_store(self):
+        profiler = Profiler(self.store, rate=1, memory=False)
+        recorders = [self.request(profiler) for _ in range(3)]
+
+        self.assertTrue(len(self.store) == 2)
+        self.assertTrue(self.store.list()[0] is recorders[-1].profile)
+        self.assertTrue(self.store.get(recorders[0].profile.id) is None)
+        self.assertFalse(any(
+            name.startswith(recorders[0].profile.id)
+            for name in os.listdir(self.directory)))
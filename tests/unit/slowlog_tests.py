@@ -0,0 +1,118 @@
+"""Test the slow request log."""
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Query, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from jsonapiquery.database.sqlalchemy import QueryMixin
+from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
+from jsonapiquery.slowlog import fingerprint_request, SlowRequestRecorder
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.sqlalchemy import *
+
+import json
+import jsonapiquery
+import os
+import tempfile
+
+
+class SlowRequestRecorderTestCase(BaseSQLAlchemyTestCase):
+
+    def setUp(self):
+        # Plans are fetched on a separate pooled connection.
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine(
+            'sqlite:///{}'.format(self.path), poolclass=QueuePool)
+        Base.metadata.create_all(self.engine)
+
+        class BaseQuery(QueryMixin, Query):
+            pass
+
+        self.session = sessionmaker(bind=self.engine, query_cls=BaseQuery)()
+        self.recorder = SlowRequestRecorder(
+            self.engine, threshold=0, explain_threshold=0)
+        self.drivers = [
+            DriverSchemaMarshmallow(PersonSchema()),
+            DriverModelSQLAlchemy(Person)]
+
+    def tearDown(self):
+        self.recorder.close()
+        self.session.close()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def parse(self, params):
+        query = self.session.query(Person)
+        query, filters = jsonapiquery.filter_query(query, params, self.drivers)
+        query, sorts = jsonapiquery.sort_query(query, params, self.drivers)
+        query, includes = jsonapiquery.include_query(
+            query, params, self.drivers)
+        query, paginators = jsonapiquery.paginate_query(query, params)
+        return query, (filters, sorts, includes, paginators)
+
+    def test_fingerprint_request(self):
+        """Test fingerprints exclude literal values."""
+        _, first = self.parse({
+            'filter[name]': 'ilike:fred', 'filter[student.school.title]': 'a',
+            'sort': '-age,name', 'include': 'student.school',
+            'page[limit]': '10', 'page[offset]': '20'})
+        _, second = self.parse({
+            'filter[student.school.title]': 'b', 'filter[name]': 'ilike:bob',
+            'sort': '-age,name', 'include': 'student.school',
+            'page[offset]': '0', 'page[limit]': '5'})
+
+        fingerprint = fingerprint_request(*first)
+        self.assertTrue(fingerprint == fingerprint_request(*second))
+        self.assertTrue(fingerprint == (
+            'filter=name:ilike,student.school.title:eq&sort=-age,name&'
+            'include=student.school&page=limit,offset'))
+
+    def test_record_request(self):
+        """Test statements and plans of a slow request are recorded."""
+        query, items = self.parse({'filter[name]': 'fred'})
+        with self.recorder.request(*items):
+            query.all()
+        with self.recorder.request(*items):
+            query.all()
+
+        profile = self.recorder.top()[0]
+        self.assertTrue(profile.fingerprint == 'filter=name:eq')
+        self.assertTrue(profile.count == 2)
+        statement = profile.statements[-1]
+        self.assertTrue(statement.statement.startswith('SELECT'))
+        self.assertTrue('SCAN' in str(statement.plan))
+        self.assertTrue(json.dumps(self.recorder.dump()))
+
+    def test_explain_error(self):
+        """Test a failing plan leaves the request's transaction usable."""
+        query, items = self.parse({})
+        with mock.patch.object(
+                SlowRequestRecorder, 'explain', side_effect=ValueError('x')):
+            with self.recorder.request(*items):
+                query.all()
+                self.session.add(Person(name='Fred'))
+                self.session.flush()
+        self.session.commit()
+
+        statement = self.recorder.top()[0].statements[0]
+        self.assertTrue(statement.plan == ['ValueError: x'])
+        self.assertTrue(self.session.query(Person).count() == 1)
+
+    def test_threshold(self):
+        self.recorder.threshold = 60
+        query, items = self.parse({})
+        with self.recorder.request(*items):
+            query.all()
+        self.assertTrue(self.recorder.dump() == [])
+
+    def test_max_fingerprints(self):
+        """Test the fingerprint with the least total time is discarded."""
+        self.recorder.max_fingerprints = 2
+        self.recorder.add('a', 3, [])
+        self.recorder.add('b', 1, [])
+        self.recorder.add('c', 2, [])
+
+        top = self.recorder.top()
+        self.assertTrue([item.fingerprint for item in top] == ['a', 'c'])
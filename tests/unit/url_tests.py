@@ -1,6 +1,7 @@
 from nose.tools import assert_raises
 
 from jsonapiquery import url
+from jsonapiquery.types import Sort
 from tests.unit import UnitTestCase
 
 
@@ -99,3 +100,53 @@ class URLTestCase(UnitTestCase):
         self.assertTrue(field[1] == 'b')
 
         assert_raises(StopIteration, next, fields)
+
+    def test_iter_facets(self):
+        params = {'meta[facets]': 'status,author.country,'}
+        facets = url.iter_facets(params)
+
+        facet = next(facets)
+        self.assertTrue(facet.source == 'meta[facets]')
+        self.assertTrue(facet.relationships == [])
+        self.assertTrue(facet.attribute == 'status')
+
+        facet = next(facets)
+        self.assertTrue(facet.relationships == ['author'])
+        self.assertTrue(facet.attribute == 'country')
+
+        # Assert skips empty facets.
+        assert_raises(StopIteration, next, facets)
+
+    def test_iter_include_limits(self):
+        params = {
+            'page[comments][limit]': '5', 'page[limit]': '10',
+            'page[author.articles][limit]': '2',
+            'sort[author.articles]': '-views'}
+        limits = sorted(
+            url.iter_include_limits(params), key=lambda limit: limit.source)
+
+        limit = limits[0]
+        self.assertTrue(limit.source == 'page[author.articles][limit]')
+        self.assertTrue(limit.relationships == ['author', 'articles'])
+        self.assertTrue(limit.limit == '2')
+        self.assertTrue(limit.sorts == [Sort(
+            'sort[author.articles]', ['author', 'articles'], 'views', '-')])
+
+        limit = limits[1]
+        self.assertTrue(limit.relationships == ['comments'])
+        self.assertTrue(limit.sorts == [])
+        self.assertTrue(len(limits) == 2)
+
+    def test_iter_counts(self):
+        params = {'meta[counts]': 'comments,,author.articles'}
+        counts = url.iter_counts(params)
+
+        count = next(counts)
+        self.assertTrue(count.source == 'meta[counts]')
+        self.assertTrue(count.relationships == ['comments'])
+
+        count = next(counts)
+        self.assertTrue(count.relationships == ['author', 'articles'])
+
+        # Assert skips empty counts.
+        assert_raises(StopIteration, next, counts)
@@ -0,0 +1,117 @@
+"""Test statement fingerprinting and N+1 detection."""
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from nose.tools import assert_raises
+
+from jsonapiquery.drivers import DriverModelSQLAlchemy, DriverSchemaMarshmallow
+from jsonapiquery.drivers.model.sqlalchemy import Mapper
+from jsonapiquery.types import Include
+from jsonapiquery.utils import (
+    fingerprint_statement, NPlusOneDetector, NPlusOneError, NPlusOneWarning)
+from tests.marshmallow_jsonapi import Person as PersonSchema
+from tests.sqlalchemy import *
+
+import jsonapiquery
+import threading
+import warnings
+
+
+class FingerprintTestCase(BaseSQLAlchemyTestCase):
+
+    def test_fingerprint_literals(self):
+        """Test literals, placeholders and IN lists are normalized."""
+        first = fingerprint_statement(
+            "SELECT t1.id FROM t1 WHERE t1.name = 'O''Neil' AND t1.id IN "
+            "(1, 2, 3)\n LIMIT 10")
+        second = fingerprint_statement(
+            "SELECT t1.id FROM t1 WHERE t1.name = :name_1 AND t1.id IN "
+            "(%(id_1)s, %(id_2)s) LIMIT ?")
+        self.assertTrue(first == second)
+        self.assertTrue(
+            first == 'SELECT t1.id FROM t1 WHERE t1.name = ? AND t1.id IN '
+                     '(?) LIMIT ?')
+
+    def test_fingerprint_identifiers(self):
+        """Test identifiers and casts are preserved."""
+        self.assertTrue(
+            fingerprint_statement('SELECT anon_1.x::integer FROM anon_1') ==
+            'SELECT anon_1.x::integer FROM anon_1')
+
+
+class NPlusOneDetectorTestCase(BaseSQLAlchemyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.people = [Person(name=str(i), student=[Student()]) for i in range(4)]
+        self.session.add_all(self.people)
+        self.session.commit()
+        self.session.expire_all()
+        self.people = self.session.query(Person).all()
+
+    def include(self, name):
+        include = Include('include', [name])
+        for driver in [
+                DriverSchemaMarshmallow(PersonSchema()),
+                DriverModelSQLAlchemy(Person)]:
+            include = driver.parse(include)
+        return include
+
+    def test_detect_lazy_loads(self):
+        """Test repeated lazy loads are reported."""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with NPlusOneDetector(self.session.bind, threshold=3) as detector:
+                for person in self.people:
+                    person.student
+
+        self.assertTrue(len(detector.detections) == 1)
+        self.assertTrue(detector.detections[0].count == 4)
+        self.assertTrue(detector.detections[0].include is None)
+        self.assertTrue(caught[0].category is NPlusOneWarning)
+
+    def test_detect_include(self):
+        """Test detections are tied to the include being loaded."""
+        include = self.include('student')
+        detector = NPlusOneDetector(self.session.bind, 3, action='raise')
+        with mock.patch.object(Mapper, 'load'):
+            with assert_raises(NPlusOneError):
+                with detector:
+                    jsonapiquery.serialize_includes([include], self.people)
+
+        detection = detector.detections[0]
+        self.assertTrue(detection.include == 'student')
+        self.assertTrue(detection.relationship.attribute_name == 'student')
+
+    def test_batched_include(self):
+        """Test batch loaded includes are not reported."""
+        include = self.include('student')
+        with NPlusOneDetector(self.session.bind, 1, 'raise') as detector:
+            jsonapiquery.serialize_includes([include], self.people)
+        self.assertTrue(detector.detections == [])
+
+    def test_shared_detector(self):
+        """Test one detector entered from several threads at once."""
+        engine = self.session.bind
+        detector = NPlusOneDetector(engine, threshold=2, action='raise')
+        barrier = threading.Barrier(4)
+
+        def run(count):
+            with detector:
+                barrier.wait()
+                with engine.connect() as conn:
+                    for _ in range(count):
+                        conn.execute('SELECT 1')
+
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(run, count) for count in [1, 2, 2, 3]]
+        errors = [future.exception() for future in futures]
+        self.assertTrue(
+            [isinstance(error, NPlusOneError) for error in errors] ==
+            [False, False, False, True])
+
+    def test_sample_rate(self):
+        with NPlusOneDetector(self.session.bind, 0, sample_rate=0) as detector:
+            self.people[0].student
+        self.assertFalse(detector.is_sampled)
+        self.assertTrue(detector.detections == [])